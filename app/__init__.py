@@ -4,6 +4,15 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 
 from config import config
+from .activity import ActivityLogWriter
+from .archive import LogArchive
+from .bloom import ShortCodeFilter
+from .cache import ResolveCache, TokenCache, UserAgentCache
+from .codes import CodeAllocator
+from .counters import VisitCounter
+from .geoip import GeoIP
+from .metrics import Metrics
+from .querystats import QueryCounter
 
 
 bootstrap = Bootstrap()
@@ -12,6 +21,17 @@ login_manager = LoginManager()
 login_manager.session_protection = 'strong'
 login_manager.login_message = u'Please login.'
 login_manager.login_view = 'auth.login'
+resolve_cache = ResolveCache()
+token_cache = TokenCache()
+user_agent_cache = UserAgentCache()
+visit_counter = VisitCounter()
+activity_log_writer = ActivityLogWriter()
+code_allocator = CodeAllocator()
+geoip = GeoIP()
+log_archive = LogArchive()
+short_code_filter = ShortCodeFilter()
+query_counter = QueryCounter()
+metrics = Metrics()
 
 
 def create_app(config_name):
@@ -20,6 +40,17 @@ def create_app(config_name):
     config[config_name].__init__(app)
     db.init_app(app)
     bootstrap.init_app(app)
+    query_counter.init_app(app)
+    metrics.init_app(app)
+    resolve_cache.init_app(app)
+    token_cache.init_app(app)
+    user_agent_cache.init_app(app)
+    visit_counter.init_app(app)
+    geoip.init_app(app)
+    activity_log_writer.init_app(app)
+    log_archive.init_app(app)
+    code_allocator.init_app(app)
+    short_code_filter.init_app(app)
     from .main import main as main_blueprint
     from .auth import auth as auth_blueprint
     from .api import api as api_blueprint
@@ -27,4 +58,7 @@ def create_app(config_name):
     app.register_blueprint(auth_blueprint, url_prefix='/auth')
     app.register_blueprint(api_blueprint, url_prefix='/api/v1')
     login_manager.init_app(app)
+    if app.config['REDIRECT_FAST_PATH']:
+        from .fastpath import RedirectMiddleware
+        app.wsgi_app = RedirectMiddleware(app)
     return app
@@ -0,0 +1,302 @@
+"""Asynchronous, batched ingestion of the visit activity logs.
+
+Redirects only append their log row to a bounded in-process queue, a
+background writer thread takes rows off the queue and bulk inserts them with
+a single executemany per batch. The visit rollups are updated in the same
+transaction.
+
+Logs are stored compactly: addresses as their packed 4 or 16 bytes, and
+browser and platform names as ids into lookup tables. The writer keeps the
+ids of the names it has seen in memory, so only names new to the process
+are looked up or inserted. When a GeoIP range table is configured, the
+writer also fills in the location of every address.
+"""
+import atexit
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from app.geoip import Location
+from app.rollups import update_rollups, update_sketches
+
+OVERFLOW_POLICIES = ('block', 'drop-oldest', 'sample')
+EMPTY_LOCATION = (None,) * len(Location._fields)
+
+
+class InternCache(object):
+    """Map names to the ids of their rows in a lookup table."""
+
+    def __init__(self, table, limit):
+        """Create an empty cache of the ids of the names in table."""
+        self.table = table
+        self.limit = limit
+        self.length = table.c.name.type.length
+        self.ids = {}
+        self.hits = 0
+        self.misses = 0
+
+    def intern(self, engine, names):
+        """Return the ids of names, inserting the names not stored yet.
+
+        Names longer than the name column are stored truncated, None has no
+        id.
+        """
+        if len(self.ids) > self.limit:
+            self.ids.clear()
+        stored = {name: name[:self.length] for name in set(names)
+                  if name is not None}
+        missing = set(stored.values()) - set(self.ids)
+        self.hits += len(stored) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            with engine.connect() as connection:
+                self._load(connection, missing)
+                for name in sorted(missing - set(self.ids)):
+                    try:
+                        connection.execute(self.table.insert().values(
+                            name=name))
+                    except IntegrityError:
+                        # Another writer interned the name first.
+                        pass
+                self._load(connection, missing - set(self.ids))
+        return {name: self.ids[value] for name, value in stored.items()}
+
+    def _load(self, connection, names):
+        if names:
+            self.ids.update(connection.execute(
+                select([self.table.c.name, self.table.c.id]).where(
+                    self.table.c.name.in_(names))).fetchall())
+
+
+class LogQueue(object):
+    """Buffer the activity log rows of an app and write them in batches."""
+
+    def __init__(self, app):
+        """Configure the queue from the app configuration."""
+        self.app = app
+        self.asynchronous = app.config['ACTIVITY_LOG_ASYNC']
+        self.maxsize = app.config['ACTIVITY_LOG_QUEUE_SIZE']
+        self.batch_size = app.config['ACTIVITY_LOG_BATCH_SIZE']
+        self.linger = app.config['ACTIVITY_LOG_LINGER']
+        self.overflow = app.config['ACTIVITY_LOG_OVERFLOW']
+        self.sample_rate = app.config['ACTIVITY_LOG_SAMPLE_RATE']
+        self.intern_cache_size = app.config['ACTIVITY_LOG_INTERN_CACHE_SIZE']
+        if self.overflow not in OVERFLOW_POLICIES:
+            raise ValueError('ACTIVITY_LOG_OVERFLOW must be one of %s.'
+                             % ', '.join(OVERFLOW_POLICIES))
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self._rows = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._stopping = False
+        self._thread = None
+        self._browsers = None
+        self._platforms = None
+
+    def put(self, row):
+        """Queue a log row, applying the overflow policy when full."""
+        if not self.asynchronous:
+            self.write([row])
+            return
+        if self._thread is None:
+            self.start()
+        with self._lock:
+            if not self._admit():
+                self.dropped += 1
+                return
+            self._rows.append(row)
+            self.enqueued += 1
+            if len(self._rows) >= self.batch_size:
+                self._not_empty.notify()
+
+    def _admit(self):
+        """Make room for a row, return False if it has to be dropped.
+
+        Must be called with the lock held. The sample policy starts admitting
+        only a sample_rate fraction of rows once the queue is half full and
+        drops every row once it is full.
+        """
+        if self.overflow == 'block':
+            while len(self._rows) >= self.maxsize and not self._stopping:
+                self._not_full.wait()
+            return True
+        if self.overflow == 'drop-oldest':
+            while len(self._rows) >= self.maxsize:
+                self._rows.popleft()
+                self.dropped += 1
+            return True
+        if len(self._rows) >= self.maxsize:
+            return False
+        if len(self._rows) >= self.maxsize // 2:
+            return random.random() < self.sample_rate
+        return True
+
+    def take(self):
+        """Wait for the next batch and return it.
+
+        A batch is returned as soon as batch_size rows are queued or linger
+        seconds after the first row of the batch was seen.
+        """
+        with self._lock:
+            while not self._rows and not self._stopping:
+                self._not_empty.wait()
+            deadline = time.monotonic() + self.linger
+            while len(self._rows) < self.batch_size and not self._stopping:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._not_empty.wait(remaining)
+            batch = [self._rows.popleft() for _ in
+                     range(min(self.batch_size, len(self._rows)))]
+            self._not_full.notify_all()
+            return batch
+
+    def encode(self, engine, rows):
+        """Return rows as stored in the activity_logs table.
+
+        The address is packed and located, and the browser and platform
+        names are replaced by the ids of their interned rows.
+        """
+        from app.models import UserAgentBrowser, UserAgentPlatform, pack_ip
+
+        if self._browsers is None:
+            self._browsers = InternCache(UserAgentBrowser.__table__,
+                                         self.intern_cache_size)
+            self._platforms = InternCache(UserAgentPlatform.__table__,
+                                          self.intern_cache_size)
+        browsers = self._browsers.intern(
+            engine, (row.get('browser') for row in rows))
+        platforms = self._platforms.intern(
+            engine, (row.get('platform') for row in rows))
+        geoip = self.app.extensions['geoip']
+        stored_rows = []
+        for row in rows:
+            stored = dict(row)
+            location = geoip.locate(stored.get('ip'))
+            stored.update(zip(Location._fields, location or EMPTY_LOCATION))
+            stored['packed_ip'] = pack_ip(stored.pop('ip', None))
+            stored['browser_id'] = browsers.get(stored.pop('browser', None))
+            stored['platform_id'] = platforms.get(
+                stored.pop('platform', None))
+            stored_rows.append(stored)
+        return stored_rows
+
+    def write(self, rows):
+        """Bulk insert rows into the activity_logs table.
+
+        The rollups and visitor sketches of the rows are updated in the same
+        transaction.
+        """
+        from app import db
+        from app.models import UrlActivityLogs
+
+        engine = db.get_engine(self.app)
+        stored_rows = self.encode(engine, rows)
+        try:
+            with engine.begin() as connection:
+                connection.execute(UrlActivityLogs.__table__.insert(),
+                                   stored_rows)
+                update_rollups(connection, rows)
+                update_sketches(connection, rows)
+        except IntegrityError:
+            # Another writer inserted one of the rollup rows first, this
+            # time it is updated instead.
+            with engine.begin() as connection:
+                connection.execute(UrlActivityLogs.__table__.insert(),
+                                   stored_rows)
+                update_rollups(connection, rows)
+                update_sketches(connection, rows)
+        self.written += len(rows)
+        self.batches += 1
+
+    def start(self):
+        """Start the background writer thread."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run,
+                                            name='activity-log-writer')
+            self._thread.daemon = True
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the writer thread once every queued row is written."""
+        with self._lock:
+            self._stopping = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                batch = self.take()
+                if not batch:
+                    if self._stopping:
+                        return
+                    continue
+                try:
+                    self.write(batch)
+                except Exception:
+                    self.failed += len(batch)
+                    self.app.logger.exception(
+                        'Writing %d activity logs failed.' % len(batch))
+
+    def depth(self):
+        """Return the number of rows waiting to be written."""
+        return len(self._rows)
+
+    def stats(self):
+        """Return the counters used to tune the queue."""
+        return {'depth': self.depth(), 'maxsize': self.maxsize,
+                'enqueued': self.enqueued, 'written': self.written,
+                'dropped': self.dropped, 'failed': self.failed,
+                'batches': self.batches,
+                'intern_hits': sum(cache.hits for cache in self._caches()),
+                'intern_misses': sum(cache.misses
+                                     for cache in self._caches())}
+
+    def _caches(self):
+        return [cache for cache in (self._browsers, self._platforms)
+                if cache is not None]
+
+
+class ActivityLogWriter(object):
+    """Record visits of short_urls off the redirect critical path."""
+
+    def __init__(self, app=None):
+        """Initialize the extension, optionally binding it to app."""
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Create the log queue of app."""
+        app.extensions['activity_log_writer'] = LogQueue(app)
+
+    @property
+    def queue(self):
+        """Return the log queue of the current app."""
+        return current_app.extensions['activity_log_writer']
+
+    def record(self, short_url_id, ip, browser, platform):
+        """Queue the log of a visit to a short_url."""
+        self.queue.put({'short_url_id': short_url_id, 'ip': ip,
+                        'browser': browser, 'platform': platform,
+                        'visited_at': datetime.utcnow()})
+
+    def stats(self):
+        """Return the queue depth and drop counters of the current app."""
+        return self.queue.stats()
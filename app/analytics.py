@@ -0,0 +1,97 @@
+"""Breakdowns of the visits to a short_url or to all of a user's short_urls.
+
+The platforms, browsers and countries of the visitors and the hour of the
+day of their visits are counted with GROUP BY queries over the range of
+activity logs, so the database returns a few dozen totals instead of every
+log row. Platforms and browsers are grouped on their interned ids and only
+the names of the top ones are looked up.
+"""
+from sqlalchemy import Integer, and_, cast, extract, func, select
+
+from app.rollups import UNKNOWN
+
+HOURS = 24
+
+
+def hour_of_day(column, dialect):
+    """Return an expression for the hour of a datetime column."""
+    if dialect == 'sqlite':
+        return cast(func.strftime('%H', column), Integer)
+    return cast(extract('hour', column), Integer)
+
+
+def log_filter(start, end, short_url_id=None, user_id=None):
+    """Return the condition selecting the logs of a breakdown.
+
+    The logs are those of a short_url, or of every short_url of a user,
+    visited from start on and before end.
+    """
+    from app.models import ShortUrl, UrlActivityLogs
+
+    logs = UrlActivityLogs.__table__
+    if short_url_id is not None:
+        owner = logs.c.short_url_id == short_url_id
+    else:
+        short_urls = ShortUrl.__table__
+        owner = logs.c.short_url_id.in_(select([short_urls.c.id]).where(
+            short_urls.c.user_id == user_id))
+    return and_(owner, logs.c.visited_at >= start, logs.c.visited_at < end)
+
+
+def counts(column, condition, limit=None):
+    """Return (value, visits) pairs of the logs grouped on column.
+
+    The pairs are sorted on the number of visits, the limit first only.
+    """
+    from app import db
+    from app.models import UrlActivityLogs
+
+    visits = func.count()
+    query = select([column, visits]).select_from(
+        UrlActivityLogs.__table__).where(condition).group_by(
+        column).order_by(visits.desc(), column)
+    if limit:
+        query = query.limit(limit)
+    return db.session.execute(query).fetchall()
+
+
+def named_counts(column, names_table, condition, limit):
+    """Return the top names of an interned column and their visits."""
+    from app import db
+
+    rows = counts(column, condition, limit)
+    ids = [value for value, _ in rows if value is not None]
+    names = dict(db.session.execute(
+        select([names_table.c.id, names_table.c.name]).where(
+            names_table.c.id.in_(ids))).fetchall()) if ids else {}
+    return [{'name': names.get(value, UNKNOWN), 'visits': visits}
+            for value, visits in rows]
+
+
+def breakdown(start, end, limit, short_url_id=None, user_id=None):
+    """Return the visits of a short_url or user between start and end.
+
+    The limit most frequent platforms, browsers and countries are listed
+    with their visits, and the visits are counted per hour of the day.
+    """
+    from app import db
+    from app.models import (UrlActivityLogs, UserAgentBrowser,
+                            UserAgentPlatform)
+
+    logs = UrlActivityLogs.__table__
+    condition = log_filter(start, end, short_url_id, user_id)
+    hours = [0] * HOURS
+    hour = hour_of_day(logs.c.visited_at, db.engine.dialect.name)
+    for value, visits in counts(hour, condition):
+        hours[value] = visits
+    return {'total': sum(hours),
+            'platforms': named_counts(logs.c.platform_id,
+                                      UserAgentPlatform.__table__,
+                                      condition, limit),
+            'browsers': named_counts(logs.c.browser_id,
+                                     UserAgentBrowser.__table__,
+                                     condition, limit),
+            'countries': [{'name': value or UNKNOWN, 'visits': visits}
+                          for value, visits in counts(
+                              logs.c.country_name, condition, limit)],
+            'hours': hours}
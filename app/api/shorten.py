@@ -4,16 +4,29 @@ The module is for all endpoints that manages all services related
 to url shortening.
 """
 
-from flask import abort, current_app, g, jsonify, redirect, request
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+from flask import (Response, abort, current_app, g, jsonify, redirect,
+                   request, stream_with_context)
 from werkzeug.exceptions import BadRequest
 from voluptuous import MultipleInvalid
 
-from app import db
+from app import db, log_archive, resolve_cache, visit_counter
+from app.analytics import breakdown
 from app.api import api
 from app.api.validators import valid_url
 from app.api.auth import auth
 from app.helper import UrlSaver
-from app.models import LongUrl, ShortUrl, User
+from app.models import LongUrl, ShortUrl, UrlActivityLogs, User, unpack_ip
+from app.pagination import InvalidCursor
+from app.rollups import (GRANULARITIES, bucket_size, unique_visitors,
+                         visit_stats)
+
+LOG_FIELDS = ('I.P Address', 'User agent', 'System platform', 'Visited at')
+LOG_FORMATS = ('json', 'ndjson', 'csv')
 
 
 def check_authentication_with_token():
@@ -22,6 +35,95 @@ def check_authentication_with_token():
         abort(403)
 
 
+def get_own_short_url(id, include_deleted=True):
+    """Return a short_url of the current user or abort with a 404."""
+    short_url = ShortUrl.find_owned(id, g.current_user.id, include_deleted)
+    if short_url is None:
+        abort(404, "You do not have any such URL.")
+    return short_url
+
+
+def get_time_argument(name, default):
+    """Return a UTC time passed as an ISO 8601 date or date and time."""
+    value = request.args.get(name)
+    if not value:
+        return default
+    for time_format in ('%Y-%m-%d', '%Y-%m-%dT%H:%M', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return datetime.strptime(value, time_format)
+        except ValueError:
+            pass
+    abort(400, "%s must be an ISO 8601 date or date and time." % name)
+
+
+def get_limit():
+    """Return the number of rows a listing request asks for."""
+    max_limit = current_app.config['URL_LIST_MAX_PAGE_SIZE']
+    try:
+        limit = int(request.args.get(
+            'limit', current_app.config['URL_LIST_PAGE_SIZE']))
+    except ValueError:
+        limit = 0
+    if not 0 < limit <= max_limit:
+        abort(400, "limit must be a number between 1 and %d." % max_limit)
+    return limit
+
+
+def get_breakdown_arguments():
+    """Return the time range and the number of top values of a breakdown.
+
+    The range defaults to the BREAKDOWN_DEFAULT_DAYS days before now.
+    """
+    end = get_time_argument('to', datetime.utcnow())
+    start = get_time_argument('from', end - timedelta(
+        days=current_app.config['BREAKDOWN_DEFAULT_DAYS']))
+    if start >= end:
+        abort(400, "from must be before to.")
+    max_top = current_app.config['BREAKDOWN_MAX_TOP']
+    try:
+        top = int(request.args.get('top', current_app.config['BREAKDOWN_TOP']))
+    except ValueError:
+        top = 0
+    if not 0 < top <= max_top:
+        abort(400, "top must be a number between 1 and %d." % max_top)
+    return start, end, top
+
+
+def get_flag(name):
+    """Return whether a boolean argument of the request is set."""
+    return request.args.get(name, '').lower() in ('1', 'true', 'yes')
+
+
+def get_page_arguments():
+    """Return the limit and the after cursor of a listing request."""
+    return get_limit(), request.args.get('after')
+
+
+def log_details(log):
+    """Return the details of a visit shown to the owner of the short_url."""
+    return dict(zip(LOG_FIELDS, (
+        unpack_ip(log.packed_ip), log.browser, log.platform,
+        log.visited_at.isoformat() if log.visited_at else None)))
+
+
+def export_logs(chunks, log_format):
+    """Yield the text of logs read a chunk at a time as NDJSON or CSV."""
+    if log_format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, LOG_FIELDS)
+        writer.writeheader()
+        for logs in chunks:
+            writer.writerows(log_details(log) for log in logs)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+    else:
+        for logs in chunks:
+            yield ''.join(json.dumps(log_details(log)) + '\n'
+                          for log in logs)
+
+
 @api.route('/shorten', methods=['POST'], strict_slashes=False)
 @auth.login_required
 def shorten_url():
@@ -55,6 +157,53 @@ def shorten_url():
                     'short_url': site_url + short_url.url}), 201
 
 
+@api.route('/shorten/batch', methods=['POST'], strict_slashes=False)
+@auth.login_required
+def shorten_urls_in_batch():
+    """An endpoint which shortens an array of long urls at once.
+
+    Every item is validated up front, the valid ones are saved in a single
+    transaction and the response lists a result or an error per item, in
+    the order of the request.
+    """
+    check_authentication_with_token()
+
+    try:
+        items = request.json
+    except BadRequest:
+        abort(400, "The request does not contain a body.")
+    if not isinstance(items, list) or not items:
+        abort(400, "The request body must be a non empty array.")
+    limit = current_app.config['SHORTEN_BATCH_LIMIT']
+    if len(items) > limit:
+        abort(400, "A batch can hold at most %d URLs." % limit)
+
+    results, valid = [None] * len(items), []
+    for index, item in enumerate(items):
+        try:
+            valid_url(item)
+        except MultipleInvalid as e:
+            results[index] = {'error': e.msg}
+            continue
+        vanity_string = None
+        if not g.current_user.is_anonymous:
+            vanity_string = item.get('vanity_string')
+        valid.append((index, item['url'], vanity_string))
+
+    site_url = current_app.config['SITE_URL']
+    saved = UrlSaver.bulk_generate_and_save_urls(
+        [(url, vanity_string) for _, url, vanity_string in valid],
+        g.current_user)
+    for (index, _, _), short_url in zip(valid, saved):
+        if isinstance(short_url, str):
+            results[index] = {'error': short_url}
+        else:
+            results[index] = {'id': short_url.id,
+                              'short_url': site_url + short_url.url,
+                              'created': short_url.created}
+    return jsonify({'results': results}), 200
+
+
 @api.route('/<shorturl>', strict_slashes=False)
 def get_url(shorturl):
     """Redirect short_urls to their long_url version.
@@ -69,7 +218,7 @@ def get_url(shorturl):
     elif short_url and not short_url.is_active:
         abort(400, "URL is inactive.")
     elif short_url and short_url.is_active:
-        return redirect(short_url.long_url.url, code=302)
+        return redirect(short_url.long_url, code=302)
     else:
         abort(404)
 
@@ -88,11 +237,7 @@ def change_long_url(id):
     except BadRequest:
         abort(400, "The request does not contain a body.")
 
-    try:
-        short_url = [short_url for short_url in g.current_user.short_urls
-                     if short_url.id == id and not short_url.deleted][0]
-    except IndexError:
-        abort(404, "You do not have any such URL.")
+    short_url = get_own_short_url(id, include_deleted=False)
 
     long_url = request.json.get('url')
     site_url = current_app.config['SITE_URL']
@@ -115,8 +260,10 @@ def get_user_short_urls():
     site_url = current_app.config['SITE_URL']
     if not short_url:
         abort(404, "You are yet to shorten any URL.")
+    visits = visit_counter.totals(short_url)
     return jsonify({'short_url list':
-                    [{'date_added': x.date_created, 'times_visted': x.no_of_visits,
+                    [{'date_added': x.date_created,
+                      'times_visted': visits[x.id],
                       'is_active': x.is_active,
                       'short_url': site_url + x.url}
                         for x in short_url]}), 200
@@ -125,41 +272,112 @@ def get_user_short_urls():
 @api.route('/shorturl/<int:id>/logs', strict_slashes=False)
 @auth.login_required
 def get_short_url_visit_log(id):
-    """Get log details of visits to a particular short_url."""
+    """Get log details of visits to a particular short_url.
+
+    The logs are returned latest first a page at a time, optionally only
+    those visited from and before to. With format ndjson or csv every log in
+    the range is streamed instead, read VISIT_LOG_EXPORT_CHUNK_SIZE at a
+    time. With archived true the logs moved to the archive are read instead.
+    """
     check_authentication_with_token()
 
+    short_url = get_own_short_url(id)
+    log_format = request.args.get('format', 'json')
+    if log_format not in LOG_FORMATS:
+        abort(400, "format must be one of %s." % ', '.join(LOG_FORMATS))
+    start = get_time_argument('from', None)
+    end = get_time_argument('to', None)
+    archived = get_flag('archived')
+    source = log_archive if archived else UrlActivityLogs
+    if log_format != 'json':
+        chunks = source.chunks_of_visits(
+            short_url.id, current_app.config['VISIT_LOG_EXPORT_CHUNK_SIZE'],
+            start, end)
+        return Response(
+            stream_with_context(export_logs(chunks, log_format)),
+            mimetype=('text/csv' if log_format == 'csv'
+                      else 'application/x-ndjson'), headers={
+                'Content-Disposition': 'attachment; filename=%s-logs.%s' % (
+                    short_url.url, log_format)})
+    limit, after = get_page_arguments()
     try:
-        logs = [short_url for short_url in g.current_user.short_urls
-                if short_url.id == id][0].logs
-    except IndexError:
-        abort(404, "You do not have any such URL.")
-    if logs:
-        return jsonify({'short_url logs':
-                        [{'I.P Address': x.ip, 'User agent': x.browser,
-                          'System platform': x.platform} for x in logs]}), 200
+        logs, next_cursor = source.page_of_visits(
+            short_url.id, limit, after, start, end)
+    except InvalidCursor:
+        abort(400, "Invalid cursor.")
+    if logs or after or start or end or archived:
+        return jsonify({'short_url logs': [log_details(x) for x in logs],
+                        'next': next_cursor}), 200
     else:
         return jsonify({'message': 'This URL has never been visited or unable'
                         ' to record any details.'}), 404
 
 
+@api.route('/shorturl/<int:id>/stats', strict_slashes=False)
+@auth.login_required
+def get_short_url_stats(id):
+    """Get the visits to a short_url per hour or day in a time range.
+
+    The visits are read from the rollup tables, from defaults to
+    VISIT_STATS_DEFAULT_BUCKETS buckets before to, which defaults to now.
+    """
+    check_authentication_with_token()
+
+    short_url = get_own_short_url(id)
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in GRANULARITIES:
+        abort(400, "granularity must be one of %s." % ', '.join(GRANULARITIES))
+    size = bucket_size(granularity)
+    end = get_time_argument('to', datetime.utcnow())
+    start = get_time_argument('from', end - size * current_app.config[
+        'VISIT_STATS_DEFAULT_BUCKETS'])
+    if start >= end:
+        abort(400, "from must be before to.")
+    if (end - start) / size > current_app.config['VISIT_STATS_MAX_BUCKETS']:
+        abort(400, "The time range holds more than %d buckets." %
+              current_app.config['VISIT_STATS_MAX_BUCKETS'])
+    stats = visit_stats(short_url.id, start, end, granularity)
+    stats.update({'short_url': current_app.config['SITE_URL'] + short_url.url,
+                  'granularity': granularity, 'from': start.isoformat(),
+                  'to': end.isoformat()})
+    return jsonify(stats), 200
+
+
+@api.route('/shorturl/<int:id>/breakdown', strict_slashes=False)
+@auth.login_required
+def get_short_url_breakdown(id):
+    """Get the top platforms, browsers and countries visiting a short_url.
+
+    The visits in the time range are also counted per hour of the day, in
+    UTC.
+    """
+    check_authentication_with_token()
+
+    short_url = get_own_short_url(id)
+    start, end, top = get_breakdown_arguments()
+    visits = breakdown(start, end, top, short_url_id=short_url.id)
+    visits.update({'short_url': current_app.config['SITE_URL'] +
+                   short_url.url, 'from': start.isoformat(),
+                   'to': end.isoformat()})
+    return jsonify(visits), 200
+
+
 @api.route('/shorturl/<int:id>', strict_slashes=False)
 @auth.login_required
 def get_short_url(id):
     """Get the details of a short_url."""
     check_authentication_with_token()
 
-    try:
-        short_url = [short_url for short_url in g.current_user.short_urls
-                     if short_url.id == id][0]
-    except IndexError:
-        abort(404, "You do not have any such URL.")
+    short_url = get_own_short_url(id)
     site_url = current_app.config['SITE_URL']
 
     return jsonify({'short_url': site_url + short_url.url,
-                    'times_visted': short_url.no_of_visits,
+                    'times_visted': visit_counter.totals(
+                        [short_url])[short_url.id],
                     'long_url': short_url.long_url.url,
                     'date added': short_url.date_created,
-                    'active status': short_url.is_active}), 200
+                    'active status': short_url.is_active,
+                    'unique visitors': unique_visitors(short_url.id)}), 200
 
 
 @api.route('/short_url/<int:id>/deactivate', methods=['PUT'],
@@ -171,11 +389,7 @@ def toggle_is_active(id):
     """Deactivate or activate a users short_url."""
     check_authentication_with_token()
 
-    try:
-        short_url = [short_url for short_url in g.current_user.short_urls
-                     if short_url.id == id][0]
-    except IndexError:
-        abort(404, "You do not have any such URL.")
+    short_url = get_own_short_url(id)
 
     if short_url.is_active and request.url.endswith('deactivate'):
         short_url.is_active = False
@@ -189,20 +403,31 @@ def toggle_is_active(id):
               " activated or deactivate a URL that is already deactivated.")
 
     db.session.commit()
+    resolve_cache.invalidate(short_url.url)
     return jsonify({'message': output}), 200
 
 
 @api.route('/users/influential', strict_slashes=False)
 @auth.login_required
 def get_influential_users():
-    """Get a list of influential users and the number of URLs shortened."""
+    """Get a list of influential users and the number of URLs shortened.
+
+    The users are read a page at a time with the limit and offset arguments,
+    the AnonymousUser is only listed if include_anonymous is true.
+    """
     check_authentication_with_token()
-    users = User.query.all()
-    sorted_users = sorted(users, key=lambda user: len(user.short_urls),
-                          reverse=True)
+    limit = get_limit()
+    try:
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        offset = -1
+    if offset < 0:
+        abort(400, "offset must be a number greater than or equal to 0.")
+    include_anonymous = get_flag('include_anonymous')
+    users = User.sort_users_by_short_urls(limit, offset, include_anonymous)
     return jsonify({'users_list': [{'Name': x.first_name + " " + x.last_name,
-                                    'No of URLs shortened': len(list(
-                                     x.short_urls))} for x in sorted_users]})
+                                    'No of URLs shortened': x.short_url_count}
+                                   for x in users]})
 
 
 @api.route('/user', strict_slashes=False)
@@ -218,23 +443,45 @@ def get_user_details():
                                 g.current_user.short_urls))}), 200
 
 
+@api.route('/user/breakdown', strict_slashes=False)
+@auth.login_required
+def get_user_breakdown():
+    """Get the top platforms, browsers and countries visiting a user's URLs.
+
+    The visits to every short_url of the current user are counted.
+    """
+    check_authentication_with_token()
+
+    start, end, top = get_breakdown_arguments()
+    visits = breakdown(start, end, top, user_id=g.current_user.id)
+    visits.update({'from': start.isoformat(), 'to': end.isoformat()})
+    return jsonify(visits), 200
+
+
 @api.route('/<string:url_type>/<string:sort_type>', strict_slashes=False)
 @auth.login_required
 def sort_urls(url_type, sort_type):
-    """Return short_urls based popularity and recently added."""
+    """Return short_urls based popularity and recently added.
+
+    The listing is returned a page at a time, the next page is requested by
+    passing the returned next cursor as the after argument.
+    """
     check_authentication_with_token()
 
     if sort_type == 'popularity' and url_type == 'shorturl':
-        shorturl_list = ShortUrl.sort_shorturl_by_popularity()
-        return jsonify({'url_list': shorturl_list}), 200
+        sort = ShortUrl.sort_shorturl_by_popularity
     elif sort_type == 'popularity' and url_type == 'longurl':
-        longurl_list = LongUrl.sort_longurl_by_popularity()
-        return jsonify({'url_list': longurl_list}), 200
+        sort = LongUrl.sort_longurl_by_popularity
     elif sort_type == 'date' and url_type == 'shorturl':
-        shorturl_list = ShortUrl.sort_short_url_by_date_added()
-        return jsonify({'url_list': shorturl_list}), 200
+        sort = ShortUrl.sort_short_url_by_date_added
     else:
         abort(400, "Invalid endpoint.")
+    limit, after = get_page_arguments()
+    try:
+        url_list, next_cursor = sort(limit, after)
+    except InvalidCursor:
+        abort(400, "Invalid cursor.")
+    return jsonify({'url_list': url_list, 'next': next_cursor}), 200
 
 
 @api.route('/short_url/<int:id>/delete', methods=['DELETE'],
@@ -244,13 +491,11 @@ def delete_urls(id):
     """Set short_url delete column to True."""
     check_authentication_with_token()
 
-    try:
-        short_url = [short_url for short_url in g.current_user.short_urls
-                     if short_url.id == id][0]
-    except IndexError:
-        abort(404, "You do not have any such URL.")
+    short_url = get_own_short_url(id)
     if short_url.deleted:
         abort(404, "This URL has been deleted.")
     short_url.deleted = True
+    g.current_user.count_short_urls(-1)
     db.session.commit()
+    resolve_cache.invalidate(short_url.url)
     return jsonify({'message': 'Deletion successful.'})
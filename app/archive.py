@@ -0,0 +1,294 @@
+"""Retention, archival and downsampling of the visit activity logs.
+
+Logs older than ACTIVITY_LOG_RETENTION_DAYS are moved out of the
+activity_logs table into append-only, gzip compressed segment files under
+ACTIVITY_LOG_ARCHIVE_DIR. Their visits were already folded into the rollups
+and visitor sketches when they were written, so the stats do not change.
+
+Logs are archived oldest first, ACTIVITY_LOG_ARCHIVE_BATCH at a time. Each
+batch is written to a new segment file holding one gzip member per
+short_url, then indexed in the activity_log_archive table and deleted in one
+short transaction. A crash before the commit leaves an unindexed segment
+behind and the logs in place, to be archived again by the next run.
+
+Hourly rollups older than VISIT_ROLLUP_HOURLY_RETENTION_DAYS are dropped,
+the daily rollups keep counting their visits.
+"""
+import gzip
+import json
+import os
+from collections import namedtuple
+from datetime import datetime, timedelta
+from itertools import groupby, islice
+
+from flask import current_app
+from sqlalchemy import and_, bindparam, select
+
+from app.pagination import DATETIME_FORMAT, decode_cursor, encode_cursor
+
+ARCHIVED_FIELDS = ('id', 'ip', 'browser', 'platform', 'visited_at',
+                   'country_name', 'region_name', 'city', 'latitude',
+                   'longitude')
+DELETE_CHUNK = 500
+
+
+class ArchivedLog(namedtuple('ArchivedLog', ARCHIVED_FIELDS)):
+    """An activity log read back from a segment file."""
+
+    __slots__ = ()
+
+    @property
+    def packed_ip(self):
+        """Return the address packed as it is in activity_logs."""
+        from app.models import pack_ip
+        return pack_ip(self.ip)
+
+
+class LogArchiver(object):
+    """Archive the old activity logs of an app and read them back."""
+
+    def __init__(self, app):
+        """Configure the archiver from the app configuration."""
+        self.app = app
+        self.directory = app.config['ACTIVITY_LOG_ARCHIVE_DIR']
+        self.retention = timedelta(
+            days=app.config['ACTIVITY_LOG_RETENTION_DAYS'])
+        self.hourly_retention = timedelta(
+            days=app.config['VISIT_ROLLUP_HOURLY_RETENTION_DAYS'])
+        self.batch_size = app.config['ACTIVITY_LOG_ARCHIVE_BATCH']
+
+    def run(self, now=None):
+        """Archive the old logs and drop the old hourly rollups.
+
+        Returns the number of logs archived and of rollup rows dropped.
+        """
+        now = now or datetime.utcnow()
+        archived = 0
+        while True:
+            logs = self.archive_batch(now - self.retention)
+            if not logs:
+                break
+            archived += logs
+        return archived, self.downsample(now - self.hourly_retention)
+
+    def archive_batch(self, cutoff):
+        """Archive the oldest batch of logs visited before cutoff.
+
+        Returns the number of logs archived, 0 once none is left.
+        """
+        from app import db
+        from app.models import (ActivityLogArchive, UrlActivityLogs,
+                                UserAgentBrowser, UserAgentPlatform,
+                                unpack_ip)
+
+        logs_table = UrlActivityLogs.__table__
+        browsers = UserAgentBrowser.__table__
+        platforms = UserAgentPlatform.__table__
+        engine = db.get_engine(self.app)
+        with engine.connect() as connection:
+            logs = connection.execute(
+                select([logs_table.c.id, logs_table.c.short_url_id,
+                        logs_table.c.packed_ip,
+                        browsers.c.name.label('browser'),
+                        platforms.c.name.label('platform')] +
+                       [logs_table.c[name] for name in ARCHIVED_FIELDS[4:]])
+                .select_from(logs_table.outerjoin(
+                    browsers, logs_table.c.browser_id == browsers.c.id)
+                    .outerjoin(platforms,
+                               logs_table.c.platform_id == platforms.c.id))
+                .where(logs_table.c.visited_at < cutoff)
+                .order_by(logs_table.c.visited_at, logs_table.c.id)
+                .limit(self.batch_size)).fetchall()
+        if not logs:
+            return 0
+        records = [(log.short_url_id, dict(
+            zip(ARCHIVED_FIELDS, (log.id, unpack_ip(log.packed_ip)) +
+                tuple(log[3:])),
+            visited_at=log.visited_at.strftime(DATETIME_FORMAT)))
+            for log in logs]
+        members = self.write_segment(records)
+        ids = [log.id for log in logs]
+        with engine.begin() as connection:
+            connection.execute(ActivityLogArchive.__table__.insert(), members)
+            for start in range(0, len(ids), DELETE_CHUNK):
+                connection.execute(logs_table.delete().where(
+                    logs_table.c.id.in_(ids[start:start + DELETE_CHUNK])))
+        return len(logs)
+
+    def write_segment(self, records):
+        """Write (short_url_id, record) pairs to a new segment file.
+
+        The records of every short_url are compressed into their own gzip
+        member, in the order given. Returns the index rows of the members.
+        """
+        first = records[0][1]
+        segment = 'activity-logs-%s-%d.gz' % (
+            first['visited_at'].replace(':', '').replace('.', ''),
+            first['id'])
+        path = os.path.join(self.directory, segment)
+        os.makedirs(self.directory, exist_ok=True)
+        members, position = [], 0
+        with open(path + '.tmp', 'wb') as segment_file:
+            for short_url_id, group in groupby(
+                    sorted(records, key=lambda pair: pair[0]),
+                    key=lambda pair: pair[0]):
+                group = [record for _, record in group]
+                data = gzip.compress(''.join(
+                    json.dumps(record) + '\n' for record in group).encode(
+                    'utf-8'))
+                segment_file.write(data)
+                members.append({
+                    'segment': segment, 'short_url_id': short_url_id,
+                    'first_visit': _visit_time(group[0]),
+                    'last_visit': _visit_time(group[-1]),
+                    'logs': len(group), 'position': position,
+                    'size': len(data)})
+                position += len(data)
+            segment_file.flush()
+            os.fsync(segment_file.fileno())
+        os.rename(path + '.tmp', path)
+        return members
+
+    def downsample(self, cutoff):
+        """Drop the hourly rollups of buckets before cutoff in batches.
+
+        Returns the number of rollup rows dropped.
+        """
+        from app import db
+        from app.models import VisitRollupHourly
+
+        table = VisitRollupHourly.__table__
+        key = [table.c.short_url_id, table.c.bucket, table.c.platform,
+               table.c.browser]
+        engine = db.get_engine(self.app)
+        dropped = 0
+        while True:
+            with engine.begin() as connection:
+                rows = connection.execute(select(key).where(
+                    table.c.bucket < cutoff).limit(self.batch_size)).fetchall()
+                if not rows:
+                    return dropped
+                connection.execute(
+                    table.delete().where(and_(*[
+                        column == bindparam('dropped_%s' % column.name)
+                        for column in key])),
+                    [{'dropped_%s' % column.name: value
+                      for column, value in zip(key, row)} for row in rows])
+                dropped += len(rows)
+
+    def members(self, short_url_id, start=None, end=None, before=None):
+        """Return the archived members of a short_url, latest first.
+
+        Only the members holding visits from start on, before end and not
+        after before are returned.
+        """
+        from app.models import ActivityLogArchive
+
+        query = ActivityLogArchive.query.filter_by(short_url_id=short_url_id)
+        if start is not None:
+            query = query.filter(ActivityLogArchive.last_visit >= start)
+        if end is not None:
+            query = query.filter(ActivityLogArchive.first_visit < end)
+        if before is not None:
+            query = query.filter(ActivityLogArchive.first_visit <= before)
+        return query.order_by(ActivityLogArchive.last_visit.desc(),
+                              ActivityLogArchive.id.desc()).all()
+
+    def read(self, short_url_id, start=None, end=None, after=None):
+        """Yield the archived logs of a short_url, latest first.
+
+        Members are decompressed one at a time as the logs are consumed.
+        Logs are filtered to the visits from start on and before end, and
+        to those following the keyset cursor after.
+        """
+        from app.models import UrlActivityLogs
+
+        cursor = None
+        if after:
+            cursor = tuple(decode_cursor(after, [UrlActivityLogs.visited_at,
+                                                 UrlActivityLogs.id]))
+        for member in self.members(short_url_id, start, end,
+                                   cursor[0] if cursor else None):
+            for log in reversed(self.load(member)):
+                if start is not None and log.visited_at < start:
+                    continue
+                if end is not None and log.visited_at >= end:
+                    continue
+                if cursor and (log.visited_at, log.id) >= cursor:
+                    continue
+                yield log
+
+    def load(self, member):
+        """Return the logs of an archived member in the order written."""
+        with open(os.path.join(self.directory, member.segment),
+                  'rb') as segment_file:
+            segment_file.seek(member.position)
+            data = gzip.decompress(segment_file.read(member.size))
+        logs = []
+        for line in data.decode('utf-8').splitlines():
+            record = json.loads(line)
+            record['visited_at'] = _visit_time(record)
+            logs.append(ArchivedLog(**record))
+        return logs
+
+    def page_of_visits(self, short_url_id, limit, after=None, start=None,
+                       end=None):
+        """Return a page of the archived logs of a short_url, latest first.
+
+        Returns at most limit logs following the cursor after and the cursor
+        of the next page, like UrlActivityLogs.page_of_visits.
+        """
+        logs = list(islice(self.read(short_url_id, start, end, after),
+                           limit + 1))
+        if len(logs) <= limit:
+            return logs, None
+        logs = logs[:limit]
+        return logs, encode_cursor([logs[-1].visited_at, logs[-1].id])
+
+    def chunks_of_visits(self, short_url_id, chunk_size, start=None,
+                         end=None):
+        """Yield all the archived logs of a short_url chunk_size at a time."""
+        logs = self.read(short_url_id, start, end)
+        while True:
+            chunk = list(islice(logs, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+
+def _visit_time(record):
+    return datetime.strptime(record['visited_at'], DATETIME_FORMAT)
+
+
+class LogArchive(object):
+    """Move old activity logs into compressed segment files."""
+
+    def __init__(self, app=None):
+        """Initialize the extension, optionally binding it to app."""
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Create the archiver of app."""
+        app.extensions['log_archive'] = LogArchiver(app)
+
+    @property
+    def archiver(self):
+        """Return the archiver of the current app."""
+        return current_app.extensions['log_archive']
+
+    def run(self, now=None):
+        """Archive the old logs and drop the old hourly rollups."""
+        return self.archiver.run(now)
+
+    def page_of_visits(self, short_url_id, limit, after=None, start=None,
+                       end=None):
+        """Return a page of the archived logs of a short_url."""
+        return self.archiver.page_of_visits(short_url_id, limit, after,
+                                            start, end)
+
+    def chunks_of_visits(self, short_url_id, chunk_size, start=None,
+                         end=None):
+        """Yield all the archived logs of a short_url a chunk at a time."""
+        return self.archiver.chunks_of_visits(short_url_id, chunk_size,
+                                              start, end)
@@ -0,0 +1,341 @@
+"""Bloom filter of the issued short_url codes.
+
+Scanners and mistyped links ask for codes that were never issued. Every
+worker keeps a Bloom filter of all the codes in the short_url table, so a
+code the filter has never seen is answered with a 404 without looking it
+up. The filter has no false negatives for the codes it was given and
+answers "maybe" for roughly SHORT_CODE_FILTER_ERROR_RATE of the unknown
+codes, which then go to the database as before.
+
+The filter is built by streaming short_url.url in a background thread the
+first time a code is looked up, every code is looked up until it is ready.
+The codes saved by the worker are added as they are saved. Before a code is
+rejected the codes saved since by other workers are read, with an id above
+the highest seen. Ids missing below it, of rows not committed yet, are read
+again until SHORT_CODE_FILTER_REFRESH_OVERLAP higher ids were seen. Those
+refreshes run at most once every SHORT_CODE_FILTER_REFRESH_INTERVAL
+seconds and the codes missing in the meantime wait for the next one, so a
+saved code is never rejected and unknown codes cost at most one probe of
+the primary key per interval, however many arrive. Codes are never removed
+since deleting a short_url only flags it.
+
+Rows written below the highest id seen, by a restore for example, are only
+found once the filter is built again. ``python run.py rebuild_code_filter``
+bumps a counter in the code_sequence table which every refresh reads, so
+each worker rebuilds its filter on its next refresh.
+"""
+import hashlib
+import math
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import func, or_, select
+
+STREAM_CHUNK = 10000
+REBUILD_SEQUENCE = 'short_code_filter'
+
+
+class BloomFilter(object):
+    """A Bloom filter of strings over a bit array."""
+
+    def __init__(self, bits, hashes, capacity=None):
+        """Create an empty filter of bits bits probed hashes times."""
+        self.bits = bits
+        self.hashes = hashes
+        self.capacity = capacity
+        self.count = 0
+        self.array = bytearray((bits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity, error_rate, max_bytes=None):
+        """Create a filter holding capacity strings at error_rate.
+
+        The bit array is capped to max_bytes, a capped filter answers
+        "maybe" more often than error_rate once it holds capacity strings.
+        """
+        capacity = max(1, capacity)
+        bits = int(math.ceil(-capacity * math.log(error_rate) /
+                             math.log(2) ** 2))
+        if max_bytes:
+            bits = min(bits, max_bytes * 8)
+        hashes = max(1, int(round(bits / capacity * math.log(2))))
+        return cls(bits, hashes, capacity)
+
+    def positions(self, value):
+        """Return the bits of value, by double hashing a 128 bit digest."""
+        digest = hashlib.blake2b(value.encode('utf-8'),
+                                 digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'big')
+        second = int.from_bytes(digest[8:], 'big') | 1
+        return [(first + number * second) % self.bits
+                for number in range(self.hashes)]
+
+    def add(self, value):
+        """Add a string to the filter.
+
+        Strings already in the filter, or looking like they are, are not
+        counted again.
+        """
+        array, added = self.array, False
+        for position in self.positions(value):
+            bit = 1 << (position & 7)
+            if not array[position >> 3] & bit:
+                array[position >> 3] |= bit
+                added = True
+        if added:
+            self.count += 1
+
+    def __contains__(self, value):
+        """Return False if value was never added, True if it may have been."""
+        array = self.array
+        return all(array[position >> 3] & (1 << (position & 7))
+                   for position in self.positions(value))
+
+    def error_rate(self):
+        """Return the expected false positive rate at the current count."""
+        return (1 - math.exp(-self.hashes * self.count / self.bits)) ** \
+            self.hashes
+
+
+class CodeFilter(object):
+    """The Bloom filter of the short_url codes of an app."""
+
+    clock = staticmethod(time.monotonic)
+    sleep = staticmethod(time.sleep)
+
+    def __init__(self, app):
+        """Configure the filter from the app configuration."""
+        self.app = app
+        self.capacity = app.config['SHORT_CODE_FILTER_CAPACITY']
+        self.error_rate = app.config['SHORT_CODE_FILTER_ERROR_RATE']
+        self.max_bytes = app.config['SHORT_CODE_FILTER_MAX_BYTES']
+        self.interval = app.config['SHORT_CODE_FILTER_REFRESH_INTERVAL']
+        self.overlap = app.config['SHORT_CODE_FILTER_REFRESH_OVERLAP']
+        self.filter = None
+        self.generation = 0
+        self.high_water = 0
+        self.gaps = set()
+        self.rejected = 0
+        self.refreshes = 0
+        self.builds = 0
+        self._refresh_starts = 0
+        self._refreshed_at = None
+        self.ready = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    @property
+    def table(self):
+        """Return the short_url table."""
+        from app.models import ShortUrl
+        return ShortUrl.__table__
+
+    def start(self):
+        """Build the filter in a background thread, ready is set when done.
+
+        Nothing is started once the filter was built.
+        """
+        with self._lock:
+            if self._thread is not None or self.ready.is_set():
+                return
+            self._thread = threading.Thread(target=self._run,
+                                            name='short-code-filter-builder')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        with self.app.app_context():
+            try:
+                self.build()
+            except Exception:
+                self.app.logger.exception(
+                    'Building the short code filter failed, codes are '
+                    'looked up instead.')
+            finally:
+                self.ready.set()
+
+    def _generation(self, connection):
+        """Return how many rebuilds were requested so far."""
+        from app.models import CodeSequence
+
+        table = CodeSequence.__table__
+        return connection.execute(select([table.c.next_value]).where(
+            table.c.name == REBUILD_SEQUENCE)).scalar() or 0
+
+    def request_rebuild(self):
+        """Make every worker build its filter again on its next refresh."""
+        from app.codes import CodeSequenceLease
+
+        return CodeSequenceLease(self.app, REBUILD_SEQUENCE).lease(1)[1]
+
+    def build(self):
+        """Build the filter from every code in the short_url table.
+
+        The filter is sized for twice the codes found, at least for
+        SHORT_CODE_FILTER_CAPACITY of them. Nothing is built before the
+        table is created. Returns the number of codes.
+        """
+        from app import db
+
+        table = self.table
+        with db.get_engine(self.app).connect() as connection:
+            if not connection.dialect.has_table(connection, table.name):
+                return 0
+            generation = self._generation(connection)
+            codes, high_water = connection.execute(select(
+                [func.count(), func.max(table.c.id)])).first()
+            high_water = high_water or 0
+            bloom = BloomFilter.for_capacity(
+                max(self.capacity, 2 * codes), self.error_rate,
+                self.max_bytes)
+            recent = set()
+            result = connection.execution_options(
+                stream_results=True).execute(select(
+                    [table.c.id, table.c.url]).where(
+                    table.c.id <= high_water))
+            while True:
+                rows = result.fetchmany(STREAM_CHUNK)
+                if not rows:
+                    break
+                for id, code in rows:
+                    bloom.add(code)
+                    if id > high_water - self.overlap:
+                        recent.add(id)
+        with self._lock:
+            self.filter = bloom
+            self.generation = generation
+            self.high_water = high_water
+            self.gaps = self._gaps(set(), recent, 0, high_water)
+            self.builds += 1
+        self.ready.set()
+        return bloom.count
+
+    def _gaps(self, gaps, ids, low, high):
+        """Return the ids up to high still missing once ids were read.
+
+        Those are the earlier gaps and the ids above low that were not read,
+        as long as they are within SHORT_CODE_FILTER_REFRESH_OVERLAP ids of
+        high.
+        """
+        floor = high - self.overlap
+        missing = (set(range(max(low, floor) + 1, high + 1)) | gaps) - ids
+        return set(id for id in missing if id > floor)
+
+    def refresh(self):
+        """Add the codes saved since the last refresh by any worker.
+
+        Reads the codes with an id above the highest seen and those of the
+        gaps left below it. The filter is built again once it holds more
+        codes than it was sized for, or when a rebuild was requested.
+        Returns the number of codes read.
+        """
+        from app import db
+
+        self._refresh_starts += 1
+        self._refreshed_at = self.clock()
+        table = self.table
+        condition = table.c.id > self.high_water
+        if self.gaps:
+            condition = or_(condition, table.c.id.in_(sorted(self.gaps)))
+        with db.get_engine(self.app).connect() as connection:
+            generation = self._generation(connection)
+            if generation == self.generation:
+                rows = connection.execute(select(
+                    [table.c.id, table.c.url]).where(condition)).fetchall()
+        if generation != self.generation:
+            return self.build()
+        with self._lock:
+            for _, code in rows:
+                self.filter.add(code)
+            ids = set(id for id, _ in rows)
+            high_water = max([self.high_water] + list(ids))
+            self.gaps = self._gaps(self.gaps, ids, self.high_water,
+                                   high_water)
+            self.high_water = high_water
+            self.refreshes += 1
+            full = self.filter.count > self.filter.capacity
+        if full:
+            self.build()
+        return len(rows)
+
+    def add(self, code):
+        """Add a code saved by this worker."""
+        with self._lock:
+            if self.filter is not None:
+                self.filter.add(code)
+
+    def might_contain(self, code):
+        """Return False if code was never issued, True if it may have been.
+
+        Until the filter is built every code may have been issued, the
+        first lookup starts building it. A code the filter has not seen is
+        only rejected after a refresh started since it was looked up.
+        Concurrent lookups share that refresh, which waits until
+        SHORT_CODE_FILTER_REFRESH_INTERVAL passed since the previous one.
+        """
+        if self.filter is None:
+            if self._thread is None:
+                self.start()
+            return True
+        if code in self.filter:
+            return True
+        started = self._refresh_starts
+        with self._refresh_lock:
+            if self._refresh_starts == started:
+                if self._refreshed_at is not None:
+                    wait = self._refreshed_at + self.interval - self.clock()
+                    if wait > 0:
+                        self.sleep(wait)
+                self.refresh()
+        if code in self.filter:
+            return True
+        self.rejected += 1
+        return False
+
+    def stats(self):
+        """Return the size and counters of the filter."""
+        bloom = self.filter
+        return {'codes': bloom.count if bloom else 0,
+                'bytes': len(bloom.array) if bloom else 0,
+                'hashes': bloom.hashes if bloom else 0,
+                'error_rate': bloom.error_rate() if bloom else 0.0,
+                'rejected': self.rejected, 'refreshes': self.refreshes,
+                'builds': self.builds}
+
+
+class ShortCodeFilter(object):
+    """Reject unknown short_url codes before they reach the database."""
+
+    def __init__(self, app=None):
+        """Initialize the extension, optionally binding it to app."""
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Create the code filter of app, built on the first lookup."""
+        app.extensions['short_code_filter'] = CodeFilter(app)
+
+    @property
+    def filter(self):
+        """Return the code filter of the current app."""
+        return current_app.extensions['short_code_filter']
+
+    def might_contain(self, code):
+        """Return False if code was never issued, True if it may have been."""
+        if not current_app.config['SHORT_CODE_FILTER_ENABLED']:
+            return True
+        return self.filter.might_contain(code)
+
+    def add(self, code):
+        """Add a newly saved code to the filter."""
+        self.filter.add(code)
+
+    def request_rebuild(self):
+        """Make the filter of every worker be built again."""
+        return self.filter.request_rebuild()
+
+    def stats(self):
+        """Return the size and counters of the filter."""
+        return self.filter.stats()
@@ -0,0 +1,327 @@
+"""In-process caches used on the hot request paths.
+
+The caches here live in the memory of a single worker, they are bounded and
+every entry can expire, so a worker never serves stale data for longer than
+the configured TTL even when another worker changed the underlying row.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from flask import current_app
+from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
+from sqlalchemy.orm import make_transient_to_detached
+from werkzeug.useragents import UserAgent
+
+MISSING = object()
+
+ResolvedUrl = namedtuple('ResolvedUrl', ['id', 'long_url', 'long_url_id',
+                                         'is_active', 'deleted'])
+ParsedUserAgent = namedtuple('ParsedUserAgent', ['browser', 'platform',
+                                                 'version'])
+
+
+class LRUCache(object):
+    """A thread safe, bounded least recently used cache.
+
+    Entries expire ``ttl`` seconds after they were set, a ``ttl`` of None
+    keeps them until they are evicted to make room for newer entries.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, clock=time.monotonic):
+        """Create an empty cache holding at most maxsize entries."""
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=MISSING):
+        """Return the value cached for key or default if absent or expired."""
+        with self._lock:
+            try:
+                value, expires_at = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires_at is not None and expires_at <= self.clock():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=MISSING):
+        """Cache value under key, evicting the least recently used entry."""
+        if ttl is MISSING:
+            ttl = self.ttl
+        expires_at = self.clock() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        """Drop key from the cache, return True if it was cached."""
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def clear(self):
+        """Drop every entry from the cache."""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        """Return the number of entries currently cached."""
+        return len(self._data)
+
+    def stats(self):
+        """Return the counters used to size the cache."""
+        lookups = self.hits + self.misses
+        return {'size': len(self._data), 'maxsize': self.maxsize,
+                'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_ratio': self.hits / lookups if lookups else 0.0}
+
+
+class Invalidations(object):
+    """Remember the version at which the last maxsize keys were invalidated.
+
+    Every invalidation bumps the version. A value read at some version is
+    stale if its key was invalidated at a later version, keys forgotten to
+    stay within maxsize count as invalidated at the latest version
+    forgotten. Callers hold lock around a check and the write it guards.
+    """
+
+    def __init__(self, maxsize):
+        """Start at version 0 with no invalidated keys."""
+        self.maxsize = maxsize
+        self.version = 0
+        self.lock = threading.Lock()
+        self._forgotten = 0
+        self._keys = OrderedDict()
+
+    def record(self, key):
+        """Invalidate key at a new version."""
+        self.version += 1
+        self._keys[key] = self.version
+        self._keys.move_to_end(key)
+        while len(self._keys) > self.maxsize:
+            _, version = self._keys.popitem(last=False)
+            self._forgotten = max(self._forgotten, version)
+
+    def since(self, key, version):
+        """Return True if key may have been invalidated after version."""
+        return (version < self._forgotten or
+                self._keys.get(key, 0) > version)
+
+
+class ResolveCache(object):
+    """Cache short_url -> ResolvedUrl for the redirect path.
+
+    Unknown short_urls are cached as None (negative entries) with their own,
+    usually shorter, TTL so a burst of requests for a missing code only
+    queries the database once.
+    """
+
+    def __init__(self, app=None):
+        """Initialize the extension, optionally binding it to app."""
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Create the cache of app from its configuration."""
+        app.extensions['resolve_cache'] = LRUCache(
+            maxsize=app.config['RESOLVE_CACHE_SIZE'],
+            ttl=app.config['RESOLVE_CACHE_TTL'])
+        app.extensions['resolve_cache_invalidations'] = Invalidations(
+            app.config['RESOLVE_CACHE_SIZE'])
+
+    @property
+    def cache(self):
+        """Return the cache of the current app."""
+        return current_app.extensions['resolve_cache']
+
+    def get(self, short_url):
+        """Return the cached ResolvedUrl, None or MISSING if not cached."""
+        if not current_app.config['RESOLVE_CACHE_ENABLED']:
+            return MISSING
+        return self.cache.get(short_url)
+
+    def version(self):
+        """Return the version to pass to set for a row read from now on."""
+        return current_app.extensions['resolve_cache_invalidations'].version
+
+    def set(self, short_url, resolved, version=None):
+        """Cache the resolved details of short_url, None if it is unknown.
+
+        version is what version() returned before the row was read, the
+        details are not cached if short_url was invalidated since then, as
+        they may predate the change.
+        """
+        if not current_app.config['RESOLVE_CACHE_ENABLED']:
+            return
+        ttl = MISSING
+        if resolved is None:
+            ttl = current_app.config['RESOLVE_CACHE_NEGATIVE_TTL']
+        invalidations = current_app.extensions['resolve_cache_invalidations']
+        with invalidations.lock:
+            if version is None or not invalidations.since(short_url, version):
+                self.cache.set(short_url, resolved, ttl=ttl)
+
+    def invalidate(self, short_url):
+        """Forget short_url after its row changed."""
+        invalidations = current_app.extensions['resolve_cache_invalidations']
+        with invalidations.lock:
+            invalidations.record(short_url)
+            self.cache.delete(short_url)
+
+    def stats(self):
+        """Return hit, miss and eviction counters of the current app."""
+        return self.cache.stats()
+
+
+class TokenCache(object):
+    """Cache verified auth tokens and the users they identify.
+
+    Tokens map to user ids until the token expires or TOKEN_CACHE_TTL is
+    over, so a token seen recently skips the signature check. User ids map
+    to detached copies of their users, which are merged into the session
+    without a SELECT. The users are dropped whenever the cached columns of
+    their row are updated or the row is deleted, so a token of a deleted
+    user stops identifying anyone.
+    """
+
+    def __init__(self, app=None):
+        """Initialize the extension, optionally binding it to app."""
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Create the caches and token serializer of app."""
+        app.extensions['token_cache'] = {
+            'tokens': LRUCache(maxsize=app.config['TOKEN_CACHE_SIZE'],
+                               ttl=app.config['TOKEN_CACHE_TTL']),
+            'users': LRUCache(maxsize=app.config['TOKEN_CACHE_SIZE'],
+                              ttl=app.config['TOKEN_CACHE_TTL']),
+            'serializer': Serializer(app.config['SECRET_KEY']),
+            'invalidations': Invalidations(app.config['TOKEN_CACHE_SIZE'])}
+
+    @property
+    def caches(self):
+        """Return the caches of the current app."""
+        return current_app.extensions['token_cache']
+
+    @property
+    def serializer(self):
+        """Return the serializer verifying the tokens of the current app."""
+        return self.caches['serializer']
+
+    def user_id(self, token):
+        """Return the id of the user of a verified token or MISSING."""
+        if not current_app.config['TOKEN_CACHE_ENABLED']:
+            return MISSING
+        return self.caches['tokens'].get(token)
+
+    def set_user_id(self, token, user_id, expires_at=None):
+        """Cache the user id of a verified token until it expires."""
+        if not current_app.config['TOKEN_CACHE_ENABLED']:
+            return
+        ttl = current_app.config['TOKEN_CACHE_TTL']
+        if expires_at is not None:
+            ttl = min(ttl, expires_at - time.time())
+            if ttl <= 0:
+                return
+        self.caches['tokens'].set(token, user_id, ttl=ttl)
+
+    def user(self, user_id):
+        """Return the detached copy of a user or MISSING if not cached."""
+        if not current_app.config['TOKEN_CACHE_ENABLED']:
+            return MISSING
+        return self.caches['users'].get(user_id)
+
+    def version(self):
+        """Return the version to pass to set_user for a user read from now."""
+        return self.caches['invalidations'].version
+
+    def set_user(self, user, version=None, keys=None):
+        """Cache a detached copy of the column values of user.
+
+        Only the primary key and keys are copied when given, the other
+        columns are loaded when first read. version is what version()
+        returned before the user was read, the user is not cached if it
+        was invalidated since then.
+        """
+        if not current_app.config['TOKEN_CACHE_ENABLED']:
+            return
+        mapper = user.__mapper__
+        if keys is None:
+            keys = [column.key for column in mapper.column_attrs]
+        keys = set(keys) | set(mapper.get_property_by_column(column).key
+                               for column in mapper.primary_key)
+        copy = mapper.class_(**{key: getattr(user, key) for key in keys})
+        make_transient_to_detached(copy)
+        invalidations = self.caches['invalidations']
+        with invalidations.lock:
+            if version is None or not invalidations.since(user.id, version):
+                self.caches['users'].set(user.id, copy)
+
+    def invalidate(self, user_id):
+        """Forget the user with user_id after its row changed."""
+        invalidations = self.caches['invalidations']
+        with invalidations.lock:
+            invalidations.record(user_id)
+            self.caches['users'].delete(user_id)
+
+    def stats(self):
+        """Return the counters of the token and user caches."""
+        return {'tokens': self.caches['tokens'].stats(),
+                'users': self.caches['users'].stats()}
+
+
+class UserAgentCache(object):
+    """Cache raw User-Agent strings -> ParsedUserAgent for the visit path.
+
+    Werkzeug parses a User-Agent header with a series of regular
+    expressions every time it is read, while real traffic only carries a
+    few thousand distinct headers. Parsed headers never go stale, so the
+    entries have no TTL and are only evicted to make room.
+    """
+
+    def __init__(self, app=None):
+        """Initialize the extension, optionally binding it to app."""
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Create the cache of app from its configuration."""
+        app.extensions['user_agent_cache'] = LRUCache(
+            maxsize=app.config['USER_AGENT_CACHE_SIZE'])
+
+    @property
+    def cache(self):
+        """Return the cache of the current app."""
+        return current_app.extensions['user_agent_cache']
+
+    def parse(self, string):
+        """Return the browser, platform and version of a User-Agent."""
+        parsed = self.cache.get(string)
+        if parsed is MISSING:
+            user_agent = UserAgent(string)
+            parsed = ParsedUserAgent(user_agent.browser, user_agent.platform,
+                                     user_agent.version)
+            self.cache.set(string, parsed)
+        return parsed
+
+    def stats(self):
+        """Return hit, miss and eviction counters of the current app."""
+        return self.cache.stats()
@@ -0,0 +1,354 @@
+"""Allocation of short_url codes without a lookup per code.
+
+Codes are base62 encodings of ids handed out by a monotonically increasing
+counter. Workers lease blocks of ids from a row of the code_sequence table,
+so the database is touched once per block rather than once per code, and
+since every id is used once no uniqueness check or retry is needed. The ids
+can be passed through a keyed permutation first so consecutive codes are not
+guessable from one another.
+
+Alternatively codes are popped from a pool of random codes which a
+background thread validates in batches and keeps topped up.
+"""
+import atexit
+import hashlib
+import hmac
+import os
+import random
+import string
+import threading
+from collections import deque
+
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+BASE62 = string.digits + string.ascii_letters
+
+
+def base62_encode(number, length=1):
+    """Encode a non negative integer, left padded to length characters."""
+    digits = []
+    while number:
+        number, remainder = divmod(number, 62)
+        digits.append(BASE62[remainder])
+    return ''.join(reversed(digits)).rjust(length, BASE62[0])
+
+
+def base62_decode(code):
+    """Decode a base62 string back into an integer."""
+    number = 0
+    for char in code:
+        number = number * 62 + BASE62.index(char)
+    return number
+
+
+class Scrambler(object):
+    """A keyed permutation of the integers in [0, size).
+
+    It is a balanced Feistel network over the smallest even number of bits
+    covering size, cycle walking until the result falls back into range.
+    """
+
+    rounds = 4
+
+    def __init__(self, key, size):
+        """Create the permutation of range(size) selected by key."""
+        self.key = key if isinstance(key, bytes) else key.encode('utf-8')
+        self.size = size
+        self.half_bits = ((size - 1).bit_length() + 1) // 2
+        self.mask = (1 << self.half_bits) - 1
+
+    def _round(self, number, value):
+        digest = hmac.new(self.key, b'%d:%d' % (number, value),
+                          hashlib.sha256).digest()
+        return int.from_bytes(digest[:8], 'big') & self.mask
+
+    def _feistel(self, value):
+        left, right = value >> self.half_bits, value & self.mask
+        for number in range(self.rounds):
+            left, right = right, left ^ self._round(number, right)
+        return (left << self.half_bits) | right
+
+    def __call__(self, value):
+        """Return the image of value under the permutation."""
+        value = self._feistel(value)
+        while value >= self.size:
+            value = self._feistel(value)
+        return value
+
+
+class CodeSequenceLease(object):
+    """Lease blocks of ids from a code_sequence row and encode them."""
+
+    def __init__(self, app, name='short_url'):
+        """Configure the lease from the app configuration."""
+        self.app = app
+        self.name = name
+        self.length = app.config['SHORT_URL_LENGTH']
+        self.block_size = app.config['SHORT_URL_BLOCK_SIZE']
+        self.scramble = app.config['SHORT_URL_SCRAMBLE']
+        self.key = (app.config['SHORT_URL_SCRAMBLE_KEY'] or
+                    app.config['SECRET_KEY'] or '')
+        self.leases = 0
+        self._scramblers = {}
+        self._next = self._end = 0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def lease(self, size=None):
+        """Reserve the next size ids, return the first and last + 1."""
+        from app import db
+
+        size = size or self.block_size
+        engine = db.get_engine(self.app)
+        with engine.begin() as connection:
+            end = self._advance(connection, size)
+        if end is None:
+            try:
+                with engine.begin() as connection:
+                    connection.execute(self.table.insert().values(
+                        name=self.name, next_value=size))
+                end = size
+            except IntegrityError:
+                # Another worker created the row first, lease from it.
+                with engine.begin() as connection:
+                    end = self._advance(connection, size)
+        self.leases += 1
+        return end - size, end
+
+    def _advance(self, connection, size):
+        """Move the sequence size ids ahead, return None if it is missing.
+
+        The UPDATE locks the row until the transaction ends, so the value
+        read back afterwards is the end of a block no other worker holds.
+        """
+        table = self.table
+        updated = connection.execute(
+            table.update().where(table.c.name == self.name).values(
+                next_value=table.c.next_value + size))
+        if not updated.rowcount:
+            return None
+        return connection.execute(select([table.c.next_value]).where(
+            table.c.name == self.name)).scalar()
+
+    @property
+    def table(self):
+        """Return the code_sequence table."""
+        from app.models import CodeSequence
+        return CodeSequence.__table__
+
+    def next_ids(self, count):
+        """Return count unused ids, leasing a new block when needed.
+
+        Ids left in the current block are used first, the rest comes from a
+        single lease of at least one block.
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                # A forked worker must not reuse the block of its parent.
+                self._next = self._end = 0
+                self._pid = os.getpid()
+            ids = list(range(self._next, min(self._end, self._next + count)))
+            self._next += len(ids)
+            missing = count - len(ids)
+            if missing:
+                start, self._end = self.lease(max(missing, self.block_size))
+                ids.extend(range(start, start + missing))
+                self._next = start + missing
+            return ids
+
+    def next_id(self):
+        """Return the next unused id."""
+        return self.next_ids(1)[0]
+
+    def encode(self, number):
+        """Turn an id into a code of at least length characters.
+
+        Ids are spread over codes of length characters first, then over
+        codes one character longer and so on, so codes never repeat.
+        """
+        length = self.length
+        while number >= 62 ** length:
+            number -= 62 ** length
+            length += 1
+        if self.scramble:
+            if length not in self._scramblers:
+                self._scramblers[length] = Scrambler(self.key, 62 ** length)
+            number = self._scramblers[length](number)
+        return base62_encode(number, length)
+
+    def allocate(self):
+        """Return a short_url code that was never handed out before."""
+        return self.encode(self.next_id())
+
+    def allocate_many(self, count):
+        """Return count short_url codes that were never handed out before."""
+        return [self.encode(number) for number in self.next_ids(count)]
+
+    def stats(self):
+        """Return how many blocks were leased and how much is left."""
+        return {'leases': self.leases, 'remaining': self._end - self._next}
+
+
+class CodePool(object):
+    """Keep a pool of random, unused codes above a low-water mark."""
+
+    def __init__(self, app):
+        """Configure the pool from the app configuration."""
+        self.app = app
+        self.length = app.config['SHORT_URL_LENGTH']
+        self.size = app.config['SHORT_URL_POOL_SIZE']
+        self.low_water = app.config['SHORT_URL_POOL_LOW_WATER']
+        self.refill_batch = app.config['SHORT_URL_POOL_REFILL_BATCH']
+        self.refills = 0
+        self.popped = 0
+        self.fallbacks = 0
+        self._codes = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def generate(self, count):
+        """Return up to count random codes that are not in use.
+
+        The candidates are checked against the short_url table with a single
+        IN query instead of one query per code.
+        """
+        from app import db
+        from app.models import ShortUrl
+
+        candidates = set(''.join(random.choice(BASE62)
+                                 for _ in range(self.length))
+                         for _ in range(count))
+        table = ShortUrl.__table__
+        with db.get_engine(self.app).connect() as connection:
+            taken = set(row[0] for row in connection.execute(
+                select([table.c.url]).where(table.c.url.in_(candidates))))
+        return list(candidates - taken)
+
+    def refill(self):
+        """Top the pool up to its size, one refill batch at a time."""
+        while len(self._codes) < self.size and not self._stopping:
+            codes = self.generate(min(self.refill_batch,
+                                      self.size - len(self._codes)))
+            with self._lock:
+                pooled = set(self._codes)
+                self._codes.extend(code for code in codes
+                                   if code not in pooled)
+            self.refills += 1
+
+    def pop(self):
+        """Return an unused code, generating one right away if empty."""
+        if self._thread is None:
+            self.start()
+        with self._lock:
+            code = self._codes.popleft() if self._codes else None
+            remaining = len(self._codes)
+        if remaining < self.low_water:
+            self._wakeup.set()
+        if code is None:
+            self.fallbacks += 1
+            code = self.generate_now(1)[0]
+        self.popped += 1
+        return code
+
+    def pop_many(self, count):
+        """Return count unused codes, generating what the pool lacks."""
+        if self._thread is None:
+            self.start()
+        with self._lock:
+            codes = [self._codes.popleft()
+                     for _ in range(min(count, len(self._codes)))]
+            remaining = len(self._codes)
+        if remaining < self.low_water:
+            self._wakeup.set()
+        if len(codes) < count:
+            self.fallbacks += 1
+            codes.extend(self.generate_now(count - len(codes), set(codes)))
+        self.popped += count
+        return codes
+
+    def generate_now(self, count, exclude=()):
+        """Generate count unused codes on the calling thread."""
+        codes = []
+        while len(codes) < count:
+            codes.extend(code for code in self.generate(count - len(codes))
+                         if code not in exclude and code not in codes)
+        return codes[:count]
+
+    def start(self):
+        """Start the background thread refilling the pool."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run,
+                                            name='short-url-pool-refill')
+            self._thread.daemon = True
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the refill thread."""
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        with self.app.app_context():
+            while not self._stopping:
+                try:
+                    self.refill()
+                except Exception:
+                    self.app.logger.exception('Refilling the pool failed.')
+                self._wakeup.wait()
+                self._wakeup.clear()
+
+    def stats(self):
+        """Return the pool level and how often it ran dry."""
+        return {'size': len(self._codes), 'popped': self.popped,
+                'refills': self.refills, 'fallbacks': self.fallbacks}
+
+
+class CodeAllocator(object):
+    """Hand out short_url codes from block leased counters or a pool."""
+
+    def __init__(self, app=None):
+        """Initialize the extension, optionally binding it to app."""
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Create the code sequence lease and the code pool of app."""
+        app.extensions['code_allocator'] = CodeSequenceLease(app)
+        app.extensions['code_pool'] = CodePool(app)
+
+    @property
+    def lease(self):
+        """Return the code sequence lease of the current app."""
+        return current_app.extensions['code_allocator']
+
+    @property
+    def pool(self):
+        """Return the code pool of the current app."""
+        return current_app.extensions['code_pool']
+
+    def allocate(self):
+        """Return an unused short_url code."""
+        if current_app.config['SHORT_URL_ALLOCATOR'] == 'pool':
+            return self.pool.pop()
+        return self.lease.allocate()
+
+    def allocate_many(self, count):
+        """Return count unused short_url codes."""
+        if current_app.config['SHORT_URL_ALLOCATOR'] == 'pool':
+            return self.pool.pop_many(count)
+        return self.lease.allocate_many(count)
+
+    def stats(self):
+        """Return the counters of the allocator in use."""
+        if current_app.config['SHORT_URL_ALLOCATOR'] == 'pool':
+            return self.pool.stats()
+        return self.lease.stats()
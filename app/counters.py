@@ -0,0 +1,375 @@
+"""Write-behind aggregation of the visit counters.
+
+Instead of a read-modify-write and a commit per redirect, visits are counted
+in memory per short_url and long_url and periodically flushed as batched
+``UPDATE ... SET no_of_visits = no_of_visits + :delta`` statements.
+
+With VISIT_COUNTER_SHARDS set the flushes go to one of that many rows of the
+visit_count_shard table instead, picked at random, so workers flushing the
+visits of a viral link do not queue on a single row lock. Reads add the
+shards to the no_of_visits columns, and the shards are periodically
+compacted back into those columns. Each worker compacts the rows it added
+visits to every VISIT_COUNTER_COMPACT_INTERVAL seconds, and every shard
+holding visits every VISIT_COUNTER_SWEEP_INTERVAL seconds, so the visits
+left by workers that stopped before compacting them are not held back.
+"""
+import atexit
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+
+from flask import current_app
+from sqlalchemy import and_, bindparam, func, or_, select
+from sqlalchemy.exc import IntegrityError
+
+
+class CounterAccumulator(object):
+    """Hold the pending visit counts of an app and flush them."""
+
+    known_shards_limit = 100000
+
+    def __init__(self, app):
+        """Configure the accumulator from the app configuration."""
+        self.app = app
+        self.write_behind = app.config['VISIT_COUNTER_WRITE_BEHIND']
+        self.interval = app.config['VISIT_COUNTER_FLUSH_INTERVAL']
+        self.threshold = app.config['VISIT_COUNTER_FLUSH_THRESHOLD']
+        self.shards = app.config['VISIT_COUNTER_SHARDS']
+        self.compact_interval = app.config['VISIT_COUNTER_COMPACT_INTERVAL']
+        self.compact_batch = app.config['VISIT_COUNTER_COMPACT_BATCH']
+        self.sweep_interval = app.config['VISIT_COUNTER_SWEEP_INTERVAL']
+        self.short_urls = Counter()
+        self.long_urls = Counter()
+        self.flushes = 0
+        self.flushed_increments = 0
+        self.compactions = 0
+        self._known_shards = set()
+        self._dirty = set()
+        self._compacted_at = self._swept_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def incr(self, short_url_id, long_url_id, delta=1):
+        """Count delta visits of a short_url and its long_url."""
+        with self._lock:
+            self.short_urls[short_url_id] += delta
+            self.long_urls[long_url_id] += delta
+            pending = len(self.short_urls) + len(self.long_urls)
+        if not self.write_behind:
+            self.flush()
+            self._compact_if_due()
+            return
+        if self._thread is None:
+            self.start()
+        if pending >= self.threshold:
+            self._wakeup.set()
+
+    def discard(self, short_url_id):
+        """Forget the visits of a short_url whose count was reset.
+
+        Pending visits are dropped and the shards of the short_url zeroed.
+        """
+        from app import db
+
+        with self._lock:
+            self.short_urls.pop(short_url_id, None)
+        if self.shards:
+            table = self.shard_table
+            with db.get_engine(self.app).begin() as connection:
+                connection.execute(table.update().where(and_(
+                    table.c.table_name == 'short_url',
+                    table.c.row_id == short_url_id)).values(visits=0))
+
+    def pending(self):
+        """Return the number of rows waiting to be flushed."""
+        with self._lock:
+            return len(self.short_urls) + len(self.long_urls)
+
+    @property
+    def shard_table(self):
+        """Return the visit_count_shard table."""
+        from app.models import VisitCountShard
+        return VisitCountShard.__table__
+
+    def flush(self):
+        """Write the pending counts to the database in one transaction."""
+        from app import db
+        from app.models import LongUrl, ShortUrl
+
+        with self._lock:
+            short_urls, self.short_urls = self.short_urls, Counter()
+            long_urls, self.long_urls = self.long_urls, Counter()
+        if not short_urls and not long_urls:
+            return
+        engine = db.get_engine(self.app)
+        try:
+            if self.shards:
+                deltas = self._pick_shards((('short_url', short_urls),
+                                            ('long_url', long_urls)))
+                self._create_shards(engine, deltas)
+            with engine.begin() as connection:
+                if self.shards:
+                    self._add_to_shards(connection, deltas)
+                else:
+                    self._add_visits(connection, ShortUrl.__table__,
+                                     short_urls)
+                    self._add_visits(connection, LongUrl.__table__,
+                                     long_urls)
+        except Exception:
+            with self._lock:
+                self.short_urls.update(short_urls)
+                self.long_urls.update(long_urls)
+            raise
+        self.flushes += 1
+        self.flushed_increments += sum(short_urls.values())
+
+    @staticmethod
+    def _add_visits(connection, table, deltas):
+        """Add deltas to the no_of_visits column of table.
+
+        Rows are updated in id order so concurrent flushes lock them in the
+        same order.
+        """
+        if not deltas:
+            return
+        connection.execute(
+            table.update().where(table.c.id == bindparam('row_id')).values(
+                no_of_visits=table.c.no_of_visits + bindparam('delta')),
+            [{'row_id': row_id, 'delta': deltas[row_id]}
+             for row_id in sorted(deltas)])
+
+    def _pick_shards(self, deltas_by_table):
+        """Assign every counted row a random shard."""
+        return {(table_name, row_id, random.randrange(self.shards)): delta
+                for table_name, deltas in deltas_by_table
+                for row_id, delta in deltas.items()}
+
+    def _create_shards(self, engine, deltas):
+        """Insert the shard rows that deltas need and that do not exist.
+
+        Shard rows are never deleted, so once a row is known to exist it is
+        not looked up again by this process.
+        """
+        table = self.shard_table
+        missing = set(deltas) - self._known_shards
+        if not missing:
+            return
+        row_ids = defaultdict(set)
+        for table_name, row_id, _ in missing:
+            row_ids[table_name].add(row_id)
+        with engine.connect() as connection:
+            existing = set(tuple(row) for row in connection.execute(
+                select([table.c.table_name, table.c.row_id, table.c.shard])
+                .where(or_(*[and_(table.c.table_name == table_name,
+                                  table.c.row_id.in_(ids))
+                             for table_name, ids in row_ids.items()]))))
+            for table_name, row_id, shard in sorted(missing - existing):
+                try:
+                    connection.execute(table.insert().values(
+                        table_name=table_name, row_id=row_id, shard=shard,
+                        visits=0))
+                except IntegrityError:
+                    # Another worker created the shard first.
+                    pass
+        if len(self._known_shards) > self.known_shards_limit:
+            self._known_shards.clear()
+        self._known_shards.update(missing)
+
+    def _add_to_shards(self, connection, deltas):
+        """Add deltas to their shard rows, in key order."""
+        table = self.shard_table
+        connection.execute(
+            table.update().where(and_(
+                table.c.table_name == bindparam('shard_table'),
+                table.c.row_id == bindparam('shard_row'),
+                table.c.shard == bindparam('shard_number'))).values(
+                visits=table.c.visits + bindparam('delta')),
+            [{'shard_table': key[0], 'shard_row': key[1],
+              'shard_number': key[2], 'delta': deltas[key]}
+             for key in sorted(deltas)])
+        with self._lock:
+            self._dirty.update(key[:2] for key in deltas)
+
+    def visits(self, table_name, row_ids):
+        """Return the visits still held in shards of row_ids, by id."""
+        from app import db
+
+        if not self.shards or not row_ids:
+            return {}
+        table = self.shard_table
+        row_ids = sorted(set(row_ids))
+        visits = {}
+        for start in range(0, len(row_ids), self.compact_batch):
+            visits.update(db.session.execute(
+                select([table.c.row_id, func.sum(table.c.visits)]).where(and_(
+                    table.c.table_name == table_name,
+                    table.c.row_id.in_(
+                        row_ids[start:start + self.compact_batch])))
+                .group_by(table.c.row_id)).fetchall())
+        return visits
+
+    def compact(self, everything=False):
+        """Move the visits counted in shards into the no_of_visits columns.
+
+        Only the rows this process added visits to since the last compaction
+        are compacted, unless everything is set. Returns the number of shard
+        rows that held visits.
+        """
+        table = self.shard_table
+        with self._lock:
+            dirty, self._dirty = sorted(self._dirty), set()
+        compacted = 0
+        if everything:
+            while True:
+                moved = self._compact(table.c.visits != 0, self.compact_batch)
+                if not moved:
+                    break
+                compacted += moved
+            self._swept_at = time.monotonic()
+        for start in range(0, len(dirty), self.compact_batch):
+            row_ids = defaultdict(list)
+            for table_name, row_id in dirty[start:start + self.compact_batch]:
+                row_ids[table_name].append(row_id)
+            compacted += self._compact(and_(table.c.visits != 0, or_(
+                *[and_(table.c.table_name == table_name,
+                       table.c.row_id.in_(ids))
+                  for table_name, ids in row_ids.items()])))
+        self.compactions += 1
+        self._compacted_at = time.monotonic()
+        return compacted
+
+    def _compact(self, condition, limit=None):
+        """Compact the shard rows matching condition in one transaction.
+
+        The shard rows are locked while they are read, then exactly the
+        visits read are added to the main columns and taken off the shards,
+        so increments landing meanwhile are neither lost nor counted twice.
+        """
+        from app import db
+        from app.models import LongUrl, ShortUrl
+
+        table = self.shard_table
+        query = select([table.c.table_name, table.c.row_id, table.c.shard,
+                        table.c.visits]).where(condition).order_by(
+            table.c.table_name, table.c.row_id, table.c.shard)
+        if limit:
+            query = query.limit(limit)
+        with db.get_engine(self.app).begin() as connection:
+            rows = connection.execute(query.with_for_update()).fetchall()
+            if not rows:
+                return 0
+            totals = defaultdict(Counter)
+            for row in rows:
+                totals[row.table_name][row.row_id] += row.visits
+            for model in (ShortUrl, LongUrl):
+                self._add_visits(connection, model.__table__,
+                                 totals[model.__tablename__])
+            connection.execute(
+                table.update().where(and_(
+                    table.c.table_name == bindparam('shard_table'),
+                    table.c.row_id == bindparam('shard_row'),
+                    table.c.shard == bindparam('shard_number'))).values(
+                    visits=table.c.visits - bindparam('taken')),
+                [{'shard_table': row.table_name, 'shard_row': row.row_id,
+                  'shard_number': row.shard, 'taken': row.visits}
+                 for row in rows])
+        return len(rows)
+
+    def _compact_if_due(self):
+        if not self.shards:
+            return
+        now = time.monotonic()
+        if now - self._swept_at >= self.sweep_interval:
+            self.compact(everything=True)
+        elif now - self._compacted_at >= self.compact_interval:
+            self.compact()
+
+    def start(self):
+        """Start the background thread flushing on interval or threshold."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run,
+                                            name='visit-counter-flusher')
+            self._thread.daemon = True
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the background thread and flush what is still pending."""
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def _run(self):
+        with self.app.app_context():
+            while not self._stopping:
+                self._wakeup.wait(self.interval)
+                self._wakeup.clear()
+                try:
+                    self.flush()
+                    self._compact_if_due()
+                except Exception:
+                    self.app.logger.exception(
+                        'Flushing visit counters failed.')
+
+    def stats(self):
+        """Return the counters used to tune the flush settings."""
+        return {'pending': self.pending(), 'flushes': self.flushes,
+                'flushed_increments': self.flushed_increments,
+                'compactions': self.compactions}
+
+
+class VisitCounter(object):
+    """Count visits of short_urls without waiting on a database write."""
+
+    def __init__(self, app=None):
+        """Initialize the extension, optionally binding it to app."""
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Create the accumulator of app."""
+        app.extensions['visit_counter'] = CounterAccumulator(app)
+
+    @property
+    def accumulator(self):
+        """Return the accumulator of the current app."""
+        return current_app.extensions['visit_counter']
+
+    def incr(self, short_url_id, long_url_id):
+        """Count a visit of a short_url and its long_url."""
+        self.accumulator.incr(short_url_id, long_url_id)
+
+    def discard(self, short_url_id):
+        """Forget the pending visits of a short_url."""
+        self.accumulator.discard(short_url_id)
+
+    def flush(self):
+        """Write the pending visits to the database now."""
+        self.accumulator.flush()
+
+    def compact(self, everything=False):
+        """Move the visits held in shards into the no_of_visits columns."""
+        return self.accumulator.compact(everything)
+
+    def totals(self, urls):
+        """Return the visits of short_urls or long_urls by id.
+
+        The no_of_visits columns are added to what the shards still hold.
+        """
+        if not urls:
+            return {}
+        sharded = self.accumulator.visits(urls[0].__tablename__,
+                                          [url.id for url in urls])
+        return {url.id: (url.no_of_visits or 0) + sharded.get(url.id, 0)
+                for url in urls}
+
+    def stats(self):
+        """Return the flush counters of the current app."""
+        return self.accumulator.stats()
@@ -0,0 +1,89 @@
+"""Redirect fast path in front of the Flask application.
+
+Redirects are the bulk of the traffic, yet each one goes through request
+context setup, blueprint dispatch, the login manager and the error handlers.
+RedirectMiddleware matches short_url paths itself, resolves them through the
+model layer and answers with a minimal response. Every other request falls
+through to the wrapped Flask application unchanged.
+"""
+import time
+
+from flask import _app_ctx_stack
+from werkzeug.exceptions import HTTPException
+from werkzeug.urls import iri_to_uri
+from werkzeug.wrappers import Request
+
+from app import metrics
+from app.models import ShortUrl
+
+
+class RedirectMiddleware(object):
+    """WSGI middleware serving short_url redirects without Flask routing."""
+
+    endpoint = 'api.get_url'
+
+    def __init__(self, app):
+        """Wrap the WSGI application of a Flask app."""
+        self.app = app
+        self.wsgi_app = app.wsgi_app
+
+    def __call__(self, environ, start_response):
+        """Answer redirects directly, hand everything else to Flask."""
+        short_url = self.match(environ)
+        if short_url is None:
+            return self.wsgi_app(environ, start_response)
+        started = time.perf_counter()
+        app_ctx = _app_ctx_stack.top
+        if app_ctx is None or app_ctx.app is not self.app:
+            app_ctx = self.app.app_context()
+            app_ctx.push()
+        else:
+            app_ctx = None
+        try:
+            resolved = ShortUrl.find_url(short_url, Request(environ))
+            location = None
+            if resolved and resolved.deleted:
+                status, body = '404 NOT FOUND', 'This URL has been deleted.'
+            elif resolved and not resolved.is_active:
+                status, body = '400 BAD REQUEST', 'URL is inactive.'
+            elif resolved:
+                location = iri_to_uri(resolved.long_url, safe_conversion=True)
+                status, body = '302 FOUND', location
+            else:
+                status, body = '404 NOT FOUND', 'Resource not found.'
+            metrics.observe_request(self.endpoint, int(status[:3]),
+                                    time.perf_counter() - started)
+        finally:
+            if app_ctx is not None:
+                app_ctx.pop()
+        return self.respond(environ, start_response, status, body, location)
+
+    def match(self, environ):
+        """Return the short_url requested by environ or None.
+
+        The app's own url_map is used so a path is only served here if Flask
+        would have dispatched it to the redirect endpoint.
+        """
+        if environ.get('REQUEST_METHOD') not in ('GET', 'HEAD'):
+            return None
+        try:
+            endpoint, values = self.app.url_map.bind_to_environ(
+                environ, server_name=self.app.config['SERVER_NAME']).match()
+        except HTTPException:
+            return None
+        if endpoint != self.endpoint:
+            return None
+        return values['shorturl']
+
+    @staticmethod
+    def respond(environ, start_response, status, body, location=None):
+        """Send a plain text response."""
+        body = body.encode('utf-8')
+        headers = [('Content-Type', 'text/plain; charset=utf-8'),
+                   ('Content-Length', str(len(body)))]
+        if location is not None:
+            headers.append(('Location', location))
+        start_response(status, headers)
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return []
+        return [body]
@@ -0,0 +1,286 @@
+"""Offline GeoIP enrichment of the visit activity logs.
+
+Locations are resolved from a local range table instead of a remote
+service. The table is converted once from a CSV file of address ranges into
+a compact binary file, which is memory-mapped and searched by bisection, so
+the operating system pages in only the parts a lookup touches and every
+worker process shares the same pages.
+
+The binary file holds a header, the ranges sorted by their first address,
+the distinct locations and the strings they refer to::
+
+    header     b'GEOIPRT1', range count, location count (>8sII)
+    range      first address, last address, location index (>16s16sI)
+    location   country, region and city offsets, latitude, longitude (>IIIdd)
+    string     length and UTF-8 bytes (>H)
+
+IPv4 addresses are stored as IPv4-mapped IPv6 addresses, so a single sorted
+array covers both families and compares as bytes.
+"""
+import bisect
+import csv
+import ipaddress
+import mmap
+import struct
+from collections import namedtuple
+
+from flask import current_app
+from sqlalchemy import and_, bindparam, select
+
+from app.cache import MISSING, LRUCache
+
+MAGIC = b'GEOIPRT1'
+NAN = float('nan')
+HEADER = struct.Struct('>8sII')
+RANGE = struct.Struct('>16s16sI')
+LOCATION = struct.Struct('>IIIdd')
+STRING_LENGTH = struct.Struct('>H')
+CSV_FIELDS = ('start_ip', 'end_ip', 'country_name', 'region_name', 'city',
+              'latitude', 'longitude')
+
+Location = namedtuple('Location', ['country_name', 'region_name', 'city',
+                                   'latitude', 'longitude'])
+
+
+class InvalidRangeFile(ValueError):
+    """Raised when a range file cannot be converted or read."""
+
+
+def address_key(ip):
+    """Return the 16 byte key of an address given as text or packed bytes.
+
+    Returns None for a missing or malformed address.
+    """
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+    if address.version == 4:
+        address = ipaddress.IPv6Address(b'\0' * 10 + b'\xff\xff' +
+                                        address.packed)
+    return address.packed
+
+
+def convert(source, target):
+    """Convert a CSV file of address ranges into the binary range table.
+
+    The CSV file has a header row naming at least the CSV_FIELDS columns.
+    Ranges may be listed in any order but must not overlap. Returns the
+    number of ranges written.
+    """
+    ranges, locations, strings = [], {}, {'': 0}
+    blob = bytearray(STRING_LENGTH.pack(0))
+
+    def string(value):
+        encoded = value.encode('utf-8')[:0xffff]
+        if value not in strings:
+            strings[value] = len(blob)
+            blob.extend(STRING_LENGTH.pack(len(encoded)) + encoded)
+        return strings[value]
+
+    with open(source, newline='', encoding='utf-8') as csv_file:
+        reader = csv.DictReader(csv_file)
+        missing = set(CSV_FIELDS) - set(reader.fieldnames or ())
+        if missing:
+            raise InvalidRangeFile('Missing columns: %s.' %
+                                   ', '.join(sorted(missing)))
+        for line, row in enumerate(reader, 2):
+            first, last = address_key(row['start_ip']), address_key(
+                row['end_ip'])
+            if first is None or last is None or first > last:
+                raise InvalidRangeFile('Invalid range on line %d.' % line)
+            try:
+                location = (string(row['country_name']),
+                            string(row['region_name']), string(row['city']),
+                            _float(row['latitude']),
+                            _float(row['longitude']))
+            except ValueError:
+                raise InvalidRangeFile('Invalid coordinates on line %d.' %
+                                       line)
+            ranges.append((first, last, locations.setdefault(
+                location, len(locations))))
+    ranges.sort()
+    for previous, current in zip(ranges, ranges[1:]):
+        if current[0] <= previous[1]:
+            raise InvalidRangeFile('Overlapping ranges starting at %s.' %
+                                   ipaddress.ip_address(current[0]))
+    with open(target, 'wb') as binary_file:
+        binary_file.write(HEADER.pack(MAGIC, len(ranges), len(locations)))
+        for first, last, index in ranges:
+            binary_file.write(RANGE.pack(first, last, index))
+        for location in sorted(locations, key=locations.get):
+            binary_file.write(LOCATION.pack(*location[:3] + tuple(
+                NAN if value is None else value for value in location[3:])))
+        binary_file.write(bytes(blob))
+    return len(ranges)
+
+
+def _float(value):
+    return float(value) if value else None
+
+
+class RangeTable(object):
+    """A memory-mapped range table written by convert."""
+
+    def __init__(self, path):
+        """Map the range table at path into memory."""
+        with open(path, 'rb') as binary_file:
+            self._map = mmap.mmap(binary_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        try:
+            magic, self.ranges, self.locations = HEADER.unpack_from(self._map)
+        except struct.error:
+            magic = None
+        if magic != MAGIC:
+            self._map.close()
+            raise InvalidRangeFile('%s is not a GeoIP range table.' % path)
+        self._locations_at = HEADER.size + self.ranges * RANGE.size
+        self._strings_at = self._locations_at + self.locations * LOCATION.size
+
+    def __len__(self):
+        """Return the number of ranges, the length bisect searches."""
+        return self.ranges
+
+    def __getitem__(self, index):
+        """Return the first address of the range at index."""
+        if not 0 <= index < self.ranges:
+            raise IndexError(index)
+        return self._map[HEADER.size + index * RANGE.size:
+                         HEADER.size + index * RANGE.size + 16]
+
+    def lookup(self, key):
+        """Return the Location of the range holding a 16 byte key or None."""
+        index = bisect.bisect_right(self, key) - 1
+        if index < 0:
+            return None
+        _, last, location = RANGE.unpack_from(
+            self._map, HEADER.size + index * RANGE.size)
+        if key > last:
+            return None
+        country, region, city, latitude, longitude = LOCATION.unpack_from(
+            self._map, self._locations_at + location * LOCATION.size)
+        return Location(self._string(country), self._string(region),
+                        self._string(city), _coordinate(latitude),
+                        _coordinate(longitude))
+
+    def _string(self, offset):
+        offset += self._strings_at
+        length, = STRING_LENGTH.unpack_from(self._map, offset)
+        offset += STRING_LENGTH.size
+        return self._map[offset:offset + length].decode(
+            'utf-8', 'ignore') or None
+
+    def close(self):
+        """Unmap the range table."""
+        self._map.close()
+
+
+def _coordinate(value):
+    return None if value != value else value
+
+
+class GeoIPResolver(object):
+    """Resolve the locations of addresses for an app.
+
+    The range table named by GEOIP_DATABASE is mapped on first use, and the
+    locations of the last GEOIP_CACHE_SIZE addresses looked up are cached.
+    """
+
+    def __init__(self, app):
+        """Configure the resolver from the app configuration."""
+        self.app = app
+        self.cache = LRUCache(app.config['GEOIP_CACHE_SIZE'])
+        self._table = None
+
+    @property
+    def table(self):
+        """Return the range table, None if no GEOIP_DATABASE is set."""
+        if self._table is None and self.app.config['GEOIP_DATABASE']:
+            self._table = RangeTable(self.app.config['GEOIP_DATABASE'])
+        return self._table
+
+    def locate(self, ip):
+        """Return the Location of an address or None if it is unknown."""
+        key = address_key(ip)
+        if key is None or self.table is None:
+            return None
+        location = self.cache.get(key)
+        if location is MISSING:
+            location = self.table.lookup(key)
+            self.cache.set(key, location)
+        return location
+
+    def backfill(self, batch_size=1000):
+        """Locate the logs written without a location.
+
+        The logs are walked in batches of batch_size by id, each batch is
+        updated with one executemany. Returns the number of logs located.
+        """
+        from app import db
+        from app.models import UrlActivityLogs
+
+        if self.table is None:
+            return 0
+        table = UrlActivityLogs.__table__
+        engine = db.get_engine(self.app)
+        located, last_id = 0, 0
+        while True:
+            with engine.begin() as connection:
+                rows = connection.execute(
+                    select([table.c.id, table.c.packed_ip]).where(and_(
+                        table.c.id > last_id,
+                        table.c.country_name.is_(None))).order_by(
+                        table.c.id).limit(batch_size)).fetchall()
+                if not rows:
+                    return located
+                params = []
+                for row_id, packed_ip in rows:
+                    location = self.locate(packed_ip)
+                    if location is not None:
+                        params.append(dict(
+                            [('located_%s' % name, value) for name, value
+                             in zip(Location._fields, location)],
+                            log_id=row_id))
+                if params:
+                    connection.execute(
+                        table.update().where(
+                            table.c.id == bindparam('log_id')).values(
+                            {name: bindparam('located_%s' % name)
+                             for name in Location._fields}), params)
+                located += len(params)
+                last_id = rows[-1][0]
+
+    def stats(self):
+        """Return the cache counters of the resolver."""
+        return {'hits': self.cache.hits, 'misses': self.cache.misses,
+                'size': len(self.cache)}
+
+
+class GeoIP(object):
+    """Locate the visitors of short_urls from a local range table."""
+
+    def __init__(self, app=None):
+        """Initialize the extension, optionally binding it to app."""
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Create the resolver of app."""
+        app.extensions['geoip'] = GeoIPResolver(app)
+
+    @property
+    def resolver(self):
+        """Return the resolver of the current app."""
+        return current_app.extensions['geoip']
+
+    def locate(self, ip):
+        """Return the Location of an address or None if it is unknown."""
+        return self.resolver.locate(ip)
+
+    def backfill(self, batch_size=1000):
+        """Locate the logs written without a location."""
+        return self.resolver.backfill(batch_size)
+
+    def stats(self):
+        """Return the cache counters of the current app."""
+        return self.resolver.stats()
@@ -4,10 +4,16 @@ Helps keep the code base DRY.
 """
 import random
 import string
+from collections import namedtuple
 
-from flask import abort
-from .models import ShortUrl, LongUrl
-from app import db
+from flask import abort, current_app
+from sqlalchemy.exc import IntegrityError
+
+from .models import ShortUrl, LongUrl, hash_url, relationship_table
+from app import (code_allocator, db, metrics, resolve_cache,
+                 short_code_filter)
+
+SavedUrl = namedtuple('SavedUrl', ['id', 'url', 'created'])
 
 
 class UrlSaver(object):
@@ -16,10 +22,11 @@ class UrlSaver(object):
     @staticmethod
     def generate_and_save_urls(url, user, vanity_string=None):
         """Help manage the generating and saving of urls."""
-        if url in [x.url for x in user.long_urls]:
-            long_url = LongUrl.query.filter_by(url=url).first()
-            return [short_url for short_url in
-                    user.short_urls if short_url.long_url_id == long_url.id][0]
+        short_url = ShortUrl.query.join(LongUrl).filter(
+            LongUrl.url_hash == hash_url(url),
+            ShortUrl.user_id == user.id).first()
+        if short_url:
+            return short_url
 
         elif vanity_string:
             short_url = ShortUrl.query.filter_by(url=vanity_string).first()
@@ -29,30 +36,169 @@ class UrlSaver(object):
             return save_data
         else:
             short_url = UrlSaver.generate_short_url()
-            save_data = UrlSaver.save_url(short_url, url, user)
+            try:
+                save_data = UrlSaver.save_url(short_url, url, user)
+            except IntegrityError:
+                # Allocated codes can only clash with vanity strings, codes of
+                # the random allocator or codes pooled by another worker, a
+                # second clash is unlikely.
+                db.session.rollback()
+                short_url = UrlSaver.generate_short_url()
+                save_data = UrlSaver.save_url(short_url, url, user)
             return save_data
 
+    @staticmethod
+    def bulk_generate_and_save_urls(items, user):
+        """Shorten many (url, vanity_string) pairs in a single transaction.
+
+        Returns, in the order of items, a SavedUrl for every item that was
+        shortened now or earlier and an error message for every item whose
+        vanity string is already in use.
+        """
+        try:
+            return UrlSaver.bulk_save_urls(items, user)
+        except IntegrityError:
+            # See generate_and_save_urls, a second clash is unlikely.
+            db.session.rollback()
+            return UrlSaver.bulk_save_urls(items, user)
+
+    @staticmethod
+    def bulk_save_urls(items, user):
+        """Save a batch of urls with a fixed number of queries.
+
+        Existing long_urls, the short_urls the user already has for them,
+        clashing vanity strings and existing user links are each looked up
+        with one IN query, codes are allocated together and every new row is
+        inserted before a single commit.
+        """
+        urls = set(url for url, _ in items)
+        long_urls = {long_url.url: long_url for long_url in
+                     LongUrl.query.filter(LongUrl.url_hash.in_(
+                         [hash_url(url) for url in urls]))}
+        long_url_ids = [long_url.id for long_url in long_urls.values()]
+        existing, linked = {}, set()
+        if long_url_ids:
+            for short_url in ShortUrl.query.filter(
+                    ShortUrl.user_id == user.id,
+                    ShortUrl.long_url_id.in_(long_url_ids)):
+                existing.setdefault(short_url.long_url_id,
+                                    SavedUrl(short_url.id, short_url.url,
+                                             False))
+            linked = set(row[0] for row in db.session.query(
+                relationship_table.c.long_url_id).filter(
+                relationship_table.c.user_id == user.id,
+                relationship_table.c.long_url_id.in_(long_url_ids)))
+        vanity_strings = set(vanity for _, vanity in items if vanity)
+        taken = set(row[0] for row in db.session.query(ShortUrl.url).filter(
+            ShortUrl.url.in_(vanity_strings))) if vanity_strings else set()
+
+        results, new_urls, pending = [], {}, []
+        for url, vanity_string in items:
+            long_url = long_urls.get(url)
+            if long_url is not None and long_url.id in existing:
+                results.append(existing[long_url.id])
+            elif url in new_urls:
+                pending.append((len(results), url))
+                results.append(None)
+            elif vanity_string and vanity_string in taken:
+                results.append("Vanity string already in use. Pick another.")
+            else:
+                if vanity_string:
+                    taken.add(vanity_string)
+                new_urls[url] = vanity_string
+                pending.append((len(results), url))
+                results.append(None)
+        if not new_urls:
+            return results
+
+        codes = iter(UrlSaver.generate_short_urls(
+            sum(1 for vanity in new_urls.values() if not vanity)))
+        for url in new_urls:
+            if url not in long_urls:
+                long_urls[url] = LongUrl(url=url)
+                db.session.add(long_urls[url])
+        db.session.flush()
+        short_urls = {}
+        for url, vanity_string in new_urls.items():
+            short_urls[url] = ShortUrl(url=vanity_string or next(codes),
+                                       long_url_id=long_urls[url].id,
+                                       user_id=user.id)
+        db.session.add_all(short_urls.values())
+        user.count_short_urls(len(short_urls))
+        links = [{'user_id': user.id, 'long_url_id': long_urls[url].id}
+                 for url in new_urls if long_urls[url].id not in linked]
+        if links:
+            db.session.execute(relationship_table.insert(), links)
+        db.session.flush()
+        saved = {url: SavedUrl(short_url.id, short_url.url, True)
+                 for url, short_url in short_urls.items()}
+        db.session.commit()
+        for short_url in saved.values():
+            resolve_cache.invalidate(short_url.url)
+            short_code_filter.add(short_url.url)
+        metrics.inc('short_urls_created_total', len(saved), source='batch')
+        for index, url in pending:
+            results[index] = saved[url]
+        return results
+
     @staticmethod
     def save_url(short_url, url, user):
-        """Save and append short and long urls to their various tables."""
-        long_url = LongUrl.query.filter_by(url=url).first()
+        """Save and append short and long urls to their various tables.
+
+        The short_url and the link of the user to the long_url are inserted
+        directly, the user's short_urls and the long_url's users are never
+        loaded.
+        """
+        long_url = LongUrl.find_by_url(url)
 
+        linked = False
         if not long_url:
             long_url = LongUrl(url=url)
             db.session.add(long_url)
             db.session.commit()
-        shorturl = ShortUrl(url=short_url, long_url_id=long_url.id)
-        user.short_urls.append(shorturl)
-        long_url.users.append(user)
+        else:
+            linked = db.session.query(relationship_table).filter_by(
+                user_id=user.id, long_url_id=long_url.id).first() is not None
+        shorturl = ShortUrl(url=short_url, long_url_id=long_url.id,
+                            user_id=user.id)
+        db.session.add(shorturl)
+        user.count_short_urls(1)
+        if not linked:
+            db.session.execute(relationship_table.insert(), [
+                {'user_id': user.id, 'long_url_id': long_url.id}])
         db.session.commit()
+        resolve_cache.invalidate(short_url)
+        short_code_filter.add(short_url)
+        metrics.inc('short_urls_created_total', source='single')
         return shorturl
 
     @staticmethod
-    def generate_short_url(length=6):
-        """Generate a unique short_url."""
+    def generate_short_url(length=None):
+        """Generate a unique short_url.
+
+        The counter allocator hands out codes from leased id blocks and the
+        pool allocator pops pre-validated codes, neither touches the
+        short_url table. The random allocator draws codes until it finds one
+        that is not in use.
+        """
+        if current_app.config['SHORT_URL_ALLOCATOR'] != 'random':
+            return code_allocator.allocate()
+        length = length or current_app.config['SHORT_URL_LENGTH']
         short_url = ''.join(random.choice(
-            string.ascii_letters + string.digits) for _ in range(6))
+            string.ascii_letters + string.digits) for _ in range(length))
         while ShortUrl.query.filter_by(url=short_url).first():
             short_url = ''.join(random.choice(
-                string.ascii_letters + string.digits) for _ in range(6))
+                string.ascii_letters + string.digits) for _ in range(length))
         return(short_url)
+
+    @staticmethod
+    def generate_short_urls(count):
+        """Generate count unique short_urls at once."""
+        if not count:
+            return []
+        if current_app.config['SHORT_URL_ALLOCATOR'] != 'random':
+            return code_allocator.allocate_many(count)
+        short_urls = set()
+        while len(short_urls) < count:
+            short_urls.add(UrlSaver.generate_short_url())
+        return list(short_urls)
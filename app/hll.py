@@ -0,0 +1,76 @@
+"""HyperLogLog sketches estimating the number of distinct visitors.
+
+A sketch keeps 2 ** precision one byte registers, whatever the number of
+visitors added, and estimates their number within about 1.04 / sqrt(2 **
+precision), 1.6% with the default precision. Sketches of the same precision
+merge into the sketch of the union of their visitors by taking the register
+wise maximum, so the visitors of a range of days are counted from the daily
+sketches alone.
+"""
+import hashlib
+import math
+import zlib
+
+PRECISION = 12
+HASH_BITS = 64
+_POWERS = [2.0 ** -rank for rank in range(HASH_BITS + 1)]
+
+
+class HyperLogLog(object):
+    """A HyperLogLog sketch with 64 bit hashes."""
+
+    def __init__(self, precision=PRECISION, registers=None):
+        """Create an empty sketch or one holding registers."""
+        self.precision = precision
+        self.registers = (bytearray(registers) if registers is not None
+                          else bytearray(1 << precision))
+
+    @staticmethod
+    def hash(value):
+        """Return the 64 bit hash of a string."""
+        return int.from_bytes(hashlib.blake2b(
+            value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+    def add(self, value):
+        """Add a string to the sketch."""
+        self.add_hash(self.hash(value))
+
+    def add_hash(self, hashed):
+        """Add the 64 bit hash of a value to the sketch."""
+        bits = HASH_BITS - self.precision
+        index = hashed >> bits
+        rank = bits - (hashed & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """Add the values of another sketch of the same precision."""
+        if other.precision != self.precision:
+            raise ValueError('Only sketches of the same precision merge.')
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self):
+        """Return the estimated number of distinct values added."""
+        size = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / sum(
+            _POWERS[register] for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * size and zeros:
+            # Linear counting is more accurate for small cardinalities.
+            estimate = size * math.log(size / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self):
+        """Return the registers compressed for storage.
+
+        The registers of sketches holding few values are mostly zeros and
+        compress to a small fraction of their size.
+        """
+        return zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Return the sketch stored by to_bytes."""
+        registers = zlib.decompress(data)
+        return cls(len(registers).bit_length() - 1, registers)
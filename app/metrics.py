@@ -0,0 +1,243 @@
+"""Request latency histograms and counters served at /metrics.
+
+The registry keeps a shard of counters and fixed bucket histograms per
+thread. Recording a value only touches the shard of the recording thread,
+without a lock, so it is cheap enough to stay on for the redirect path. The
+shards are summed when /metrics is scraped, those of finished threads are
+folded into a single retired shard then.
+
+Besides the request latencies by endpoint and status, the redirects by
+outcome and the short_urls created, /metrics exports the stats() counters
+of the caches and of the write behind components, in the Prometheus text
+exposition format.
+"""
+import bisect
+import threading
+import time
+
+from flask import Response, current_app, g, request
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+METRICS = {
+    'http_request_duration_seconds': (
+        'histogram', 'Time spent serving requests by endpoint and status.'),
+    'redirects_total': ('counter', 'Short URL lookups by outcome.'),
+    'short_urls_created_total': ('counter', 'Short URLs created.'),
+}
+
+
+class MetricsRegistry(object):
+    """Counters and fixed bucket histograms aggregated per thread."""
+
+    def __init__(self, buckets):
+        """Create an empty registry whose histograms use buckets."""
+        self.buckets = tuple(sorted(buckets))
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def inc(self, name, amount=1, **labels):
+        """Add amount to the counter name with labels."""
+        shard = self._shard()
+        key = (name, tuple(sorted(labels.items())))
+        shard[key] = shard.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        """Add value to the histogram name with labels."""
+        shard = self._shard()
+        key = (name, tuple(sorted(labels.items())))
+        series = shard.get(key)
+        if series is None:
+            series = shard[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def collect(self):
+        """Return the sum of every shard, keyed on (name, labels)."""
+        with self._lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    _merge(self._retired, shard)
+            self._shards = live
+            totals = {}
+            _merge(totals, self._retired)
+            for _, shard in live:
+                _merge(totals, dict(shard))
+        return totals
+
+
+def _merge(totals, shard):
+    for key, value in shard.items():
+        if isinstance(value, list):
+            series = totals.setdefault(key, [0] * (len(value) - 1) + [0.0])
+            for index, count in enumerate(value):
+                series[index] += count
+        else:
+            totals[key] = totals.get(key, 0) + value
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\').replace(
+            '"', '\\"').replace('\n', '\\n')) for name, value in pairs)
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value) if value != float('inf') else '+Inf'
+    return str(value)
+
+
+def component_stats():
+    """Return (metric, type, help, [(labels, value)]) of the components."""
+    from app import (activity_log_writer, code_allocator, geoip,
+                     resolve_cache, short_code_filter, token_cache,
+                     user_agent_cache, visit_counter)
+
+    tokens = token_cache.stats()
+    activity = activity_log_writer.stats()
+    caches = [('resolve', resolve_cache.stats()),
+              ('token', tokens['tokens']), ('token_user', tokens['users']),
+              ('user_agent', user_agent_cache.stats()),
+              ('geoip', geoip.stats()),
+              ('intern', {'hits': activity.pop('intern_hits'),
+                          'misses': activity.pop('intern_misses')})]
+    metrics = [
+        ('cache_hits_total', 'counter', 'Cache lookups that hit.',
+         [((('cache', name),), stats['hits']) for name, stats in caches]),
+        ('cache_misses_total', 'counter', 'Cache lookups that missed.',
+         [((('cache', name),), stats['misses']) for name, stats in caches]),
+        ('cache_entries', 'gauge', 'Entries held by the cache.',
+         [((('cache', name),), stats['size']) for name, stats in caches
+          if 'size' in stats])]
+    for component, stats in [('activity_log', activity),
+                             ('visit_counter', visit_counter.stats()),
+                             ('code_allocator', code_allocator.stats()),
+                             ('short_code_filter',
+                              short_code_filter.stats())]:
+        for key, value in sorted(stats.items()):
+            metrics.append(('%s_%s' % (component, key), 'gauge',
+                            'The %s of the %s.' % (key.replace('_', ' '),
+                                                   component.replace(
+                                                       '_', ' ')),
+                            [((), value)]))
+    return metrics
+
+
+def exposition(registry, stats=()):
+    """Return the registry and the stats metrics in text format.
+
+    stats holds (metric, type, help, [(labels, value)]) like the result of
+    component_stats.
+    """
+    totals = registry.collect()
+    lines = []
+    for name in sorted(METRICS):
+        kind, description = METRICS[name]
+        lines.append('# HELP %s %s' % (name, description))
+        lines.append('# TYPE %s %s' % (name, kind))
+        for (metric, labels), value in sorted(totals.items()):
+            if metric != name:
+                continue
+            if kind != 'histogram':
+                lines.append('%s%s %s' % (name, _labels(labels),
+                                          _number(value)))
+                continue
+            cumulative = 0
+            for bound, count in zip(registry.buckets + (float('inf'),),
+                                    value):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (
+                    name, _labels(labels + (('le', _number(
+                        float(bound))),)), cumulative))
+            lines.append('%s_sum%s %s' % (name, _labels(labels),
+                                          _number(value[-1])))
+            lines.append('%s_count%s %d' % (name, _labels(labels),
+                                            cumulative))
+    for name, kind, description, samples in stats:
+        lines.append('# HELP %s %s' % (name, description))
+        lines.append('# TYPE %s %s' % (name, kind))
+        for labels, value in samples:
+            lines.append('%s%s %s' % (name, _labels(labels), _number(value)))
+    return '\n'.join(lines) + '\n'
+
+
+class Metrics(object):
+    """Record request latencies and counters and serve them at /metrics."""
+
+    def __init__(self, app=None):
+        """Initialize the extension, optionally binding it to app."""
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Create the registry of app and register its hooks and route."""
+        app.extensions['metrics'] = MetricsRegistry(
+            app.config['METRICS_BUCKETS'])
+        if not app.config['METRICS_ENABLED']:
+            return
+        app.before_request(self.start)
+        app.after_request(self.finish)
+        app.teardown_request(self.fail)
+        app.add_url_rule('/metrics', 'metrics', self.serve)
+
+    @property
+    def registry(self):
+        """Return the registry of the current app."""
+        return current_app.extensions['metrics']
+
+    def inc(self, name, amount=1, **labels):
+        """Add amount to a counter of the current app."""
+        if current_app.config['METRICS_ENABLED']:
+            self.registry.inc(name, amount, **labels)
+
+    def observe_request(self, endpoint, status, duration):
+        """Record the latency of a request of the current app."""
+        if current_app.config['METRICS_ENABLED']:
+            self.registry.observe('http_request_duration_seconds', duration,
+                                  endpoint=endpoint, status=status)
+
+    @staticmethod
+    def start():
+        """Note when a request started."""
+        g.metrics_started = time.perf_counter()
+
+    def finish(self, response):
+        """Record the latency of a request by endpoint and status."""
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            self.observe_request(request.endpoint or 'unmatched',
+                                 response.status_code,
+                                 time.perf_counter() - started)
+        return response
+
+    def fail(self, exception=None):
+        """Record a request that raised before its response as a 500.
+
+        Flask skips the after_request hooks when a view raises an unhandled
+        exception, the teardown hooks always run.
+        """
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            self.observe_request(request.endpoint or 'unmatched', 500,
+                                 time.perf_counter() - started)
+
+    def serve(self):
+        """Serve the metrics of the current app."""
+        return Response(exposition(self.registry, component_stats()),
+                        content_type=CONTENT_TYPE)
@@ -1,4 +1,8 @@
 """SQLalchemy database models."""
+import hashlib
+import ipaddress
+from datetime import datetime
+
 from flask import current_app
 from flask_login import AnonymousUserMixin, UserMixin
 from itsdangerous import (TimedJSONWebSignatureSerializer
@@ -6,7 +10,15 @@ from itsdangerous import (TimedJSONWebSignatureSerializer
 from werkzeug.security import generate_password_hash, check_password_hash
 
 from . import login_manager
-from app import db
+from app import (activity_log_writer, db, metrics, resolve_cache,
+                 short_code_filter, token_cache, user_agent_cache,
+                 visit_counter)
+from app.cache import MISSING, ResolvedUrl
+from app.pagination import paginate, paginate_nulls_last
+
+# The columns of the users kept by the token cache, changing any of them
+# drops the user from it.
+CACHED_USER_COLUMNS = ('first_name', 'last_name', 'email', 'password_hash')
 
 relationship_table = db.Table('relationship',
                               db.Column('user_id', db.Integer,
@@ -14,18 +26,45 @@ relationship_table = db.Table('relationship',
                                         nullable=False),
                               db.Column('long_url_id', db.Integer,
                                         db.ForeignKey('long_url.id'),
-                                        nullable=False))
+                                        nullable=False),
+                              db.Index('ix_relationship_user_id_long_url_id',
+                                       'user_id', 'long_url_id'))
+
+
+def hash_url(url):
+    """Return the fixed width hash under which a long_url is indexed."""
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+def pack_ip(ip):
+    """Return the 4 or 16 bytes of an IPv4 or IPv6 address.
+
+    Returns None for a missing or malformed address.
+    """
+    try:
+        return ipaddress.ip_address(ip).packed
+    except ValueError:
+        return None
+
+
+def unpack_ip(packed):
+    """Return the text form of an address packed by pack_ip."""
+    return str(ipaddress.ip_address(packed)) if packed else None
 
 
 class User(UserMixin, db.Model):
     """Map the User class to the users table in the database."""
 
     __tablename__ = 'users'
+    __table_args__ = (db.Index('ix_users_short_url_count_id',
+                               'short_url_count', 'id'),)
     id = db.Column(db.Integer, primary_key=True)
     first_name = db.Column(db.String(20), nullable=False)
     last_name = db.Column(db.String(20), nullable=False)
     email = db.Column(db.String(64), unique=True, index=True, nullable=False)
     password_hash = db.Column(db.String(128))
+    short_url_count = db.Column(db.Integer, nullable=False, default=0,
+                                server_default='0')
     short_urls = db.relationship("ShortUrl", back_populates="user")
     long_urls = db.relationship("LongUrl", secondary=relationship_table,
                                 back_populates="users")
@@ -57,17 +96,55 @@ class User(UserMixin, db.Model):
 
     @staticmethod
     def verify_auth_token(token):
-        """Verify token."""
-        s = Serializer(current_app.config['SECRET_KEY'])
-        try:
-            data = s.loads(token)
-        except SignatureExpired:
-            return None  # valid token, but expired
-        except BadSignature:
-            return None  # invalid token
-        user = User.query.get(data['id'])
+        """Verify token and return its user, None if it is not valid.
+
+        A token verified recently is served from the token cache without
+        checking its signature again, and its user is merged into the
+        session from the cache without a query.
+        """
+        user_id = token_cache.user_id(token)
+        if user_id is MISSING:
+            try:
+                data, header = token_cache.serializer.loads(
+                    token, return_header=True)
+            except SignatureExpired:
+                return None  # valid token, but expired
+            except BadSignature:
+                return None  # invalid token
+            user_id = data['id']
+            token_cache.set_user_id(token, user_id, header.get('exp'))
+        user = token_cache.user(user_id)
+        if user is not MISSING:
+            return db.session.merge(user, load=False)
+        version = token_cache.version()
+        user = User.query.get(user_id)
+        if user is not None:
+            token_cache.set_user(user, version, CACHED_USER_COLUMNS)
         return user
 
+    def count_short_urls(self, delta):
+        """Add delta to short_url_count when the session is flushed.
+
+        The column is updated in SQL so concurrent requests of the same user
+        do not overwrite each other's counts.
+        """
+        self.short_url_count = User.short_url_count + delta
+
+    @staticmethod
+    def sort_users_by_short_urls(limit, offset=0, include_anonymous=False):
+        """Return the names and short_url counts of the top users.
+
+        Users are ordered on the short_url_count column, the AnonymousUser
+        that owns the short_urls of anonymous visitors is left out unless
+        include_anonymous is set.
+        """
+        query = db.session.query(User.first_name, User.last_name,
+                                 User.short_url_count)
+        if not include_anonymous:
+            query = query.filter(User.email != 'AnonymousUser')
+        return query.order_by(db.desc(User.short_url_count),
+                              User.id).limit(limit).offset(offset).all()
+
     @login_manager.user_loader
     def load_user(user_id):
         """Return a user object if available or None otherwise."""
@@ -78,6 +155,24 @@ class User(UserMixin, db.Model):
         return "<User(email='%s')>" % self.email
 
 
+@db.event.listens_for(User, 'after_update')
+def invalidate_cached_user(mapper, connection, user):
+    """Drop a user from the token cache once a cached column changed.
+
+    Updates of the other columns, like short_url_count on every shortening,
+    keep the user cached.
+    """
+    attrs = db.inspect(user).attrs
+    if any(attrs[key].history.has_changes() for key in CACHED_USER_COLUMNS):
+        token_cache.invalidate(user.id)
+
+
+@db.event.listens_for(User, 'after_delete')
+def invalidate_deleted_user(mapper, connection, user):
+    """Drop a deleted user from the token cache."""
+    token_cache.invalidate(user.id)
+
+
 class AnonymousUser(AnonymousUserMixin):
     """Create an User with AnonymousUserMixin properties."""
 
@@ -94,13 +189,19 @@ class ShortUrl(db.Model):
     """Map ShortUrl class to short_url table in the database."""
 
     __tablename__ = 'short_url'
+    __table_args__ = (db.Index('ix_short_url_user_id_long_url_id',
+                               'user_id', 'long_url_id'),
+                      db.Index('ix_short_url_deleted_no_of_visits_id',
+                               'deleted', 'no_of_visits', 'id'),
+                      db.Index('ix_short_url_deleted_date_created_id',
+                               'deleted', 'date_created', 'id'))
 
     id = db.Column(db.Integer, primary_key=True)
     url = db.Column(db.String, unique=True)
     is_active = db.Column(db.Boolean, default=True)
     no_of_visits = db.Column(db.Integer, default=0)
     deleted = db.Column(db.Boolean(), default=False, index=True)
-    date_created = db.Column(db.DateTime, default=db.func.current_timestamp(),
+    date_created = db.Column(db.DateTime, default=datetime.utcnow,
                              nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     user = db.relationship("User", back_populates="short_urls")
@@ -111,11 +212,11 @@ class ShortUrl(db.Model):
 
     def change_long_url(self, long_url, user):
         """Change the target url of a short_url and commit to database."""
-        new_long_url = LongUrl.query.filter_by(url=long_url).first()
+        new_long_url = LongUrl.find_by_url(long_url)
         old_long_url = self.long_url
-        if new_long_url in user.long_urls:
-            short_url = [short_url for short_url in user.short_urls if
-                         short_url.long_url_id == new_long_url.id][0]
+        short_url = new_long_url and ShortUrl.find_for_user(
+            new_long_url.id, user.id)
+        if short_url:
             return short_url
         elif not new_long_url:
             new_long_url = LongUrl(url=long_url)
@@ -130,55 +231,115 @@ class ShortUrl(db.Model):
         new_long_url.users.append(user)
         self.no_of_visits = 0
         db.session.commit()
+        visit_counter.discard(self.id)
+        resolve_cache.invalidate(self.url)
         return True
 
     @staticmethod
-    def sort_short_url_by_date_added():
+    def find_owned(id, user_id, include_deleted=True):
+        """Return the short_url with id if user_id owns it, None otherwise.
+
+        A single lookup on the primary key, the user's other short_urls are
+        never loaded.
+        """
+        query = ShortUrl.query.filter_by(id=id, user_id=user_id)
+        if not include_deleted:
+            query = query.filter_by(deleted=False)
+        return query.first()
+
+    @staticmethod
+    def find_for_user(long_url_id, user_id):
+        """Return the short_url a user already has for a long_url or None."""
+        return ShortUrl.query.filter_by(user_id=user_id,
+                                        long_url_id=long_url_id).first()
+
+    @staticmethod
+    def sort_short_url_by_date_added(limit, after=None):
         """Sort the short_urls based on how recently they were added.
 
-        Sorts the list of short_urls queried from the ShortUrl
-        table based on how recently they were added.
+        Returns a page of at most limit short_urls following the cursor
+        after, sorted on how recently they were added, and the cursor of the
+        next page.
         """
-        short_urls = ShortUrl.query.order_by(
-            db.desc(ShortUrl.date_created)).filter_by(deleted=False).all()
-        return [{'Date_added': x.date_created, 'Times_visted': x.no_of_visits,
-                'short_url': x.url} for x in short_urls]
+        short_urls, next_cursor = paginate(
+            ShortUrl.query.filter_by(deleted=False),
+            [ShortUrl.date_created, ShortUrl.id], limit, after)
+        visits = visit_counter.totals(short_urls)
+        return [{'Date_added': x.date_created, 'Times_visted': visits[x.id],
+                'short_url': x.url} for x in short_urls], next_cursor
 
     @staticmethod
-    def sort_shorturl_by_popularity():
+    def sort_shorturl_by_popularity(limit, after=None):
         """Sort the short_urls based on popularity.
 
-        Sorts the list of short_urls queried from the ShortUrl
-        table based on the number of visits.
+        Returns a page of at most limit short_urls following the cursor
+        after, sorted on the number of visits, and the cursor of the next
+        page. The order follows the compacted no_of_visits column, the
+        visits reported include those still held in shards.
         """
-        short_urls = ShortUrl.query.order_by(db.desc(
-                        ShortUrl.no_of_visits)).filter_by(deleted=False).all()
-        return [{'Times_visted': x.no_of_visits, 'date_added': x.date_created,
-                'short_url': x.url} for x in short_urls]
+        short_urls, next_cursor = paginate(
+            ShortUrl.query.filter_by(deleted=False),
+            [ShortUrl.no_of_visits, ShortUrl.id], limit, after)
+        visits = visit_counter.totals(short_urls)
+        return [{'Times_visted': visits[x.id], 'date_added': x.date_created,
+                'short_url': x.url} for x in short_urls], next_cursor
+
+    @staticmethod
+    def resolve(short_url):
+        """Return the redirect details of a short_url or None if unknown.
+
+        The details are served from the resolve cache when possible, a miss
+        costs a single query joining the short_url to its long_url. Codes
+        the short code filter has never seen are unknown without a query.
+        A row read before a concurrent change is not cached once the change
+        invalidated it.
+        """
+        resolved = resolve_cache.get(short_url)
+        if resolved is not MISSING:
+            return resolved
+        if not short_code_filter.might_contain(short_url):
+            return None
+        version = resolve_cache.version()
+        row = db.session.query(ShortUrl.id, LongUrl.url, ShortUrl.long_url_id,
+                               ShortUrl.is_active, ShortUrl.deleted).join(
+            LongUrl, ShortUrl.long_url_id == LongUrl.id).filter(
+            ShortUrl.url == short_url).first()
+        resolved = ResolvedUrl(*row) if row else None
+        resolve_cache.set(short_url, resolved, version)
+        return resolved
 
     @staticmethod
     def find_url(short_url, request):
         """Query the database for a given short_url.
 
         It also counts the number of times it finds the short_url that is
-        active and not deleted.
+        active and not deleted. The visit counts and the activity log are
+        written behind so the redirect never waits on them, and the
+        User-Agent is parsed once per distinct header by the user agent
+        cache. A header it does not recognize is logged as the browser,
+        truncated to the length of the browser names, without a platform.
         """
-        short_url = ShortUrl.query.filter_by(url=short_url,
-                                             deleted=False).first()
-        if short_url and short_url.is_active:
-            short_url.no_of_visits += 1
-            short_url.long_url.no_of_visits += 1
+        short_url = ShortUrl.resolve(short_url)
+        if short_url is None:
+            metrics.inc('redirects_total', outcome='unknown')
+        elif short_url.deleted:
+            metrics.inc('redirects_total', outcome='deleted')
+        elif not short_url.is_active:
+            metrics.inc('redirects_total', outcome='inactive')
+        else:
+            metrics.inc('redirects_total', outcome='redirected')
+        if short_url and short_url.is_active and not short_url.deleted:
+            visit_counter.incr(short_url.id, short_url.long_url_id)
             ip = request.remote_addr
-            if request.user_agent:
-                browser = request.user_agent.browser
-                platform = request.user_agent.platform
+            header = request.headers.get('User-Agent', '')
+            user_agent = user_agent_cache.parse(header)
+            if user_agent.browser:
+                browser = user_agent.browser
+                platform = user_agent.platform
             else:
                 platform = None
-                browser = request.headers['User-Agent']
-            log = UrlActivityLogs(ip=ip, browser=browser, platform=platform,
-                                  short_url_id=short_url.id)
-            db.session.add(log)
-            db.session.commit()
+                browser = header[:UserAgentBrowser.name.type.length] or None
+            activity_log_writer.record(short_url.id, ip, browser, platform)
         return short_url
 
     def __repr__(self):
@@ -190,24 +351,45 @@ class LongUrl(db.Model):
     """Map the LongUrl class to the long_url table in the database."""
 
     __tablename__ = 'long_url'
+    __table_args__ = (db.Index('ix_long_url_no_of_visits_id',
+                               'no_of_visits', 'id'),)
     id = db.Column(db.Integer, primary_key=True)
     url = db.Column(db.String, unique=True)
+    url_hash = db.Column(db.String(64), unique=True, index=True)
     no_of_visits = db.Column(db.Integer, default=0)
     users = db.relationship("User", secondary=relationship_table,
                             back_populates="long_urls")
     short_urls = db.relationship("ShortUrl", back_populates="long_url")
 
+    @db.validates('url')
+    def validate_url(self, key, url):
+        """Keep url_hash in step with url."""
+        self.url_hash = hash_url(url)
+        return url
+
+    @staticmethod
+    def find_by_url(url):
+        """Return the long_url with the given url or None.
+
+        The lookup goes through the index on url_hash instead of comparing
+        the unbounded url column.
+        """
+        return LongUrl.query.filter_by(url_hash=hash_url(url)).first()
+
     @staticmethod
-    def sort_longurl_by_popularity():
+    def sort_longurl_by_popularity(limit, after=None):
         """Sort the long_urls based on popularity.
 
-        Sorts the list of long_urls queried from the LongtUrl
-        table based on the number of visits.
+        Returns a page of at most limit long_urls following the cursor
+        after, sorted on the number of visits, and the cursor of the next
+        page. The order follows the compacted no_of_visits column, the
+        visits reported include those still held in shards.
         """
-        long_urls = LongUrl.query.order_by(
-                                db.desc(LongUrl.no_of_visits)).all()
-        return [{'Times_visted': x.no_of_visits,
-                'long_url': x.url} for x in long_urls]
+        long_urls, next_cursor = paginate(
+            LongUrl.query, [LongUrl.no_of_visits, LongUrl.id], limit, after)
+        visits = visit_counter.totals(long_urls)
+        return [{'Times_visted': visits[x.id],
+                'long_url': x.url} for x in long_urls], next_cursor
 
     @staticmethod
     def sort_long_url_by_date_added():
@@ -230,15 +412,224 @@ class UrlActivityLogs(db.Model):
     """Map the class to the activity_logs table in the database."""
 
     __tablename__ = 'activity_logs'
+    __table_args__ = (
+        db.Index('ix_activity_logs_short_url_id_visited_at_id',
+                 'short_url_id', 'visited_at', 'id'),
+        db.Index('ix_activity_logs_visited_at_id', 'visited_at', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    ip = db.Column(db.String(15), nullable=False)
-    platform = db.Column(db.String())
-    browser = db.Column(db.String)
+    packed_ip = db.Column(db.LargeBinary(16))
+    platform_id = db.Column(db.Integer,
+                            db.ForeignKey('user_agent_platform.id'))
+    browser_id = db.Column(db.Integer, db.ForeignKey('user_agent_browser.id'))
     country_name = db.Column(db.String(64))
     region_name = db.Column(db.String(64))
     city = db.Column(db.String(64))
     latitude = db.Column(db.Float(6))
     longitude = db.Column(db.Float(6))
+    visited_at = db.Column(db.DateTime, default=datetime.utcnow)
     short_url_id = db.Column(db.Integer, db.ForeignKey('short_url.id'),
                              nullable=False)
     short_url = db.relationship("ShortUrl", back_populates="logs")
+    user_agent_platform = db.relationship("UserAgentPlatform")
+    user_agent_browser = db.relationship("UserAgentBrowser")
+
+    @property
+    def ip(self):
+        """Return the visitor's address as text."""
+        return unpack_ip(self.packed_ip)
+
+    @property
+    def platform(self):
+        """Return the name of the visitor's platform."""
+        if self.user_agent_platform:
+            return self.user_agent_platform.name
+
+    @property
+    def browser(self):
+        """Return the name of the visitor's browser."""
+        if self.user_agent_browser:
+            return self.user_agent_browser.name
+
+    @staticmethod
+    def visits_of(short_url_id, start=None, end=None):
+        """Return a query of the logs of a short_url.
+
+        Only the columns shown to its owner are read, and only the visits
+        from start on and before end when they are given. The browser and
+        platform names are joined from their lookup tables.
+        """
+        query = db.session.query(
+            UrlActivityLogs.id, UrlActivityLogs.packed_ip,
+            UserAgentBrowser.name.label('browser'),
+            UserAgentPlatform.name.label('platform'),
+            UrlActivityLogs.visited_at).outerjoin(
+            UserAgentBrowser,
+            UrlActivityLogs.browser_id == UserAgentBrowser.id).outerjoin(
+            UserAgentPlatform,
+            UrlActivityLogs.platform_id == UserAgentPlatform.id).filter(
+            UrlActivityLogs.short_url_id == short_url_id)
+        if start is not None:
+            query = query.filter(UrlActivityLogs.visited_at >= start)
+        if end is not None:
+            query = query.filter(UrlActivityLogs.visited_at < end)
+        return query
+
+    @staticmethod
+    def page_of_visits(short_url_id, limit, after=None, start=None,
+                       end=None):
+        """Return a page of the logs of a short_url, latest first.
+
+        Returns at most limit logs following the cursor after and the cursor
+        of the next page. Logs written before visit times were recorded
+        have none, they come last and only outside a time range.
+        """
+        return paginate_nulls_last(
+            UrlActivityLogs.visits_of(short_url_id, start, end),
+            [UrlActivityLogs.visited_at, UrlActivityLogs.id], limit, after)
+
+    @staticmethod
+    def chunks_of_visits(short_url_id, chunk_size, start=None, end=None):
+        """Yield all the logs of a short_url a page of chunk_size at a time.
+
+        Every chunk is a separate keyset query, so exporting the logs of a
+        busy short_url never holds more than one chunk in memory.
+        """
+        after = None
+        while True:
+            logs, after = UrlActivityLogs.page_of_visits(
+                short_url_id, chunk_size, after, start, end)
+            if logs:
+                yield logs
+            if after is None:
+                return
+
+
+class UserAgentBrowser(db.Model):
+    """Map the UserAgentBrowser class to the user_agent_browser table.
+
+    Each browser name is stored once, activity logs refer to it by id.
+    """
+
+    __tablename__ = 'user_agent_browser'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(255), unique=True, nullable=False)
+
+
+class UserAgentPlatform(db.Model):
+    """Map the UserAgentPlatform class to the user_agent_platform table.
+
+    Each platform name is stored once, activity logs refer to it by id.
+    """
+
+    __tablename__ = 'user_agent_platform'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(255), unique=True, nullable=False)
+
+
+class ActivityLogArchive(db.Model):
+    """Map the ActivityLogArchive class to the activity_log_archive table.
+
+    Each row locates the gzip member of a segment file holding the archived
+    logs of a short_url visited from first_visit to last_visit.
+    """
+
+    __tablename__ = 'activity_log_archive'
+    __table_args__ = (
+        db.Index('ix_activity_log_archive_short_url_id_last_visit',
+                 'short_url_id', 'last_visit'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    segment = db.Column(db.String(255), nullable=False)
+    short_url_id = db.Column(db.Integer, db.ForeignKey('short_url.id'),
+                             nullable=False)
+    first_visit = db.Column(db.DateTime, nullable=False)
+    last_visit = db.Column(db.DateTime, nullable=False)
+    logs = db.Column(db.Integer, nullable=False)
+    position = db.Column(db.BigInteger, nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+
+
+class CodeSequence(db.Model):
+    """Map the CodeSequence class to the code_sequence table.
+
+    Each row is a named counter from which workers lease blocks of ids to
+    turn into short_url codes.
+    """
+
+    __tablename__ = 'code_sequence'
+    name = db.Column(db.String(32), primary_key=True)
+    next_value = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+class VisitCountShard(db.Model):
+    """Map the VisitCountShard class to the visit_count_shard table.
+
+    Each row holds part of the visits of a short_url or long_url, named by
+    table_name and row_id, that were not compacted into its no_of_visits yet.
+    """
+
+    __tablename__ = 'visit_count_shard'
+    table_name = db.Column(db.String(16), primary_key=True)
+    row_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    shard = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    visits = db.Column(db.Integer, nullable=False, default=0)
+
+
+class VisitRollupHourly(db.Model):
+    """Map the VisitRollupHourly class to the visit_rollup_hourly table.
+
+    Each row counts the visits to a short_url from a platform and browser
+    during the hour starting at bucket.
+    """
+
+    __tablename__ = 'visit_rollup_hourly'
+    short_url_id = db.Column(db.Integer, db.ForeignKey('short_url.id'),
+                             primary_key=True, autoincrement=False)
+    bucket = db.Column(db.DateTime, primary_key=True)
+    platform = db.Column(db.String(32), primary_key=True)
+    browser = db.Column(db.String(64), primary_key=True)
+    visits = db.Column(db.Integer, nullable=False, default=0)
+
+
+class VisitRollupDaily(db.Model):
+    """Map the VisitRollupDaily class to the visit_rollup_daily table.
+
+    Each row counts the visits to a short_url from a platform and browser
+    during the day starting at bucket.
+    """
+
+    __tablename__ = 'visit_rollup_daily'
+    short_url_id = db.Column(db.Integer, db.ForeignKey('short_url.id'),
+                             primary_key=True, autoincrement=False)
+    bucket = db.Column(db.DateTime, primary_key=True)
+    platform = db.Column(db.String(32), primary_key=True)
+    browser = db.Column(db.String(64), primary_key=True)
+    visits = db.Column(db.Integer, nullable=False, default=0)
+
+
+class VisitorSketch(db.Model):
+    """Map the VisitorSketch class to the visitor_sketch table.
+
+    Each row holds the compressed HyperLogLog registers counting all the
+    distinct visitors of a short_url.
+    """
+
+    __tablename__ = 'visitor_sketch'
+    short_url_id = db.Column(db.Integer, db.ForeignKey('short_url.id'),
+                             primary_key=True, autoincrement=False)
+    registers = db.Column(db.LargeBinary, nullable=False)
+
+
+class VisitorSketchDaily(db.Model):
+    """Map the VisitorSketchDaily class to the visitor_sketch_daily table.
+
+    Each row holds the compressed HyperLogLog registers counting the distinct
+    visitors of a short_url during the day starting at day.
+    """
+
+    __tablename__ = 'visitor_sketch_daily'
+    short_url_id = db.Column(db.Integer, db.ForeignKey('short_url.id'),
+                             primary_key=True, autoincrement=False)
+    day = db.Column(db.DateTime, primary_key=True)
+    registers = db.Column(db.LargeBinary, nullable=False)
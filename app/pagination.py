@@ -0,0 +1,109 @@
+"""Keyset pagination of the url listings.
+
+A page is selected with ``WHERE (key, id) < (:key, :id)`` over an index on
+(key, id) instead of an OFFSET, so reading a page deep into a listing costs
+the same as reading the first one. Clients receive the position after the
+last row of a page as an opaque cursor and send it back to get the next one.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from sqlalchemy import DateTime, and_, or_
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor was not produced by encode_cursor."""
+
+
+def encode_cursor(values):
+    """Return an opaque cursor holding the key values of a row."""
+    values = [value.strftime(DATETIME_FORMAT) if isinstance(value, datetime)
+              else value for value in values]
+    return base64.urlsafe_b64encode(
+        json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, columns):
+    """Return the key values held by a cursor for the given columns."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(
+            cursor.encode('ascii')).decode('utf-8'))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise InvalidCursor(cursor)
+        return [_load(column, value) for column, value in zip(columns, values)]
+    except (TypeError, ValueError, binascii.Error):
+        raise InvalidCursor(cursor)
+
+
+def _load(column, value):
+    if value is None and column.nullable:
+        return None
+    if isinstance(column.type, DateTime):
+        return datetime.strptime(value, DATETIME_FORMAT)
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise InvalidCursor(value)
+    return value
+
+
+def _before(columns, values):
+    """Spell out the row value comparison columns < values.
+
+    Not every backend supports comparing row values, and the expanded form
+    still lets the index on the columns narrow the scan.
+    """
+    if len(columns) == 1:
+        return columns[0] < values[0]
+    return or_(columns[0] < values[0],
+               and_(columns[0] == values[0],
+                    _before(columns[1:], values[1:])))
+
+
+def _page(query, columns, count, values=None):
+    """Return count rows of query following values in descending order."""
+    if values is not None:
+        query = query.filter(_before(columns, values))
+    return query.order_by(*[column.desc() for column in columns]).limit(
+        count).all()
+
+
+def _next(rows, columns, limit):
+    """Return the page of rows and the cursor of the next page."""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor([getattr(rows[-1], column.key)
+                                for column in columns])
+
+
+def paginate(query, columns, limit, after=None):
+    """Return a page of query in descending order of columns.
+
+    The last column must be unique so the order is total. Returns the rows of
+    the page and the cursor of the next page, None on the last page. Raises
+    InvalidCursor if after cannot be decoded.
+    """
+    values = decode_cursor(after, columns) if after else None
+    return _next(_page(query, columns, limit + 1, values), columns, limit)
+
+
+def paginate_nulls_last(query, columns, limit, after=None):
+    """Return a page of query like paginate, the first column may be NULL.
+
+    Rows whose first column is NULL follow all the others, in descending
+    order of the remaining columns. Each part is read with its own keyset
+    query, so both keep using the index on the columns.
+    """
+    values = decode_cursor(after, columns) if after else None
+    rows = []
+    if values is None or values[0] is not None:
+        rows = _page(query.filter(columns[0].isnot(None)), columns,
+                     limit + 1, values)
+    if len(rows) <= limit:
+        rows += _page(query.filter(columns[0].is_(None)), columns[1:],
+                      limit + 1 - len(rows),
+                      values[1:] if values and values[0] is None else None)
+    return _next(rows, columns, limit)
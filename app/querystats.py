@@ -0,0 +1,147 @@
+"""Count and time the SQL queries run while serving a request.
+
+Lazy relationship loads inside loops turn one query into one per row, which
+only shows up as latency once the tables grow. With QUERY_STATS_ENABLED the
+queries run by the thread serving a request are counted and timed through
+SQLAlchemy engine events. The totals are sent back in the X-Query-Count and
+X-Query-Time response headers and logged as one JSON line per request, along
+with the statements run at least QUERY_STATS_REPEAT_THRESHOLD times, the
+usual sign of an N+1 query. Queries of background threads are not counted,
+nor those of a response streamed after the view returned.
+
+count_queries collects the queries of any block of code the same way, the
+tests use it to keep every endpoint within a query budget.
+"""
+import json
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_local = threading.local()
+
+
+class QueryStats(object):
+    """The number, duration and statements of the queries of a block."""
+
+    def __init__(self):
+        """Start with no queries."""
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def record(self, statement, duration):
+        """Add a query that took duration seconds."""
+        self.count += 1
+        self.duration += duration
+        self.statements[statement] += 1
+
+    def repeated(self, threshold):
+        """Return (statement, times) of the statements run threshold times."""
+        return [(statement, times) for statement, times in
+                self.statements.most_common() if times >= threshold]
+
+
+def _collectors():
+    try:
+        return _local.collectors
+    except AttributeError:
+        _local.collectors = []
+        return _local.collectors
+
+
+def _before_cursor_execute(connection, cursor, statement, parameters,
+                           context, executemany):
+    if _collectors():
+        connection.info.setdefault('query_started', []).append(
+            time.perf_counter())
+
+
+def _after_cursor_execute(connection, cursor, statement, parameters,
+                          context, executemany):
+    collectors = _collectors()
+    if not collectors:
+        return
+    started = connection.info.get('query_started')
+    if not started:
+        return
+    duration = time.perf_counter() - started.pop()
+    for stats in collectors:
+        stats.record(statement, duration)
+
+
+def listen():
+    """Listen to the queries of every engine, once."""
+    if not event.contains(Engine, 'before_cursor_execute',
+                          _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+@contextmanager
+def count_queries():
+    """Collect the queries the current thread runs inside the block."""
+    listen()
+    stats = QueryStats()
+    _collectors().append(stats)
+    try:
+        yield stats
+    finally:
+        _collectors().remove(stats)
+
+
+class QueryCounter(object):
+    """Report the queries run by each request of an app."""
+
+    def __init__(self, app=None):
+        """Initialize the extension, optionally binding it to app."""
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Register the request hooks of app if QUERY_STATS_ENABLED."""
+        if not app.config['QUERY_STATS_ENABLED']:
+            return
+        listen()
+        app.before_request(self.start)
+        app.after_request(self.report)
+        app.teardown_request(self.stop)
+
+    @staticmethod
+    def start():
+        """Start collecting the queries of a request."""
+        g.query_stats = QueryStats()
+        _collectors().append(g.query_stats)
+
+    @staticmethod
+    def stop(exception=None):
+        """Stop collecting the queries of a request."""
+        stats = g.pop('query_stats', None)
+        if stats is not None and stats in _collectors():
+            _collectors().remove(stats)
+        return stats
+
+    def report(self, response):
+        """Add the query totals of a request to its response and log them."""
+        stats = self.stop()
+        if stats is None:
+            return response
+        threshold = current_app.config['QUERY_STATS_REPEAT_THRESHOLD']
+        repeated = stats.repeated(threshold)
+        response.headers['X-Query-Count'] = str(stats.count)
+        response.headers['X-Query-Time'] = '%.3f' % (stats.duration * 1000)
+        line = json.dumps({
+            'method': request.method, 'path': request.path,
+            'status': response.status_code, 'queries': stats.count,
+            'query_time_ms': round(stats.duration * 1000, 3),
+            'repeated': [{'statement': statement, 'times': times}
+                         for statement, times in repeated]})
+        if repeated:
+            current_app.logger.warning(line)
+        else:
+            current_app.logger.info(line)
+        return response
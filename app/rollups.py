@@ -0,0 +1,195 @@
+"""Hourly and daily rollups of the visits to short_urls.
+
+Every batch of activity logs written also adds its visits to a row per
+short_url, bucket, platform and browser in the hourly and daily rollup
+tables, and its visitors to the HyperLogLog sketches of each short_url and
+day, in the same transaction. Visit statistics are read from the rollups and
+sketches only, so they never scan the activity logs.
+"""
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from sqlalchemy import and_, bindparam, select
+
+from app.hll import HyperLogLog
+
+GRANULARITIES = ('hour', 'day')
+UNKNOWN = 'unknown'
+
+
+def bucket_start(moment, granularity):
+    """Return the start of the hour or day moment falls in."""
+    if granularity == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def bucket_size(granularity):
+    """Return the length of a bucket."""
+    return timedelta(hours=1) if granularity == 'hour' else timedelta(days=1)
+
+
+def rollup_tables():
+    """Return the rollup tables by granularity."""
+    from app.models import VisitRollupDaily, VisitRollupHourly
+    return {'hour': VisitRollupHourly.__table__,
+            'day': VisitRollupDaily.__table__}
+
+
+def label(value, length):
+    """Return the value stored for a platform or browser."""
+    return (value or UNKNOWN)[:length]
+
+
+def update_rollups(connection, rows):
+    """Add the visits of activity log rows to the rollup tables.
+
+    Each table gets one SELECT for the rows that already exist, one
+    executemany UPDATE adding to them and one executemany INSERT for the
+    rest. A row inserted concurrently by another writer raises an
+    IntegrityError, the caller retries the batch.
+    """
+    tables = rollup_tables()
+    for granularity, table in tables.items():
+        visits = Counter(
+            (row['short_url_id'], bucket_start(row['visited_at'], granularity),
+             label(row.get('platform'), table.c.platform.type.length),
+             label(row.get('browser'), table.c.browser.type.length))
+            for row in rows)
+        short_url_ids = set(key[0] for key in visits)
+        buckets = set(key[1] for key in visits)
+        existing = set(tuple(row) for row in connection.execute(
+            select([table.c.short_url_id, table.c.bucket, table.c.platform,
+                    table.c.browser]).where(and_(
+                        table.c.short_url_id.in_(short_url_ids),
+                        table.c.bucket.in_(buckets)))))
+        params = [{'rollup_short_url': key[0], 'rollup_bucket': key[1],
+                   'rollup_platform': key[2], 'rollup_browser': key[3],
+                   'delta': visits[key]}
+                  for key in sorted(visits) if key in existing]
+        if params:
+            connection.execute(
+                table.update().where(and_(
+                    table.c.short_url_id == bindparam('rollup_short_url'),
+                    table.c.bucket == bindparam('rollup_bucket'),
+                    table.c.platform == bindparam('rollup_platform'),
+                    table.c.browser == bindparam('rollup_browser'))).values(
+                    visits=table.c.visits + bindparam('delta')), params)
+        new_rows = [{'short_url_id': key[0], 'bucket': key[1],
+                     'platform': key[2], 'browser': key[3],
+                     'visits': visits[key]}
+                    for key in sorted(visits) if key not in existing]
+        if new_rows:
+            connection.execute(table.insert(), new_rows)
+
+
+def visitor(row):
+    """Return the string identifying the visitor of a log row."""
+    return '%s|%s|%s' % (row.get('ip'), row.get('browser'),
+                         row.get('platform'))
+
+
+def update_sketches(connection, rows):
+    """Add the visitors of activity log rows to the sketches.
+
+    Every short_url has a sketch of all its visitors and one per day.
+    """
+    from app.models import VisitorSketch, VisitorSketchDaily
+
+    totals, daily = defaultdict(HyperLogLog), defaultdict(HyperLogLog)
+    for row in rows:
+        hashed = HyperLogLog.hash(visitor(row))
+        totals[(row['short_url_id'],)].add_hash(hashed)
+        daily[(row['short_url_id'],
+               bucket_start(row['visited_at'], 'day'))].add_hash(hashed)
+    merge_sketches(connection, VisitorSketch.__table__, ['short_url_id'],
+                   totals)
+    merge_sketches(connection, VisitorSketchDaily.__table__,
+                   ['short_url_id', 'day'], daily)
+
+
+def merge_sketches(connection, table, key_names, sketches):
+    """Merge sketches into the rows of table they are keyed by.
+
+    The stored sketches are locked while they are read and merged, so
+    concurrent writers do not overwrite each other's registers.
+    """
+    columns = [table.c[name] for name in key_names]
+    stored = connection.execute(
+        select(columns + [table.c.registers]).where(and_(*[
+            column.in_(set(key[number] for key in sketches))
+            for number, column in enumerate(columns)])).with_for_update())
+    existing = set()
+    for row in stored:
+        key = tuple(row[:-1])
+        if key in sketches:
+            sketches[key].merge(HyperLogLog.from_bytes(row[-1]))
+            existing.add(key)
+    params = [dict([('sketch_%s' % name, value)
+                    for name, value in zip(key_names, key)] +
+                   [('merged', sketches[key].to_bytes())])
+              for key in sorted(existing)]
+    if params:
+        connection.execute(
+            table.update().where(and_(*[
+                column == bindparam('sketch_%s' % column.name)
+                for column in columns])).values(
+                registers=bindparam('merged')), params)
+    new_rows = [dict(list(zip(key_names, key)) +
+                     [('registers', sketches[key].to_bytes())])
+                for key in sorted(sketches) if key not in existing]
+    if new_rows:
+        connection.execute(table.insert(), new_rows)
+
+
+def unique_visitors(short_url_id, start=None, end=None):
+    """Return the estimated number of distinct visitors of a short_url.
+
+    Without a range the sketch of all visitors is read, otherwise the daily
+    sketches of the days overlapping start to end are merged.
+    """
+    from app import db
+    from app.models import VisitorSketch, VisitorSketchDaily
+
+    if start is None:
+        table = VisitorSketch.__table__
+        query = select([table.c.registers]).where(
+            table.c.short_url_id == short_url_id)
+    else:
+        table = VisitorSketchDaily.__table__
+        query = select([table.c.registers]).where(and_(
+            table.c.short_url_id == short_url_id,
+            table.c.day >= bucket_start(start, 'day'), table.c.day < end))
+    sketch = HyperLogLog()
+    for registers, in db.session.execute(query):
+        sketch.merge(HyperLogLog.from_bytes(registers))
+    return sketch.estimate()
+
+
+def visit_stats(short_url_id, start, end, granularity):
+    """Return the visits of a short_url between start and end.
+
+    The visits are totalled per bucket, platform and browser from the rollup
+    table of the granularity. Buckets starting before end whose start is not
+    before the bucket of start are included.
+    """
+    from app import db
+
+    table = rollup_tables()[granularity]
+    rows = db.session.execute(
+        select([table.c.bucket, table.c.platform, table.c.browser,
+                table.c.visits]).where(and_(
+                    table.c.short_url_id == short_url_id,
+                    table.c.bucket >= bucket_start(start, granularity),
+                    table.c.bucket < end)).order_by(table.c.bucket))
+    buckets = defaultdict(int)
+    platforms, browsers = Counter(), Counter()
+    for bucket, platform, browser, visits in rows:
+        buckets[bucket] += visits
+        platforms[platform] += visits
+        browsers[browser] += visits
+    return {'total': sum(buckets.values()),
+            'unique_visitors': unique_visitors(short_url_id, start, end),
+            'buckets': [{'start': bucket.isoformat(), 'visits': visits}
+                        for bucket, visits in sorted(buckets.items())],
+            'platforms': dict(platforms), 'browsers': dict(browsers)}
@@ -0,0 +1,109 @@
+"""Compare the ways of building the visit breakdown of a short_url.
+
+Run it from the project root with ``python -m benchmarks.breakdowns``.
+The app is created with the benchmark configuration, set BENCH_DATABASE_URL
+to benchmark against something other than a local SQLite file.
+"""
+import argparse
+import random
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from app import create_app, db
+from app.analytics import breakdown
+from app.models import (LongUrl, ShortUrl, UrlActivityLogs, User,
+                        UserAgentBrowser, UserAgentPlatform, hash_url)
+
+BROWSERS = ['chrome', 'firefox', 'safari', 'opera', 'msie', 'edge']
+PLATFORMS = ['windows', 'linux', 'macos', 'android', 'iphone', None]
+COUNTRIES = ['Nigeria', 'Kenya', 'Ghana', 'Egypt', 'South Africa', None]
+CHUNK = 10000
+
+
+def seed(rows, days):
+    """Insert a short_url with rows visits spread over days."""
+    db.drop_all()
+    db.create_all()
+    now = datetime.utcnow()
+    db.session.execute(User.__table__.insert(), [
+        {'id': 1, 'first_name': 'user', 'last_name': 'bench',
+         'email': 'user@mark.com', 'short_url_count': 1}])
+    db.session.execute(LongUrl.__table__.insert(), [
+        {'id': 1, 'url': 'http://www.example.com',
+         'url_hash': hash_url('http://www.example.com')}])
+    db.session.execute(ShortUrl.__table__.insert(), [
+        {'id': 1, 'url': 'bench', 'user_id': 1, 'long_url_id': 1,
+         'is_active': True, 'deleted': False, 'no_of_visits': rows,
+         'date_created': now}])
+    db.session.execute(UserAgentBrowser.__table__.insert(), [
+        {'id': number + 1, 'name': name}
+        for number, name in enumerate(BROWSERS)])
+    db.session.execute(UserAgentPlatform.__table__.insert(), [
+        {'id': number + 1, 'name': name}
+        for number, name in enumerate(PLATFORMS) if name])
+    seconds = days * 24 * 3600
+    for start in range(0, rows, CHUNK):
+        db.session.execute(UrlActivityLogs.__table__.insert(), [
+            {'short_url_id': 1, 'packed_ip': b'\n\x00\x00\x01',
+             'browser_id': random.randint(1, len(BROWSERS)),
+             'platform_id': random.choice([1, 2, 3, 4, 5, None]),
+             'country_name': random.choice(COUNTRIES),
+             'visited_at': now - timedelta(
+                 seconds=random.randint(1, seconds))}
+            for _ in range(min(CHUNK, rows - start))])
+    db.session.commit()
+    return now - timedelta(days=days), now
+
+
+def counter_breakdown(start, end, limit):
+    """Count the fetched log columns in Python."""
+    logs = db.session.query(
+        UrlActivityLogs.platform_id, UrlActivityLogs.browser_id,
+        UrlActivityLogs.country_name, UrlActivityLogs.visited_at).filter(
+        UrlActivityLogs.short_url_id == 1,
+        UrlActivityLogs.visited_at >= start,
+        UrlActivityLogs.visited_at < end)
+    platforms, browsers, countries = Counter(), Counter(), Counter()
+    hours = [0] * 24
+    for platform_id, browser_id, country_name, visited_at in logs:
+        platforms[platform_id] += 1
+        browsers[browser_id] += 1
+        countries[country_name] += 1
+        hours[visited_at.hour] += 1
+    return (platforms.most_common(limit), browsers.most_common(limit),
+            countries.most_common(limit), hours)
+
+
+def group_by_breakdown(start, end, limit):
+    """Count the logs with GROUP BY queries."""
+    return breakdown(start, end, limit, short_url_id=1)
+
+
+def timed(function, start, end, limit):
+    """Return the seconds function takes with a fresh session."""
+    db.session.remove()
+    started = time.perf_counter()
+    function(start, end, limit)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000000)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--limit', type=int, default=10)
+    args = parser.parse_args()
+    app = create_app('benchmark')
+    with app.app_context():
+        start, end = seed(args.rows, args.days)
+        print('%d visits over %d days, top %d' % (args.rows, args.days,
+                                                  args.limit))
+        for name, function in [('counter', counter_breakdown),
+                               ('group by', group_by_breakdown)]:
+            print('%-16s %10.3f s' % (name + ':', timed(
+                function, start, end, args.limit)))
+
+
+if __name__ == '__main__':
+    main()
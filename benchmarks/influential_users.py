@@ -0,0 +1,94 @@
+"""Compare the ways of building the influential users leaderboard.
+
+Run it from the project root with ``python -m benchmarks.influential_users``.
+The app is created with the benchmark configuration, set BENCH_DATABASE_URL
+to benchmark against something other than a local SQLite file.
+"""
+import argparse
+import random
+import time
+from datetime import datetime
+
+from app import create_app, db
+from app.models import LongUrl, ShortUrl, User, hash_url
+
+
+def seed(users, max_short_urls):
+    """Insert users with up to max_short_urls short_urls each."""
+    db.drop_all()
+    db.create_all()
+    counts = [random.randint(0, max_short_urls) for _ in range(users)]
+    db.session.execute(User.__table__.insert(), [
+        {'id': number + 1, 'first_name': 'user', 'last_name': str(number),
+         'email': 'user%d@mark.com' % number, 'short_url_count': count}
+        for number, count in enumerate(counts)])
+    short_urls = [(number + 1, len(counts) * index + number)
+                  for number, count in enumerate(counts)
+                  for index in range(count)]
+    db.session.execute(LongUrl.__table__.insert(), [
+        {'id': code + 1, 'url': 'http://www.example.com/%d' % code,
+         'url_hash': hash_url('http://www.example.com/%d' % code)}
+        for _, code in short_urls])
+    now = datetime.utcnow()
+    db.session.execute(ShortUrl.__table__.insert(), [
+        {'url': str(code), 'user_id': user_id, 'long_url_id': code + 1,
+         'is_active': True, 'deleted': False, 'no_of_visits': 0,
+         'date_created': now} for user_id, code in short_urls])
+    db.session.commit()
+    return len(short_urls)
+
+
+def relationship_counts(limit):
+    """Build the leaderboard the way the endpoint used to."""
+    users = User.query.all()
+    sorted_users = sorted(users, key=lambda user: len(user.short_urls),
+                          reverse=True)
+    return [(x.first_name, len(list(x.short_urls))) for x in sorted_users][
+        :limit]
+
+
+def group_by_counts(limit):
+    """Build the leaderboard with a GROUP BY over short_url."""
+    count = db.func.count(ShortUrl.id)
+    return db.session.query(User.first_name, count).outerjoin(
+        ShortUrl, ShortUrl.user_id == User.id).group_by(User.id).order_by(
+        db.desc(count), User.id).limit(limit).all()
+
+
+def denormalized_counts(limit):
+    """Build the leaderboard from users.short_url_count."""
+    return User.sort_users_by_short_urls(limit)
+
+
+def timed(function, limit):
+    """Return the seconds function takes with a fresh session."""
+    db.session.remove()
+    started = time.perf_counter()
+    function(limit)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--max-short-urls', type=int, default=5)
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--skip-relationship', action='store_true',
+                        help='skip the slow relationship loading variant')
+    args = parser.parse_args()
+    app = create_app('benchmark')
+    with app.app_context():
+        short_urls = seed(args.users, args.max_short_urls)
+        print('%d users, %d short_urls, top %d' % (args.users, short_urls,
+                                                   args.limit))
+        variants = [('group by', group_by_counts),
+                    ('short_url_count', denormalized_counts)]
+        if not args.skip_relationship:
+            variants.insert(0, ('relationships', relationship_counts))
+        for name, function in variants:
+            print('%-16s %10.3f s' % (name + ':', timed(function,
+                                                        args.limit)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""Compare redirect throughput with and without the fast path middleware.
+
+Run it from the project root with ``python -m benchmarks.redirect_fastpath``.
+The app is created with the benchmark configuration, set BENCH_DATABASE_URL
+to benchmark against something other than a local SQLite file.
+"""
+import argparse
+import time
+
+from app import create_app, db
+from app.fastpath import RedirectMiddleware
+from app.helper import UrlSaver
+from app.models import User
+
+
+def build_app(fast_path, short_urls):
+    """Create an app seeded with short_urls codes."""
+    app = create_app('benchmark')
+    if fast_path:
+        app.wsgi_app = RedirectMiddleware(app)
+    code_filter = app.extensions['short_code_filter']
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        user = User(first_name='bench', last_name='mark',
+                    email='bench@mark.com', password='password')
+        user.save()
+        codes = [UrlSaver.generate_and_save_urls(
+            'http://www.example.com/%d' % i, user).url
+            for i in range(short_urls)]
+        code_filter.build()
+    return app, codes
+
+
+def run(fast_path, requests, short_urls):
+    """Return the redirects per second served by the app."""
+    app, codes = build_app(fast_path, short_urls)
+    client = app.test_client()
+    paths = ['/api/v1/' + code for code in codes]
+    for path in paths:
+        client.get(path)
+    started = time.perf_counter()
+    for i in range(requests):
+        response = client.get(paths[i % len(paths)])
+        assert response.status_code == 302, response.status
+    elapsed = time.perf_counter() - started
+    app.extensions['visit_counter'].stop()
+    app.extensions['activity_log_writer'].stop()
+    return requests / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--short-urls', type=int, default=100)
+    args = parser.parse_args()
+    flask_rps = run(False, args.requests, args.short_urls)
+    fast_rps = run(True, args.requests, args.short_urls)
+    print('flask routing: %10.1f redirects/s' % flask_rps)
+    print('fast path:     %10.1f redirects/s' % fast_rps)
+    print('speedup:       %10.2fx' % (fast_rps / flask_rps))
+
+
+if __name__ == '__main__':
+    main()
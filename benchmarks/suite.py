@@ -0,0 +1,286 @@
+"""Load test the hot endpoints of the url shortener against seeded data.
+
+Run it from the project root with ``python run.py bench`` or
+``python -m benchmarks.suite``. The app is created with the benchmark
+configuration, set BENCH_DATABASE_URL to benchmark against something other
+than a local SQLite file, its tables are dropped and seeded first.
+
+Every endpoint is requested through the WSGI test client and, unless
+--skip-server is given, over HTTP against a local threaded server. The
+throughput and the p50 and p99 latencies of each are printed and written
+as JSON to bench_results/, named after the time and the git commit, so runs
+can be compared across commits. Requests are drawn from a random generator
+seeded with --seed, so two runs on the same data send the same requests.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import subprocess
+import threading
+import time
+from base64 import b64encode
+from datetime import datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from app import create_app, db
+from app.codes import base62_encode
+from app.models import (LongUrl, ShortUrl, UrlActivityLogs, User,
+                        UserAgentBrowser, UserAgentPlatform, hash_url,
+                        relationship_table)
+
+CHUNK = 10000
+BROWSERS = ['chrome', 'firefox', 'safari', 'opera', 'msie']
+PLATFORMS = ['windows', 'linux', 'macos', 'android', 'iphone']
+USER_AGENT = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+              '(KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.36')
+RESULTS_DIR = 'bench_results'
+ENDPOINTS = ['get_url', 'shorten_url', 'sort_urls', 'get_user_short_urls',
+             'get_short_url_visit_log']
+
+
+def insert(table, rows):
+    """Insert the rows of an iterable CHUNK at a time."""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK:
+            db.session.execute(table.insert(), chunk)
+            chunk = []
+    if chunk:
+        db.session.execute(table.insert(), chunk)
+
+
+def seed(users, long_urls, short_urls, logs, rng):
+    """Insert users, long_urls, short_urls and activity logs.
+
+    Short_urls are dealt to the users and long_urls in turn, their codes
+    are 7 characters long so they never clash with the 6 character codes
+    allocated while shortening. Half of the logs are visits to the first
+    short_url of the first user, whose visit log is requested, the rest are
+    spread over every short_url. Returns the codes of the short_urls.
+    """
+    db.drop_all()
+    db.create_all()
+    now = datetime.utcnow()
+    password_hash = generate_password_hash('password')
+    insert(User.__table__, (
+        {'id': number + 1, 'first_name': 'user', 'last_name': str(number),
+         'email': 'user%d@bench.com' % number,
+         'password_hash': password_hash,
+         'short_url_count': len(range(number, short_urls, users))}
+        for number in range(users)))
+    insert(LongUrl.__table__, (
+        {'id': number + 1, 'url': 'http://www.example.com/%d' % number,
+         'url_hash': hash_url('http://www.example.com/%d' % number),
+         'no_of_visits': 0}
+        for number in range(long_urls)))
+    codes = ['b' + base62_encode(number, 6) for number in range(short_urls)]
+    insert(ShortUrl.__table__, (
+        {'id': number + 1, 'url': code, 'user_id': number % users + 1,
+         'long_url_id': number % long_urls + 1, 'is_active': True,
+         'deleted': False, 'no_of_visits': 0,
+         'date_created': now - timedelta(seconds=short_urls - number)}
+        for number, code in enumerate(codes)))
+    insert(relationship_table, (
+        {'user_id': user_id, 'long_url_id': long_url_id}
+        for user_id, long_url_id in sorted(set(
+            (number % users + 1, number % long_urls + 1)
+            for number in range(short_urls)))))
+    db.session.execute(UserAgentBrowser.__table__.insert(), [
+        {'id': number + 1, 'name': name}
+        for number, name in enumerate(BROWSERS)])
+    db.session.execute(UserAgentPlatform.__table__.insert(), [
+        {'id': number + 1, 'name': name}
+        for number, name in enumerate(PLATFORMS)])
+    insert(UrlActivityLogs.__table__, (
+        {'short_url_id': 1 if number % 2 else rng.randint(1, short_urls),
+         'packed_ip': rng.getrandbits(32).to_bytes(4, 'big'),
+         'browser_id': rng.randint(1, len(BROWSERS)),
+         'platform_id': rng.randint(1, len(PLATFORMS)),
+         'visited_at': now - timedelta(seconds=rng.randint(1, 30 * 86400))}
+        for number in range(logs)))
+    db.session.commit()
+    return codes
+
+
+def requests(endpoint, codes, count, rng):
+    """Return count (method, path, body) requests of an endpoint."""
+    if endpoint == 'get_url':
+        return [('GET', '/api/v1/' + rng.choice(codes), None)
+                for _ in range(count)]
+    if endpoint == 'shorten_url':
+        run = '%x' % rng.getrandbits(32)
+        return [('POST', '/api/v1/shorten', json.dumps(
+            {'url': 'http://www.example.org/%s/%d' % (run, number)}))
+            for number in range(count)]
+    if endpoint == 'sort_urls':
+        paths = ['/api/v1/shorturl/popularity', '/api/v1/shorturl/date',
+                 '/api/v1/longurl/popularity']
+        return [('GET', rng.choice(paths), None) for _ in range(count)]
+    if endpoint == 'get_user_short_urls':
+        return [('GET', '/api/v1/user/short_urls', None)] * count
+    return [('GET', '/api/v1/shorturl/1/logs', None)] * count
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """Serve requests without logging each of them."""
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def client_sender(app):
+    """Return a function sending a request through the test client."""
+    client = app.test_client()
+
+    def send(method, path, body, headers):
+        return client.open(path, method=method, data=body,
+                           headers=headers).status_code
+    return send
+
+
+def server_sender(port):
+    """Return a function sending a request to the local server."""
+    def send(method, path, body, headers):
+        connection = http.client.HTTPConnection('127.0.0.1', port)
+        try:
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            response.read()
+            return response.status
+        finally:
+            connection.close()
+    return send
+
+
+def percentile(latencies, fraction):
+    """Return the latency below which fraction of the sorted latencies are."""
+    index = min(len(latencies) - 1, int(round(fraction * len(latencies))) - 1)
+    return latencies[max(0, index)]
+
+
+def measure(send, batch, headers, warmup):
+    """Send a batch of requests, return their throughput and latencies."""
+    for method, path, body in batch[:warmup]:
+        send(method, path, body, headers)
+    latencies, errors = [], 0
+    started = time.perf_counter()
+    for method, path, body in batch[warmup:]:
+        sent = time.perf_counter()
+        if send(method, path, body, headers) >= 400:
+            errors += 1
+        latencies.append(time.perf_counter() - sent)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {'requests': len(latencies), 'errors': errors,
+            'throughput': len(latencies) / elapsed,
+            'mean_ms': sum(latencies) / len(latencies) * 1000,
+            'p50_ms': percentile(latencies, 0.5) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000}
+
+
+def git_commit():
+    """Return the commit of the working tree or None outside git."""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(users=100, long_urls=1000, short_urls=2000, logs=20000,
+        requests_per_endpoint=500, warmup=50, endpoints=None, server=True,
+        seed_value=0, output=None):
+    """Seed the benchmark database, load test the endpoints and save.
+
+    Returns the results, which are also written to output, by default a
+    new file under bench_results.
+    """
+    rng = random.Random(seed_value)
+    app = create_app('benchmark')
+    endpoints = endpoints or ENDPOINTS
+    code_filter = app.extensions['short_code_filter']
+    with app.app_context():
+        codes = seed(users, long_urls, short_urls, logs, rng)
+        code_filter.build()
+        token = User.query.get(1).generate_auth_token(3600).decode('ascii')
+        database = db.engine.url.drivername
+    headers = {'Authorization': 'Basic ' + b64encode(
+        (token + ':').encode('utf-8')).decode('utf-8'),
+        'Accept': 'application/json', 'Content-Type': 'application/json',
+        'User-Agent': USER_AGENT}
+    targets = [('client', client_sender(app))]
+    http_server = None
+    if server:
+        http_server = make_server('127.0.0.1', 0, app, threaded=True,
+                                  request_handler=QuietRequestHandler)
+        threading.Thread(target=http_server.serve_forever,
+                         daemon=True).start()
+        targets.append(('server', server_sender(http_server.server_port)))
+    results = []
+    try:
+        for endpoint in endpoints:
+            for target, send in targets:
+                batch = requests(endpoint, codes,
+                                 warmup + requests_per_endpoint, rng)
+                result = measure(send, batch, headers, warmup)
+                result.update({'endpoint': endpoint, 'target': target})
+                results.append(result)
+                print('%-24s %-6s %8.1f req/s  p50 %7.2f ms  p99 %7.2f ms'
+                      '  errors %d' % (endpoint, target,
+                                       result['throughput'],
+                                       result['p50_ms'], result['p99_ms'],
+                                       result['errors']))
+    finally:
+        if http_server is not None:
+            http_server.shutdown()
+        app.extensions['visit_counter'].stop()
+        app.extensions['activity_log_writer'].stop()
+    commit = git_commit()
+    report = {
+        'commit': commit, 'created': datetime.utcnow().isoformat(),
+        'python': platform.python_version(), 'database': database,
+        'seed': {'users': users, 'long_urls': long_urls,
+                 'short_urls': short_urls, 'logs': logs,
+                 'random_seed': seed_value},
+        'requests_per_endpoint': requests_per_endpoint, 'warmup': warmup,
+        'results': results}
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, '%s-%s.json' % (
+            datetime.utcnow().strftime('%Y%m%dT%H%M%S'),
+            commit or 'unknown'))
+    with open(output, 'w') as results_file:
+        json.dump(report, results_file, indent=2)
+    print('Results written to %s.' % output)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--long-urls', type=int, default=1000)
+    parser.add_argument('--short-urls', type=int, default=2000)
+    parser.add_argument('--logs', type=int, default=20000)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--warmup', type=int, default=50)
+    parser.add_argument('--endpoint', action='append', choices=ENDPOINTS,
+                        help='only benchmark this endpoint, repeatable')
+    parser.add_argument('--skip-server', action='store_true',
+                        help='only send requests through the test client')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='path of the JSON results')
+    args = parser.parse_args()
+    run(args.users, args.long_urls, args.short_urls, args.logs,
+        args.requests, args.warmup, args.endpoint, not args.skip_server,
+        args.seed, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Compare parsing User-Agent headers on every visit with memoizing them.
+
+Run it from the project root with ``python -m benchmarks.user_agents``.
+The headers follow a Zipf distribution over a corpus of browser, platform
+and version combinations, like real traffic where a few thousand distinct
+headers make up nearly all visits.
+"""
+import argparse
+import random
+import time
+
+from werkzeug.useragents import UserAgent
+
+from app import create_app, user_agent_cache
+
+TEMPLATES = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, '
+    'like Gecko) Chrome/{major}.0.{minor}.{patch} Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_12_{minor}) AppleWebKit/'
+    '537.36 (KHTML, like Gecko) Chrome/{major}.0.{minor}.{patch} '
+    'Safari/537.36',
+    'Mozilla/5.0 (X11; Linux x86_64; rv:{major}.0) Gecko/20100101 '
+    'Firefox/{major}.{minor}',
+    'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:{major}.0) Gecko/20100101 '
+    'Firefox/{major}.{minor}',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 10_{minor} like Mac OS X) '
+    'AppleWebKit/603.{patch} (KHTML, like Gecko) Version/{major}.0 '
+    'Mobile/14E304 Safari/602.1',
+    'Mozilla/5.0 (Linux; Android 7.{minor}; SM-G930F Build/NRD90M) '
+    'AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{major}.0.{patch}.98 '
+    'Mobile Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, '
+    'like Gecko) Chrome/{major}.0.{minor}.{patch} Safari/537.36 '
+    'Edge/15.{patch}',
+    'Opera/9.80 (Windows NT 6.1; WOW64) Presto/2.12.{patch} '
+    'Version/{major}.{minor}',
+    'Mozilla/5.0 (compatible; MSIE {major}.0; Windows NT 6.1; '
+    'Trident/{minor}.0)',
+    'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/'
+    'bot.html) {major}.{minor}',
+]
+
+
+def corpus(distinct):
+    """Return distinct User-Agent headers, most common first."""
+    headers = []
+    while len(headers) < distinct:
+        headers.append(random.choice(TEMPLATES).format(
+            major=random.randint(9, 60), minor=random.randint(0, 9),
+            patch=random.randint(0, 3000)))
+    return headers
+
+
+def traffic(headers, visits, exponent):
+    """Return visits headers drawn with Zipf weights."""
+    weights = [1 / (rank + 1) ** exponent for rank in range(len(headers))]
+    return random.choices(headers, weights=weights, k=visits)
+
+
+def parse_every_time(visits):
+    """Parse every header with Werkzeug."""
+    for header in visits:
+        user_agent = UserAgent(header)
+        (user_agent.browser, user_agent.platform, user_agent.version)
+
+
+def parse_memoized(visits):
+    """Parse every header through the user agent cache."""
+    for header in visits:
+        user_agent_cache.parse(header)
+
+
+def timed(function, visits):
+    """Return the seconds function takes over visits."""
+    started = time.perf_counter()
+    function(visits)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--visits', type=int, default=200000)
+    parser.add_argument('--distinct', type=int, default=3000)
+    parser.add_argument('--exponent', type=float, default=1.1)
+    args = parser.parse_args()
+    visits = traffic(corpus(args.distinct), args.visits, args.exponent)
+    app = create_app('benchmark')
+    with app.app_context():
+        print('%d visits, %d distinct headers' % (args.visits,
+                                                  len(set(visits))))
+        for name, function in [('parse', parse_every_time),
+                               ('memoized', parse_memoized)]:
+            print('%-16s %10.3f s' % (name + ':', timed(function, visits)))
+        print('hit ratio:       %10.3f' % user_agent_cache.stats()[
+            'hit_ratio'])
+
+
+if __name__ == '__main__':
+    main()
@@ -11,18 +11,87 @@ class Config:
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_COMMIT_ON_TEARDOWN = True
     SITE_URL = dotenv.get('SITE_URL')
+    RESOLVE_CACHE_ENABLED = True
+    RESOLVE_CACHE_SIZE = 10000
+    RESOLVE_CACHE_TTL = 300
+    RESOLVE_CACHE_NEGATIVE_TTL = 30
+    TOKEN_CACHE_ENABLED = True
+    TOKEN_CACHE_SIZE = 10000
+    TOKEN_CACHE_TTL = 60
+    USER_AGENT_CACHE_SIZE = 4096
+    VISIT_COUNTER_WRITE_BEHIND = True
+    VISIT_COUNTER_FLUSH_INTERVAL = 5
+    VISIT_COUNTER_FLUSH_THRESHOLD = 1000
+    VISIT_COUNTER_SHARDS = 0
+    VISIT_COUNTER_COMPACT_INTERVAL = 60
+    VISIT_COUNTER_COMPACT_BATCH = 500
+    VISIT_COUNTER_SWEEP_INTERVAL = 600
+    ACTIVITY_LOG_ASYNC = True
+    ACTIVITY_LOG_QUEUE_SIZE = 10000
+    ACTIVITY_LOG_BATCH_SIZE = 500
+    ACTIVITY_LOG_LINGER = 1.0
+    ACTIVITY_LOG_OVERFLOW = 'drop-oldest'
+    ACTIVITY_LOG_SAMPLE_RATE = 0.1
+    ACTIVITY_LOG_INTERN_CACHE_SIZE = 10000
+    GEOIP_DATABASE = dotenv.get('GEOIP_DATABASE')
+    GEOIP_CACHE_SIZE = 10000
+    ACTIVITY_LOG_RETENTION_DAYS = 90
+    ACTIVITY_LOG_ARCHIVE_DIR = dotenv.get(
+        'ACTIVITY_LOG_ARCHIVE_DIR', os.path.join(basedir, 'archive'))
+    ACTIVITY_LOG_ARCHIVE_BATCH = 1000
+    VISIT_ROLLUP_HOURLY_RETENTION_DAYS = 90
+    VISIT_STATS_DEFAULT_BUCKETS = 30
+    VISIT_STATS_MAX_BUCKETS = 1000
+    VISIT_LOG_EXPORT_CHUNK_SIZE = 1000
+    BREAKDOWN_DEFAULT_DAYS = 30
+    BREAKDOWN_TOP = 10
+    BREAKDOWN_MAX_TOP = 100
+    REDIRECT_FAST_PATH = False
+    SHORT_URL_ALLOCATOR = 'counter'
+    SHORT_URL_LENGTH = 6
+    SHORT_URL_BLOCK_SIZE = 100
+    SHORT_URL_SCRAMBLE = True
+    SHORT_URL_SCRAMBLE_KEY = dotenv.get('SHORT_URL_SCRAMBLE_KEY')
+    SHORT_URL_POOL_SIZE = 1000
+    SHORT_URL_POOL_LOW_WATER = 200
+    SHORT_URL_POOL_REFILL_BATCH = 200
+    SHORTEN_BATCH_LIMIT = 1000
+    URL_LIST_PAGE_SIZE = 100
+    URL_LIST_MAX_PAGE_SIZE = 1000
+    SHORT_CODE_FILTER_ENABLED = True
+    SHORT_CODE_FILTER_CAPACITY = 1000000
+    SHORT_CODE_FILTER_ERROR_RATE = 0.001
+    SHORT_CODE_FILTER_MAX_BYTES = 16 * 1024 * 1024
+    SHORT_CODE_FILTER_REFRESH_INTERVAL = 0.5
+    SHORT_CODE_FILTER_REFRESH_OVERLAP = 1000
+    QUERY_STATS_ENABLED = False
+    QUERY_STATS_REPEAT_THRESHOLD = 5
+    METRICS_ENABLED = True
+    METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                       0.5, 1, 2.5, 5)
 
 
 class DevelopmentConfig(Config):
     DEBUG = True
+    QUERY_STATS_ENABLED = True
     SQLALCHEMY_DATABASE_URI = dotenv.get('DEV_DATABASE_URL').format(basedir)
 
 
 class TestingConfig(Config):
     TESTING = True
+    VISIT_COUNTER_WRITE_BEHIND = False
+    ACTIVITY_LOG_ASYNC = False
+    SHORT_CODE_FILTER_ENABLED = False
+    QUERY_STATS_ENABLED = True
     SQLALCHEMY_DATABASE_URI = dotenv.get('TEST_DATABASE_URL').format(basedir)
 
 
+class BenchmarkConfig(Config):
+    SITE_URL = dotenv.get('SITE_URL', 'http://localhost:5000/')
+    SQLALCHEMY_DATABASE_URI = dotenv.get(
+        'BENCH_DATABASE_URL', 'sqlite:///{}/benchmark.sqlite').format(basedir)
+
+
 class ProductionConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL').format(basedir)
 
@@ -31,5 +100,6 @@ config = {
     'development': DevelopmentConfig,
     'testing': TestingConfig,
     'production': ProductionConfig,
+    'benchmark': BenchmarkConfig,
     'default': DevelopmentConfig
 }
@@ -0,0 +1,67 @@
+"""Add long_url.url_hash and the per user dedup indexes.
+
+The hashes of existing long_urls are backfilled in chunks of BATCH_SIZE rows
+walking the primary key, so neither the rows read nor the update statements
+grow with the size of the table. The unique index is created afterwards.
+
+Revision ID: 3f0c2b7d9a41
+Revises: 5e2a8c41d7b3
+Create Date: 2026-10-18 03:10:12.418207
+
+"""
+import hashlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f0c2b7d9a41'
+down_revision = '5e2a8c41d7b3'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+long_url = sa.table('long_url',
+                    sa.column('id', sa.Integer),
+                    sa.column('url', sa.String),
+                    sa.column('url_hash', sa.String))
+
+
+def upgrade():
+    op.add_column('long_url', sa.Column('url_hash', sa.String(length=64),
+                                        nullable=True))
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select([long_url.c.id, long_url.c.url]).where(
+                long_url.c.id > last_id).order_by(long_url.c.id).limit(
+                BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        hashes = [{'row_id': row.id, 'hash': hashlib.sha256(
+                   row.url.encode('utf-8')).hexdigest()}
+                  for row in rows if row.url is not None]
+        if hashes:
+            connection.execute(
+                long_url.update().where(
+                    long_url.c.id == sa.bindparam('row_id')).values(
+                    url_hash=sa.bindparam('hash')), hashes)
+        last_id = rows[-1].id
+    op.create_index(op.f('ix_long_url_url_hash'), 'long_url', ['url_hash'],
+                    unique=True)
+    op.create_index('ix_relationship_user_id_long_url_id', 'relationship',
+                    ['user_id', 'long_url_id'], unique=False)
+    op.create_index('ix_short_url_user_id_long_url_id', 'short_url',
+                    ['user_id', 'long_url_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_short_url_user_id_long_url_id', table_name='short_url')
+    op.drop_index('ix_relationship_user_id_long_url_id',
+                  table_name='relationship')
+    op.drop_index(op.f('ix_long_url_url_hash'), table_name='long_url')
+    with op.batch_alter_table('long_url') as batch_op:
+        batch_op.drop_column('url_hash')
@@ -0,0 +1,180 @@
+"""Store activity logs compactly.
+
+Addresses are packed into their 4 or 16 bytes and browser and platform names
+moved into lookup tables, referred to by id. Existing logs are converted in
+chunks of BATCH_SIZE rows walking the primary key, the names of each chunk
+are interned as it is converted, before the text columns are dropped.
+Downgrading restores the text columns, with room for IPv6 addresses, the
+same way.
+
+Revision ID: aac13aa0fb0e
+Revises: 9b1b3e854330
+Create Date: 2026-10-18 03:35:46.245087
+
+"""
+import ipaddress
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'aac13aa0fb0e'
+down_revision = '9b1b3e854330'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+NAME_LENGTH = 255
+
+activity_logs = sa.table('activity_logs',
+                         sa.column('id', sa.Integer),
+                         sa.column('ip', sa.String),
+                         sa.column('packed_ip', sa.LargeBinary),
+                         sa.column('browser', sa.String),
+                         sa.column('browser_id', sa.Integer),
+                         sa.column('platform', sa.String),
+                         sa.column('platform_id', sa.Integer))
+lookups = [(name, sa.table('user_agent_%s' % name,
+                           sa.column('id', sa.Integer),
+                           sa.column('name', sa.String)))
+           for name in ('browser', 'platform')]
+
+
+def pack_ip(ip):
+    try:
+        return ipaddress.ip_address(ip).packed
+    except ValueError:
+        return None
+
+
+def unpack_ip(packed):
+    return str(ipaddress.ip_address(packed)) if packed else None
+
+
+def trim(name):
+    return name[:NAME_LENGTH] if name is not None else None
+
+
+def intern(connection, table, names):
+    """Return the ids of names in a lookup table, inserting missing ones."""
+    names = set(trim(name) for name in names) - {None}
+    if not names:
+        return {}
+    select = sa.select([table.c.name, table.c.id])
+    ids = dict(connection.execute(
+        select.where(table.c.name.in_(names))).fetchall())
+    missing = names - set(ids)
+    if missing:
+        connection.execute(table.insert(),
+                           [{'name': name} for name in sorted(missing)])
+        ids.update(connection.execute(
+            select.where(table.c.name.in_(missing))).fetchall())
+    return ids
+
+
+def names_of(connection, table, ids):
+    """Return the names of ids in a lookup table."""
+    ids = set(ids) - {None}
+    if not ids:
+        return {}
+    return dict(connection.execute(sa.select([table.c.id, table.c.name]).where(
+        table.c.id.in_(ids))).fetchall())
+
+
+def compact(connection, rows):
+    """Return the packed address and lookup ids of (ip, browser, platform)."""
+    ids = [intern(connection, table, (row[index] for row in rows))
+           for index, (_, table) in enumerate(lookups, 1)]
+    return [(pack_ip(row[0]),) + tuple(
+        ids[index].get(trim(row[index + 1])) for index in range(len(ids)))
+        for row in rows]
+
+
+def expand(connection, rows):
+    """Return the address and names of (packed_ip, browser_id, platform_id)."""
+    names = [names_of(connection, table, (row[index] for row in rows))
+             for index, (_, table) in enumerate(lookups, 1)]
+    return [(unpack_ip(row[0]),) + tuple(
+        names[index].get(row[index + 1]) for index in range(len(names)))
+        for row in rows]
+
+
+def convert_logs(sources, targets, convert):
+    """Fill the target columns of every log from its source columns.
+
+    convert maps a batch of source values to their target values.
+    """
+    connection = op.get_bind()
+    sources = [activity_logs.c[source] for source in sources]
+    update = activity_logs.update().where(
+        activity_logs.c.id == sa.bindparam('row_id')).values(
+        {target: sa.bindparam('new_%s' % target) for target in targets})
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select([activity_logs.c.id] + sources).where(
+                activity_logs.c.id > last_id).order_by(
+                activity_logs.c.id).limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        values = convert(connection, [tuple(row[1:]) for row in rows])
+        connection.execute(update, [
+            dict(zip(['row_id'] + ['new_%s' % target for target in targets],
+                     (row[0],) + converted))
+            for row, converted in zip(rows, values)])
+        last_id = rows[-1][0]
+
+
+def upgrade():
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.create_table('user_agent_browser',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=255), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_table('user_agent_platform',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=255), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    with op.batch_alter_table('activity_logs') as batch_op:
+        batch_op.add_column(sa.Column('packed_ip', sa.LargeBinary(length=16),
+                                      nullable=True))
+        for name, _ in lookups:
+            batch_op.add_column(sa.Column('%s_id' % name, sa.Integer(),
+                                          nullable=True))
+            batch_op.create_foreign_key(
+                'fk_activity_logs_%s_id' % name, 'user_agent_%s' % name,
+                ['%s_id' % name], ['id'])
+    convert_logs(['ip', 'browser', 'platform'],
+                 ['packed_ip', 'browser_id', 'platform_id'], compact)
+    with op.batch_alter_table('activity_logs') as batch_op:
+        batch_op.drop_column('ip')
+        batch_op.drop_column('browser')
+        batch_op.drop_column('platform')
+    # ### end Alembic commands ###
+
+
+def downgrade():
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('activity_logs') as batch_op:
+        batch_op.add_column(sa.Column('platform', sa.VARCHAR(),
+                                      nullable=True))
+        batch_op.add_column(sa.Column('browser', sa.VARCHAR(),
+                                      nullable=True))
+        batch_op.add_column(sa.Column('ip', sa.VARCHAR(length=45),
+                                      nullable=True))
+    convert_logs(['packed_ip', 'browser_id', 'platform_id'],
+                 ['ip', 'browser', 'platform'], expand)
+    with op.batch_alter_table('activity_logs') as batch_op:
+        for name, _ in lookups:
+            batch_op.drop_constraint('fk_activity_logs_%s_id' % name,
+                                     type_='foreignkey')
+            batch_op.drop_column('%s_id' % name)
+        batch_op.drop_column('packed_ip')
+    op.drop_table('user_agent_platform')
+    op.drop_table('user_agent_browser')
+    # ### end Alembic commands ###
@@ -41,6 +41,74 @@ def test(coverage=False):
         print('HTML version: file://%s/index.html' % covdir)
 
 
+@manager.command
+def compact_visits():
+    """Move the visits held in counter shards into no_of_visits."""
+    from app import visit_counter
+    print('Compacted %d shard rows.' % visit_counter.compact(everything=True))
+
+
+@manager.command
+def geoip_convert(source, target):
+    """Convert a CSV file of address ranges into a GeoIP range table."""
+    from app.geoip import convert
+    print('Wrote %d ranges to %s.' % (convert(source, target), target))
+
+
+@manager.command
+def geoip_backfill():
+    """Fill in the location of the activity logs written without one."""
+    from app import geoip
+    print('Located %d activity logs.' % geoip.backfill())
+
+
+@manager.command
+def archive_logs():
+    """Archive the old activity logs and drop the old hourly rollups.
+
+    Meant to be run periodically, from cron for example.
+    """
+    from app import log_archive
+    print('Archived %d activity logs and dropped %d hourly rollups.' %
+          log_archive.run())
+
+
+@manager.command
+def rebuild_code_filter():
+    """Make every worker build its short code filter again.
+
+    Needed after short_urls were written below the highest id, by a restore
+    for example. Each worker rebuilds its filter on its next refresh.
+    """
+    from app import short_code_filter
+    print('Requested rebuild %d of the short code filters.' %
+          short_code_filter.request_rebuild())
+
+
+@manager.option('--users', type=int, default=100)
+@manager.option('--long-urls', dest='long_urls', type=int, default=1000)
+@manager.option('--short-urls', dest='short_urls', type=int, default=2000)
+@manager.option('--logs', type=int, default=20000)
+@manager.option('--requests', type=int, default=500)
+@manager.option('--warmup', type=int, default=50)
+@manager.option('--endpoint', dest='endpoints', action='append',
+                help='only benchmark this endpoint, repeatable')
+@manager.option('--skip-server', dest='skip_server', action='store_true',
+                help='only send requests through the test client')
+@manager.option('--seed', type=int, default=0)
+@manager.option('--output', help='path of the JSON results')
+def bench(users, long_urls, short_urls, logs, requests, warmup, endpoints,
+          skip_server, seed, output):
+    """Load test the hot endpoints against a seeded benchmark database.
+
+    The results are written as JSON under bench_results, see
+    benchmarks/suite.py.
+    """
+    from benchmarks.suite import run
+    run(users, long_urls, short_urls, logs, requests, warmup, endpoints,
+        not skip_server, seed, output)
+
+
 manager.add_command("shell", Shell(make_context=make_shell_context))
 manager.add_command('db', MigrateCommand)
 
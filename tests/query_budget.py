@@ -0,0 +1,23 @@
+"""Assertions keeping the queries run by the tests within a budget."""
+from contextlib import contextmanager
+
+from app.querystats import count_queries
+
+
+class QueryBudgetMixin(object):
+    """Mix into a TestCase to assert how many queries a block runs."""
+
+    @contextmanager
+    def assertMaxQueries(self, budget):
+        """Fail if the block runs more than budget queries.
+
+        The failure lists every statement run and how many times, so an
+        N+1 query shows up as one statement run once per row.
+        """
+        with count_queries() as stats:
+            yield stats
+        if stats.count > budget:
+            self.fail('%d queries run, the budget is %d:\n%s' % (
+                stats.count, budget, '\n'.join(
+                    '%dx %s' % (times, statement) for statement, times in
+                    stats.statements.most_common())))
@@ -0,0 +1,154 @@
+"""Test the batched ingestion of activity logs."""
+import unittest
+from datetime import datetime
+
+from app import create_app, db
+from app.activity import LogQueue
+from app.helper import UrlSaver
+from app.models import (UrlActivityLogs, User, UserAgentBrowser,
+                        UserAgentPlatform, pack_ip, unpack_ip)
+
+
+class LogQueueTestCase(unittest.TestCase):
+    """Test queueing, overflow and batch writing of activity logs."""
+
+    def setUp(self):
+        """Setup app for testing before each test case."""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(first_name='ichiato', last_name='ikikin',
+                         email='ichiato@yahoo.com', password='password')
+        self.user.save()
+        UrlSaver.generate_and_save_urls('http://www.andela.com', self.user)
+        self.app.config['ACTIVITY_LOG_ASYNC'] = True
+        self.app.config['ACTIVITY_LOG_QUEUE_SIZE'] = 4
+        self.app.config['ACTIVITY_LOG_BATCH_SIZE'] = 2
+        self.app.config['ACTIVITY_LOG_LINGER'] = 0.01
+
+    def tearDown(self):
+        """Delete app and db instances after each test case."""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def row(self, ip='127.0.0.1'):
+        """Return a log row of a visit to the saved short_url."""
+        return {'short_url_id': 1, 'ip': ip, 'browser': 'chrome',
+                'platform': 'windows', 'visited_at': datetime.utcnow()}
+
+    def test_rows_are_written_in_batches(self):
+        """Test that queued rows are bulk inserted by the writer thread."""
+        self.app.config['ACTIVITY_LOG_QUEUE_SIZE'] = 10
+        queue = LogQueue(self.app)
+        for _ in range(5):
+            queue.put(self.row())
+        queue.stop()
+        self.assertEqual(UrlActivityLogs.query.count(), 5)
+        stats = queue.stats()
+        self.assertEqual(stats['written'], 5)
+        self.assertEqual(stats['depth'], 0)
+        self.assertGreaterEqual(stats['batches'], 3)
+
+    def test_drop_oldest(self):
+        """Test that a full queue drops its oldest rows."""
+        self.app.config['ACTIVITY_LOG_BATCH_SIZE'] = 10
+        self.app.config['ACTIVITY_LOG_LINGER'] = 60
+        queue = LogQueue(self.app)
+        for i in range(6):
+            queue.put(self.row('10.0.0.%d' % i))
+        self.assertEqual(queue.depth(), 4)
+        self.assertEqual(queue.stats()['dropped'], 2)
+        queue.stop()
+        self.assertEqual(UrlActivityLogs.query.first().ip, '10.0.0.2')
+
+    def test_sample(self):
+        """Test that a filling queue only admits a sample of the rows."""
+        self.app.config['ACTIVITY_LOG_OVERFLOW'] = 'sample'
+        self.app.config['ACTIVITY_LOG_SAMPLE_RATE'] = 0
+        self.app.config['ACTIVITY_LOG_BATCH_SIZE'] = 10
+        self.app.config['ACTIVITY_LOG_LINGER'] = 60
+        queue = LogQueue(self.app)
+        for i in range(6):
+            queue.put(self.row())
+        self.assertEqual(queue.depth(), 2)
+        self.assertEqual(queue.stats()['dropped'], 4)
+        queue.stop()
+        self.assertEqual(UrlActivityLogs.query.count(), 2)
+
+    def test_unknown_overflow_policy(self):
+        """Test that an unknown overflow policy is rejected."""
+        self.app.config['ACTIVITY_LOG_OVERFLOW'] = 'ignore'
+        with self.assertRaises(ValueError):
+            LogQueue(self.app)
+
+
+class CompactLogTestCase(unittest.TestCase):
+    """Test the packed addresses and interned names of stored logs."""
+
+    def setUp(self):
+        """Setup app for testing before each test case."""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(first_name='ichiato', last_name='ikikin',
+                         email='ichiato@yahoo.com', password='password')
+        self.user.save()
+        UrlSaver.generate_and_save_urls('http://www.andela.com', self.user)
+        self.queue = LogQueue(self.app)
+
+    def tearDown(self):
+        """Delete app and db instances after each test case."""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def write(self, ip='127.0.0.1', browser='chrome', platform='windows'):
+        """Write the log of a visit to the saved short_url."""
+        self.queue.write([{'short_url_id': 1, 'ip': ip, 'browser': browser,
+                           'platform': platform,
+                           'visited_at': datetime.utcnow()}])
+
+    def test_pack_ip(self):
+        """Test packing IPv4 and IPv6 addresses."""
+        self.assertEqual(len(pack_ip('221.192.199.49')), 4)
+        self.assertEqual(len(pack_ip('2001:db8::1')), 16)
+        for ip in ('221.192.199.49', '2001:db8::1'):
+            self.assertEqual(unpack_ip(pack_ip(ip)), ip)
+        self.assertIsNone(pack_ip('unknown'))
+        self.assertIsNone(unpack_ip(None))
+
+    def test_logs_read_back(self):
+        """Test that stored logs read back as written."""
+        self.write('2001:db8::1', platform=None)
+        self.write('bad address', browser=None)
+        logs = UrlActivityLogs.query.order_by(UrlActivityLogs.id).all()
+        self.assertEqual([(x.ip, x.browser, x.platform) for x in logs],
+                         [('2001:db8::1', 'chrome', None),
+                          (None, None, 'windows')])
+
+    def test_names_are_interned(self):
+        """Test that names are stored once and their ids cached."""
+        for browser in ('chrome', 'firefox', 'chrome', 'chrome'):
+            self.write(browser=browser)
+        self.assertEqual(sorted(x.name for x in UserAgentBrowser.query),
+                         ['chrome', 'firefox'])
+        self.assertEqual(UserAgentPlatform.query.count(), 1)
+        stats = self.queue.stats()
+        self.assertEqual(stats['intern_misses'], 3)
+        self.assertEqual(stats['intern_hits'], 5)
+        other_queue = LogQueue(self.app)
+        other_queue.write([{'short_url_id': 1, 'ip': '127.0.0.1',
+                            'browser': 'firefox', 'platform': 'windows',
+                            'visited_at': datetime.utcnow()}])
+        self.assertEqual(UserAgentBrowser.query.count(), 2)
+
+    def test_long_names_are_truncated(self):
+        """Test that names longer than the lookup column are truncated."""
+        self.write(browser='x' * 300)
+        self.write(browser='x' * 301)
+        self.assertEqual([len(x.browser) for x in UrlActivityLogs.query],
+                         [255, 255])
+        self.assertEqual(UserAgentBrowser.query.count(), 1)
@@ -0,0 +1,101 @@
+"""Testing shortening of long urls in batches."""
+from base64 import b64encode
+import json
+import unittest
+
+from flask import url_for
+
+from app import create_app, db
+from app.models import LongUrl, ShortUrl, User
+
+
+class ApiBatchShorten(unittest.TestCase):
+    """Test the batch shortening endpoint."""
+
+    def setUp(self):
+        """Setup app for testing before each test case."""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client(use_cookies=True)
+        self.user = User(first_name='ichiato', last_name='ikikin',
+                         email='ichiato@yahoo.com', password='password')
+        self.user.save()
+        token = self.user.generate_auth_token(60).decode('ascii')
+        self.token_header = {
+            'Authorization': 'Basic ' + b64encode(
+                (token + ':').encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        }
+
+    def tearDown(self):
+        """Delete app and db instances after each test case."""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def shorten(self, items):
+        """Post a batch and return the status code and decoded body."""
+        response = self.client.post(url_for('api.shorten_urls_in_batch'),
+                                    headers=self.token_header,
+                                    data=json.dumps(items))
+        return response.status_code, json.loads(response.data.decode('utf-8'))
+
+    def test_batch_shortening(self):
+        """Test that every item gets a result in request order."""
+        status, body = self.shorten([
+            {'url': 'http://www.andela.com'},
+            {'url': 'not a url'},
+            {'url': 'http://www.google.com', 'vanity_string': 'goo'},
+            {'url': 'http://www.andela.com'},
+        ])
+        results = body['results']
+        self.assertEqual(status, 200)
+        self.assertEqual(len(results), 4)
+        self.assertTrue(results[0]['created'])
+        self.assertIn('error', results[1])
+        self.assertTrue(results[2]['short_url'].endswith('/goo'))
+        self.assertEqual(results[3]['id'], results[0]['id'])
+        self.assertEqual(ShortUrl.query.count(), 2)
+        self.assertEqual(len(User.query.get(1).long_urls), 2)
+
+    def test_existing_urls_are_reused(self):
+        """Test that urls shortened before are neither duplicated nor lost."""
+        _, first = self.shorten([{'url': 'http://www.andela.com'}])
+        _, second = self.shorten([{'url': 'http://www.andela.com'},
+                                  {'url': 'http://www.google.com'}])
+        self.assertEqual(second['results'][0]['id'],
+                         first['results'][0]['id'])
+        self.assertFalse(second['results'][0]['created'])
+        self.assertEqual(LongUrl.query.count(), 2)
+
+    def test_vanity_string_in_use(self):
+        """Test that taken vanity strings fail only their own item."""
+        self.shorten([{'url': 'http://www.andela.com', 'vanity_string': 'x'}])
+        _, body = self.shorten([
+            {'url': 'http://www.google.com', 'vanity_string': 'x'},
+            {'url': 'http://www.python.org', 'vanity_string': 'y'},
+            {'url': 'http://www.devops.com', 'vanity_string': 'y'},
+        ])
+        results = body['results']
+        self.assertEqual(results[0]['error'],
+                         'Vanity string already in use. Pick another.')
+        self.assertTrue(results[1]['short_url'].endswith('/y'))
+        self.assertIn('error', results[2])
+
+    def test_body_must_be_an_array(self):
+        """Test that a batch which is not an array is rejected."""
+        status, body = self.shorten({'url': 'http://www.andela.com'})
+        self.assertEqual(status, 400)
+        self.assertEqual(body['message'], 'The request is invalid or'
+                         ' inconsistent. The request body must be a non'
+                         ' empty array.')
+
+    def test_batch_limit(self):
+        """Test that batches above the limit are rejected."""
+        self.app.config['SHORTEN_BATCH_LIMIT'] = 1
+        status, _ = self.shorten([{'url': 'http://www.andela.com'},
+                                  {'url': 'http://www.google.com'}])
+        self.assertEqual(status, 400)
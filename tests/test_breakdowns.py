@@ -0,0 +1,122 @@
+"""Test the visit breakdowns of short_urls and users."""
+from base64 import b64encode
+from datetime import datetime
+import json
+import unittest
+
+from flask import url_for
+
+from app import create_app, db
+from app.activity import LogQueue
+from app.analytics import breakdown
+from app.helper import UrlSaver
+from app.models import UrlActivityLogs, User
+
+
+class BreakdownTestCase(unittest.TestCase):
+    """Test grouping the logs of a short_url or user."""
+
+    def setUp(self):
+        """Setup app for testing before each test case."""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client(use_cookies=True)
+        self.user = User(first_name='ichiato', last_name='ikikin',
+                         email='ichiato@yahoo.com', password='password')
+        self.user.save()
+        other_user = User(first_name='ada', last_name='obi',
+                          email='ada@yahoo.com', password='password')
+        other_user.save()
+        self.short_urls = [UrlSaver.generate_and_save_urls(
+            'http://www.andela.com/%d' % number, self.user)
+            for number in range(2)]
+        self.other_short_url = UrlSaver.generate_and_save_urls(
+            'http://www.google.com', other_user)
+        token = self.user.generate_auth_token(60).decode('ascii')
+        self.token_header = {
+            'Authorization': 'Basic ' + b64encode(
+                (token + ':').encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json'
+        }
+        visits = [(self.short_urls[0], 9, 'chrome', 'windows', 'Nigeria'),
+                  (self.short_urls[0], 9, 'chrome', 'linux', 'Nigeria'),
+                  (self.short_urls[0], 21, 'firefox', None, 'Kenya'),
+                  (self.short_urls[1], 21, 'chrome', 'windows', None),
+                  (self.other_short_url, 9, 'safari', 'macos', 'Ghana')]
+        LogQueue(self.app).write([
+            {'short_url_id': short_url.id, 'ip': '10.0.0.1',
+             'browser': browser, 'platform': platform,
+             'visited_at': datetime(2017, 5, 1, hour, 30)}
+            for short_url, hour, browser, platform, _ in visits])
+        for log, visit in zip(UrlActivityLogs.query.order_by(
+                UrlActivityLogs.id), visits):
+            log.country_name = visit[4]
+        db.session.commit()
+
+    def tearDown(self):
+        """Delete app and db instances after each test case."""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get_json(self, endpoint, **args):
+        """Get a breakdown from the API."""
+        response = self.client.get(url_for(endpoint, **args),
+                                   headers=self.token_header)
+        return response.status_code, json.loads(response.data.decode('utf-8'))
+
+    def test_short_url_breakdown(self):
+        """Test the top values and hours of a short_url."""
+        visits = breakdown(datetime(2017, 5, 1), datetime(2017, 5, 2), 10,
+                           short_url_id=self.short_urls[0].id)
+        self.assertEqual(visits['total'], 3)
+        self.assertEqual(visits['browsers'], [
+            {'name': 'chrome', 'visits': 2}, {'name': 'firefox', 'visits': 1}])
+        self.assertEqual(sorted((x['name'], x['visits'])
+                                for x in visits['platforms']),
+                         [('linux', 1), ('unknown', 1), ('windows', 1)])
+        self.assertEqual(visits['countries'], [
+            {'name': 'Nigeria', 'visits': 2}, {'name': 'Kenya', 'visits': 1}])
+        self.assertEqual(len(visits['hours']), 24)
+        self.assertEqual((visits['hours'][9], visits['hours'][21]), (2, 1))
+
+    def test_limit_and_range(self):
+        """Test that only the top values in the range are returned."""
+        visits = breakdown(datetime(2017, 5, 1), datetime(2017, 5, 2), 1,
+                           short_url_id=self.short_urls[0].id)
+        self.assertEqual(visits['browsers'], [{'name': 'chrome',
+                                               'visits': 2}])
+        visits = breakdown(datetime(2017, 5, 2), datetime(2017, 5, 3), 10,
+                           short_url_id=self.short_urls[0].id)
+        self.assertEqual(visits['total'], 0)
+        self.assertEqual(visits['browsers'], [])
+
+    def test_endpoints(self):
+        """Test the breakdowns of a short_url and of the current user."""
+        status, visits = self.get_json(
+            'api.get_short_url_breakdown', id=self.short_urls[1].id,
+            **{'from': '2017-05-01', 'to': '2017-05-02'})
+        self.assertEqual(status, 200)
+        self.assertEqual(visits['total'], 1)
+        self.assertEqual(visits['countries'], [{'name': 'unknown',
+                                                'visits': 1}])
+        status, visits = self.get_json(
+            'api.get_user_breakdown',
+            **{'from': '2017-05-01', 'to': '2017-05-02'})
+        self.assertEqual(status, 200)
+        self.assertEqual(visits['total'], 4)
+        self.assertEqual(visits['browsers'][0], {'name': 'chrome',
+                                                 'visits': 3})
+        self.assertNotIn('safari', [x['name'] for x in visits['browsers']])
+
+    def test_invalid_arguments(self):
+        """Test that other users' URLs and invalid arguments are rejected."""
+        status, _ = self.get_json('api.get_short_url_breakdown',
+                                  id=self.other_short_url.id)
+        self.assertEqual(status, 404)
+        for args in ({'top': 0}, {'top': 'all'},
+                     {'from': '2017-05-02', 'to': '2017-05-01'}):
+            status, _ = self.get_json('api.get_user_breakdown', **args)
+            self.assertEqual(status, 400)
@@ -0,0 +1,213 @@
+"""Test the Bloom filter rejecting unknown short_url codes."""
+import threading
+import time
+import unittest
+from unittest import mock
+
+from flask import url_for
+
+from app import create_app, db, short_code_filter
+from app.bloom import BloomFilter, CodeFilter
+from app.helper import UrlSaver
+from app.models import ShortUrl, User
+
+
+class BloomFilterTestCase(unittest.TestCase):
+    """Test the Bloom filter itself."""
+
+    def test_no_false_negatives(self):
+        """Test that every string added is found."""
+        bloom = BloomFilter.for_capacity(1000, 0.01)
+        codes = ['code%d' % number for number in range(1000)]
+        for code in codes:
+            bloom.add(code)
+        self.assertTrue(all(code in bloom for code in codes))
+        self.assertAlmostEqual(bloom.count, 1000, delta=20)
+        bloom.add(codes[0])
+        self.assertAlmostEqual(bloom.count, 1000, delta=20)
+
+    def test_false_positive_rate(self):
+        """Test that unknown strings are rarely found."""
+        bloom = BloomFilter.for_capacity(1000, 0.01)
+        for number in range(1000):
+            bloom.add('code%d' % number)
+        found = sum('other%d' % number in bloom for number in range(10000))
+        self.assertLess(found, 300)
+        self.assertAlmostEqual(bloom.error_rate(), 0.01, delta=0.005)
+
+    def test_memory_budget(self):
+        """Test that the bit array never exceeds its budget."""
+        bloom = BloomFilter.for_capacity(1000000, 0.001, max_bytes=1024)
+        self.assertEqual(len(bloom.array), 1024)
+        self.assertGreaterEqual(bloom.hashes, 1)
+
+
+class CodeFilterTestCase(unittest.TestCase):
+    """Test guarding the redirect path with the code filter."""
+
+    def setUp(self):
+        """Setup app for testing before each test case."""
+        self.app = create_app('testing')
+        self.app.config['SHORT_CODE_FILTER_ENABLED'] = True
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client(use_cookies=True)
+        self.user = User(first_name='ichiato', last_name='ikikin',
+                         email='ichiato@yahoo.com', password='password')
+        self.user.save()
+        self.short_url = UrlSaver.generate_and_save_urls(
+            'http://www.andela.com', self.user)
+        self.sleeps = []
+        self.start_filter()
+        self.statements = []
+        db.event.listen(db.engine, 'before_cursor_execute', self.count)
+
+    def tearDown(self):
+        """Delete app and db instances after each test case."""
+        db.event.remove(db.engine, 'before_cursor_execute', self.count)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def new_filter(self):
+        """Replace the code filter of the app with one not built yet."""
+        code_filter = CodeFilter(self.app)
+        code_filter.sleep = self.sleeps.append
+        self.app.extensions['short_code_filter'] = code_filter
+        return code_filter
+
+    def start_filter(self):
+        """Build a new code filter the way the first lookup does."""
+        code_filter = self.new_filter()
+        code_filter.start()
+        self.assertTrue(code_filter.ready.wait(10))
+        return code_filter
+
+    def add_short_url(self, code, id=None):
+        """Save a short_url the way another worker would."""
+        other = ShortUrl(id=id, url=code,
+                         long_url_id=self.short_url.long_url_id,
+                         user_id=self.user.id)
+        db.session.add(other)
+        db.session.commit()
+
+    def count(self, connection, cursor, statement, *args):
+        """Record the statements sent to the database."""
+        self.statements.append(statement)
+
+    def get(self, code):
+        """Request the redirect of code."""
+        return self.client.get(url_for('api.get_url', shorturl=code),
+                               headers={'Accept': 'application/json'})
+
+    def test_filter_is_built_on_first_lookup(self):
+        """Test that the filter is only built once a code is looked up."""
+        code_filter = self.new_filter()
+        self.assertIsNone(code_filter._thread)
+        self.assertEqual(self.get(self.short_url.url).status_code, 302)
+        self.assertTrue(code_filter.ready.wait(10))
+        stats = short_code_filter.stats()
+        self.assertEqual((stats['codes'], stats['builds']), (1, 1))
+
+    def test_codes_are_looked_up_until_built(self):
+        """Test that no code is rejected before the filter is built."""
+        self.new_filter()
+        with mock.patch.object(CodeFilter, 'start') as start:
+            self.assertEqual(self.get(self.short_url.url).status_code, 302)
+            self.assertEqual(self.get('zzzzzzzz').status_code, 404)
+        self.assertTrue(start.called)
+        self.assertEqual(short_code_filter.stats()['rejected'], 0)
+
+    def test_unknown_code_skips_lookup(self):
+        """Test that codes never issued are rejected without a lookup."""
+        self.assertEqual(self.get(self.short_url.url).status_code, 302)
+        self.statements = []
+        response = self.get('zzzzzzzz')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(len(self.statements), 2)
+        for statement in self.statements:
+            self.assertNotIn('long_url', statement)
+        stats = short_code_filter.stats()
+        self.assertEqual((stats['codes'], stats['rejected'],
+                          stats['refreshes']), (1, 1, 1))
+
+    def test_refreshes_wait_for_the_interval(self):
+        """Test that misses refresh the filter once per interval at most."""
+        self.get('zzzzzzzz')
+        self.assertEqual(self.sleeps, [])
+        self.get('yyyyyyyy')
+        self.assertEqual(len(self.sleeps), 1)
+        self.assertGreater(self.sleeps[0], 0)
+        self.assertLessEqual(
+            self.sleeps[0],
+            self.app.config['SHORT_CODE_FILTER_REFRESH_INTERVAL'])
+
+    def test_concurrent_misses_share_a_refresh(self):
+        """Test that misses waiting on a refresh are answered by one."""
+        code_filter = short_code_filter.filter
+        results = []
+
+        def look_up(code):
+            with self.app.app_context():
+                results.append(code_filter.might_contain(code))
+        with code_filter._refresh_lock:
+            threads = [threading.Thread(target=look_up,
+                                        args=('miss%d' % number,))
+                       for number in range(5)]
+            for thread in threads:
+                thread.start()
+            time.sleep(0.2)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [False] * 5)
+        self.assertEqual(code_filter.refreshes, 1)
+        self.assertEqual(len(self.statements), 2)
+
+    def test_saved_codes_are_added(self):
+        """Test that codes saved by the worker are found at once."""
+        short_url = UrlSaver.generate_and_save_urls('http://www.google.com',
+                                                    self.user)
+        UrlSaver.bulk_generate_and_save_urls(
+            [('http://www.bing.com', 'bing')], self.user)
+        self.assertEqual(self.get(short_url.url).status_code, 302)
+        self.assertEqual(self.get('bing').status_code, 302)
+        self.assertEqual(short_code_filter.stats()['refreshes'], 0)
+
+    def test_codes_of_other_workers_are_never_rejected(self):
+        """Test that codes saved elsewhere are found on their first visit."""
+        self.get('zzzzzzzz')
+        self.add_short_url('other')
+        self.assertEqual(self.get('other').status_code, 302)
+        self.assertEqual(short_code_filter.stats()['refreshes'], 2)
+
+    def test_requested_rebuild_reaches_the_filter(self):
+        """Test that codes restored below the highest id are found again."""
+        self.add_short_url('latest', id=2000)
+        self.assertEqual(self.get('latest').status_code, 302)
+        self.add_short_url('restored', id=100)
+        self.assertEqual(self.get('restored').status_code, 404)
+        self.assertEqual(short_code_filter.request_rebuild(), 1)
+        self.assertEqual(self.get('restored').status_code, 302)
+        self.assertEqual(short_code_filter.stats()['builds'], 2)
+
+    def test_codes_committed_out_of_order_are_found(self):
+        """Test that ids skipped by a refresh are read again."""
+        self.add_short_url('later', id=5)
+        self.assertEqual(self.get('later').status_code, 302)
+        self.assertEqual(short_code_filter.filter.gaps, {2, 3, 4})
+        self.add_short_url('earlier', id=3)
+        self.assertEqual(self.get('earlier').status_code, 302)
+        self.assertEqual(short_code_filter.filter.gaps, {2, 4})
+
+    def test_full_filter_is_rebuilt(self):
+        """Test that the filter grows once it holds its capacity."""
+        self.app.config['SHORT_CODE_FILTER_CAPACITY'] = 1
+        self.start_filter()
+        codes = [UrlSaver.generate_and_save_urls(
+            'http://www.andela.com/%d' % number, self.user).url
+            for number in range(5)]
+        self.get('yyyyyyyy')
+        self.assertEqual(short_code_filter.stats()['builds'], 2)
+        for code in codes:
+            self.assertEqual(self.get(code).status_code, 302)
@@ -0,0 +1,165 @@
+"""Test converting GeoIP range files and locating visitors with them."""
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from app import create_app, db, geoip
+from app.activity import LogQueue
+from app.geoip import (CSV_FIELDS, InvalidRangeFile, Location, RangeTable,
+                       address_key, convert)
+from app.helper import UrlSaver
+from app.models import UrlActivityLogs, User
+
+RANGES = [
+    ('10.0.0.0', '10.0.0.255', 'Nigeria', 'Lagos', 'Lagos', '6.45', '3.39'),
+    ('10.0.2.0', '10.0.3.255', 'Kenya', 'Nairobi', 'Nairobi', '-1.28',
+     '36.82'),
+    ('2001:db8::', '2001:db8::ffff', 'Ghana', '', '', '', ''),
+    ('1.0.0.0', '1.0.0.0', 'Nigeria', 'Lagos', 'Lagos', '6.45', '3.39'),
+]
+
+
+class GeoIPTestCase(unittest.TestCase):
+    """Test the range table and the resolver caching its lookups."""
+
+    def setUp(self):
+        """Write a range file and convert it."""
+        self.directory = tempfile.mkdtemp()
+        self.source = self.write_csv(RANGES)
+        self.target = os.path.join(self.directory, 'geoip.bin')
+        self.ranges = convert(self.source, self.target)
+        self.table = RangeTable(self.target)
+
+    def tearDown(self):
+        """Remove the range files."""
+        self.table.close()
+        shutil.rmtree(self.directory)
+
+    def write_csv(self, ranges, name='ranges.csv'):
+        """Write ranges to a CSV file and return its path."""
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(CSV_FIELDS)
+            writer.writerows(ranges)
+        return path
+
+    def lookup(self, ip):
+        """Return the location of an address in the table."""
+        return self.table.lookup(address_key(ip))
+
+    def test_lookup(self):
+        """Test locating addresses inside, between and outside ranges."""
+        self.assertEqual(self.ranges, 4)
+        self.assertEqual(len(self.table), 4)
+        self.assertEqual(self.lookup('10.0.0.7'),
+                         Location('Nigeria', 'Lagos', 'Lagos', 6.45, 3.39))
+        self.assertEqual(self.lookup('10.0.3.255').country_name, 'Kenya')
+        self.assertEqual(self.lookup('1.0.0.0').city, 'Lagos')
+        self.assertEqual(self.lookup('2001:db8::10'),
+                         Location('Ghana', None, None, None, None))
+        for ip in ('0.0.0.1', '10.0.1.1', '10.0.4.0', '2001:db9::'):
+            self.assertIsNone(self.lookup(ip), ip)
+
+    def test_packed_addresses(self):
+        """Test that packed addresses have the key of their text form."""
+        self.assertEqual(address_key(b'\n\x00\x00\x07'),
+                         address_key('10.0.0.7'))
+        self.assertIsNone(address_key(None))
+
+    def test_invalid_files(self):
+        """Test that overlapping, malformed and foreign files are rejected."""
+        for ranges in ([('10.0.0.0', '10.0.0.9', 'A', '', '', '', ''),
+                        ('10.0.0.9', '10.0.0.20', 'B', '', '', '', '')],
+                       [('10.0.0.9', '10.0.0.0', 'A', '', '', '', '')],
+                       [('10.0.0.0', '10.0.0.9', 'A', '', '', 'north', '')]):
+            with self.assertRaises(InvalidRangeFile):
+                convert(self.write_csv(ranges, 'invalid.csv'), os.path.join(
+                    self.directory, 'invalid.bin'))
+        with self.assertRaises(InvalidRangeFile):
+            RangeTable(self.source)
+
+    def test_resolver_cache(self):
+        """Test that the resolver caches the locations it looks up."""
+        app = create_app('testing')
+        app.config['GEOIP_DATABASE'] = self.target
+        with app.app_context():
+            for _ in range(3):
+                self.assertEqual(geoip.locate('10.0.2.1').city, 'Nairobi')
+            self.assertIsNone(geoip.locate('10.0.1.1'))
+            self.assertIsNone(geoip.locate('10.0.1.1'))
+            self.assertIsNone(geoip.locate('unknown'))
+            self.assertEqual(geoip.stats(),
+                             {'hits': 3, 'misses': 2, 'size': 2})
+
+    def test_without_database(self):
+        """Test that nothing is located when no table is configured."""
+        app = create_app('testing')
+        with app.app_context():
+            self.assertIsNone(geoip.locate('10.0.0.1'))
+            self.assertEqual(geoip.backfill(), 0)
+
+
+class GeoIPEnrichmentTestCase(unittest.TestCase):
+    """Test locating the visitors of logged visits."""
+
+    def setUp(self):
+        """Setup app for testing before each test case."""
+        self.directory = tempfile.mkdtemp()
+        self.target = os.path.join(self.directory, 'geoip.bin')
+        source = os.path.join(self.directory, 'ranges.csv')
+        with open(source, 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(CSV_FIELDS)
+            writer.writerows(RANGES)
+        convert(source, self.target)
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(first_name='ichiato', last_name='ikikin',
+                         email='ichiato@yahoo.com', password='password')
+        self.user.save()
+        UrlSaver.generate_and_save_urls('http://www.andela.com', self.user)
+
+    def tearDown(self):
+        """Delete app and db instances after each test case."""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.directory)
+
+    def write(self, *ips):
+        """Write the logs of visits from ips to the saved short_url."""
+        LogQueue(self.app).write([
+            {'short_url_id': 1, 'ip': ip, 'browser': 'chrome',
+             'platform': 'windows', 'visited_at': datetime.utcnow()}
+            for ip in ips])
+
+    def locations(self):
+        """Return the countries and cities of the logs by id."""
+        return [(x.country_name, x.city) for x in
+                UrlActivityLogs.query.order_by(UrlActivityLogs.id)]
+
+    def test_writer_locates_visitors(self):
+        """Test that logs are written with their location."""
+        self.app.config['GEOIP_DATABASE'] = self.target
+        self.write('10.0.0.1', '10.0.1.1')
+        log = UrlActivityLogs.query.first()
+        self.assertEqual((log.country_name, log.region_name, log.city,
+                          log.latitude, log.longitude),
+                         ('Nigeria', 'Lagos', 'Lagos', 6.45, 3.39))
+        self.assertEqual(self.locations()[1], (None, None))
+
+    def test_backfill(self):
+        """Test locating logs written before the table was configured."""
+        self.write('10.0.0.1', '10.0.1.1', '10.0.2.9', '2001:db8::1')
+        self.app.config['GEOIP_DATABASE'] = self.target
+        self.assertEqual(geoip.backfill(batch_size=2), 3)
+        db.session.expire_all()
+        self.assertEqual(self.locations(),
+                         [('Nigeria', 'Lagos'), (None, None),
+                          ('Kenya', 'Nairobi'), ('Ghana', None)])
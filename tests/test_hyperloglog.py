@@ -0,0 +1,123 @@
+"""Test the HyperLogLog sketches counting the unique visitors."""
+from base64 import b64encode
+from datetime import datetime
+import json
+import unittest
+
+from flask import url_for
+
+from app import create_app, db
+from app.activity import LogQueue
+from app.helper import UrlSaver
+from app.hll import HyperLogLog
+from app.models import User, VisitorSketch, VisitorSketchDaily
+from app.rollups import unique_visitors
+
+
+class HyperLogLogTestCase(unittest.TestCase):
+    """Test the accuracy, merging and storage of sketches."""
+
+    def test_estimate(self):
+        """Test that estimates are within a few percent."""
+        for count in (0, 1, 100, 10000, 100000):
+            sketch = HyperLogLog()
+            for number in range(count):
+                sketch.add('visitor %d' % number)
+                sketch.add('visitor %d' % number)
+            self.assertLessEqual(abs(sketch.estimate() - count),
+                                 max(1, count * 0.05), count)
+
+    def test_merge(self):
+        """Test that merged sketches estimate the union."""
+        first, second, union = HyperLogLog(), HyperLogLog(), HyperLogLog()
+        for number in range(3000):
+            first.add(str(number))
+            union.add(str(number))
+        for number in range(2000, 6000):
+            second.add(str(number))
+            union.add(str(number))
+        first.merge(second)
+        self.assertEqual(first.registers, union.registers)
+        with self.assertRaises(ValueError):
+            first.merge(HyperLogLog(precision=10))
+
+    def test_bytes(self):
+        """Test that sketches survive storage and compress when sparse."""
+        sketch = HyperLogLog(precision=10)
+        for number in range(50):
+            sketch.add(str(number))
+        data = sketch.to_bytes()
+        self.assertLess(len(data), len(sketch.registers) / 2)
+        stored = HyperLogLog.from_bytes(data)
+        self.assertEqual(stored.precision, 10)
+        self.assertEqual(stored.registers, sketch.registers)
+
+
+class UniqueVisitorsTestCase(unittest.TestCase):
+    """Test counting the unique visitors of short_urls."""
+
+    def setUp(self):
+        """Setup app for testing before each test case."""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client(use_cookies=True)
+        self.user = User(first_name='ichiato', last_name='ikikin',
+                         email='ichiato@yahoo.com', password='password')
+        self.user.save()
+        self.short_url = UrlSaver.generate_and_save_urls(
+            'http://www.andela.com', self.user)
+        self.queue = LogQueue(self.app)
+        token = self.user.generate_auth_token(60).decode('ascii')
+        self.token_header = {
+            'Authorization': 'Basic ' + b64encode(
+                (token + ':').encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json'
+        }
+
+    def tearDown(self):
+        """Delete app and db instances after each test case."""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def log(self, visited_at, ips):
+        """Write the logs of visits from ips to the short_url."""
+        self.queue.write([{'short_url_id': self.short_url.id, 'ip': ip,
+                           'browser': 'chrome', 'platform': 'windows',
+                           'visited_at': visited_at} for ip in ips])
+
+    def test_sketches_are_merged(self):
+        """Test that batches merge into the stored sketches."""
+        self.log(datetime(2017, 5, 1, 12), ['10.0.0.%d' % x for x in range(5)])
+        self.log(datetime(2017, 5, 1, 13), ['10.0.0.%d' % x for x in range(8)])
+        self.log(datetime(2017, 5, 2, 9), ['10.0.1.%d' % x for x in range(4)])
+        self.assertEqual(VisitorSketch.query.count(), 1)
+        self.assertEqual(VisitorSketchDaily.query.count(), 2)
+        self.assertEqual(unique_visitors(self.short_url.id), 12)
+        self.assertEqual(unique_visitors(self.short_url.id,
+                                         datetime(2017, 5, 1, 18),
+                                         datetime(2017, 5, 2)), 8)
+        self.assertEqual(unique_visitors(self.short_url.id,
+                                         datetime(2017, 5, 1),
+                                         datetime(2017, 5, 3)), 12)
+        self.assertEqual(unique_visitors(self.short_url.id,
+                                         datetime(2017, 6, 1),
+                                         datetime(2017, 6, 2)), 0)
+
+    def test_endpoints(self):
+        """Test the unique visitors returned with a short_url and stats."""
+        for _ in range(3):
+            self.client.get(url_for('api.get_url',
+                                    shorturl=self.short_url.url))
+        response = self.client.get(url_for('api.get_short_url',
+                                           id=self.short_url.id),
+                                   headers=self.token_header)
+        self.assertEqual(json.loads(response.data.decode('utf-8'))[
+            'unique visitors'], 1)
+        response = self.client.get(url_for('api.get_short_url_stats',
+                                           id=self.short_url.id),
+                                   headers=self.token_header)
+        self.assertEqual(json.loads(response.data.decode('utf-8'))[
+            'unique_visitors'], 1)
@@ -0,0 +1,94 @@
+"""Test the influential users leaderboard."""
+from base64 import b64encode
+import json
+import unittest
+
+from flask import url_for
+
+from app import create_app, db
+from app.helper import UrlSaver
+from app.models import AnonymousUser, User
+
+
+class InfluentialUsersTestCase(unittest.TestCase):
+    """Test the short_url counts and the leaderboard built from them."""
+
+    def setUp(self):
+        """Setup app for testing before each test case."""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client(use_cookies=True)
+        self.user = User(first_name='ichiato', last_name='ikikin',
+                         email='ichiato@yahoo.com', password='password')
+        self.user.save()
+        self.other_user = User(first_name='ada', last_name='obi',
+                               email='ada@yahoo.com', password='password')
+        self.other_user.save()
+        self.anonymous_user = AnonymousUser.create_anonymous_user()
+        token = self.user.generate_auth_token(60).decode('ascii')
+        self.token_header = {
+            'Authorization': 'Basic ' + b64encode(
+                (token + ':').encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json'
+        }
+
+    def tearDown(self):
+        """Delete app and db instances after each test case."""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def shorten(self, user, count):
+        """Shorten count distinct urls for user."""
+        return [UrlSaver.generate_and_save_urls(
+            'http://www.%s.com/%d' % (user.first_name, number), user)
+            for number in range(count)]
+
+    def get_users(self, **args):
+        """Get the leaderboard and return the status code and users."""
+        response = self.client.get(url_for('api.get_influential_users',
+                                           **args), headers=self.token_header)
+        body = json.loads(response.data.decode('utf-8'))
+        return response.status_code, body.get('users_list')
+
+    def test_short_url_count_is_maintained(self):
+        """Test that saving, batch saving and deleting update the count."""
+        short_urls = self.shorten(self.user, 2)
+        self.shorten(self.user, 1)
+        self.assertEqual(User.query.get(self.user.id).short_url_count, 2)
+        UrlSaver.bulk_generate_and_save_urls(
+            [('http://www.python.org', None), ('http://www.flask.org', None)],
+            self.user)
+        self.assertEqual(User.query.get(self.user.id).short_url_count, 4)
+        response = self.client.delete(
+            url_for('api.delete_urls', id=short_urls[0].id),
+            headers=self.token_header)
+        self.assertEqual(response.status_code, 200)
+        db.session.expire_all()
+        self.assertEqual(User.query.get(self.user.id).short_url_count, 3)
+
+    def test_leaderboard(self):
+        """Test that users are ordered by count without the AnonymousUser."""
+        self.shorten(self.user, 1)
+        self.shorten(self.other_user, 2)
+        self.shorten(self.anonymous_user, 3)
+        status, users = self.get_users()
+        self.assertEqual(status, 200)
+        self.assertEqual(users, [
+            {'Name': 'ada obi', 'No of URLs shortened': 2},
+            {'Name': 'ichiato ikikin', 'No of URLs shortened': 1}])
+        _, users = self.get_users(include_anonymous='true')
+        self.assertEqual(users[0]['No of URLs shortened'], 3)
+        self.assertEqual(len(users), 3)
+
+    def test_limit_and_offset(self):
+        """Test that the leaderboard is read a page at a time."""
+        self.shorten(self.user, 1)
+        self.shorten(self.other_user, 2)
+        _, users = self.get_users(limit=1, offset=1)
+        self.assertEqual(users, [{'Name': 'ichiato ikikin',
+                                  'No of URLs shortened': 1}])
+        status, _ = self.get_users(offset=-1)
+        self.assertEqual(status, 400)
@@ -0,0 +1,133 @@
+"""Test archiving old activity logs and reading them back."""
+from base64 import b64encode
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from flask import url_for
+
+from app import create_app, db, log_archive
+from app.activity import LogQueue
+from app.archive import LogArchiver
+from app.helper import UrlSaver
+from app.models import (ActivityLogArchive, UrlActivityLogs, User,
+                        VisitRollupDaily, VisitRollupHourly)
+
+NOW = datetime(2017, 9, 1)
+
+
+class LogArchiveTestCase(unittest.TestCase):
+    """Test the retention job and the archived logs API."""
+
+    def setUp(self):
+        """Setup app for testing before each test case."""
+        self.directory = tempfile.mkdtemp()
+        self.app = create_app('testing')
+        self.app.config['ACTIVITY_LOG_ARCHIVE_DIR'] = self.directory
+        self.app.config['ACTIVITY_LOG_ARCHIVE_BATCH'] = 3
+        self.app.extensions['log_archive'] = LogArchiver(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client(use_cookies=True)
+        self.user = User(first_name='ichiato', last_name='ikikin',
+                         email='ichiato@yahoo.com', password='password')
+        self.user.save()
+        self.short_urls = [UrlSaver.generate_and_save_urls(
+            'http://www.andela.com/%d' % number, self.user)
+            for number in range(2)]
+        token = self.user.generate_auth_token(60).decode('ascii')
+        self.token_header = {
+            'Authorization': 'Basic ' + b64encode(
+                (token + ':').encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json'
+        }
+        # Five old visits to the first short_url and two to the second,
+        # interleaved, then a recent visit to each.
+        owners = [0, 1, 0, 1, 0, 0, 0]
+        LogQueue(self.app).write(
+            [{'short_url_id': self.short_urls[owner].id,
+              'ip': '10.0.0.%d' % number, 'browser': 'chrome',
+              'platform': 'windows',
+              'visited_at': NOW - timedelta(days=120, hours=number)}
+             for number, owner in enumerate(owners)] +
+            [{'short_url_id': short_url.id, 'ip': '10.0.1.1',
+              'browser': 'firefox', 'platform': None,
+              'visited_at': NOW - timedelta(days=1)}
+             for short_url in self.short_urls])
+
+    def tearDown(self):
+        """Delete app and db instances after each test case."""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.directory)
+
+    def get_logs(self, short_url, **args):
+        """Get the archived logs of a short_url."""
+        return self.client.get(url_for('api.get_short_url_visit_log',
+                                       id=short_url.id, archived='true',
+                                       **args), headers=self.token_header)
+
+    def test_run(self):
+        """Test that old logs move to segments in bounded batches."""
+        daily = sorted((x.bucket, x.visits) for x in VisitRollupDaily.query)
+        self.assertEqual(log_archive.run(NOW), (7, 7))
+        self.assertEqual(UrlActivityLogs.query.count(), 2)
+        self.assertEqual(len(os.listdir(self.directory)), 3)
+        members = ActivityLogArchive.query.all()
+        self.assertEqual(sum(x.logs for x in members), 7)
+        self.assertTrue(all(x.logs <= 3 for x in members))
+        self.assertEqual(sorted((x.bucket, x.visits) for x in
+                                VisitRollupDaily.query), daily)
+        self.assertEqual(VisitRollupHourly.query.count(), 2)
+        self.assertEqual(log_archive.run(NOW), (0, 0))
+
+    def test_archived_pages(self):
+        """Test paging through archived logs, latest first."""
+        log_archive.run(NOW)
+        ips, after = [], None
+        while True:
+            args = {'limit': 1}
+            if after:
+                args['after'] = after
+            page = json.loads(self.get_logs(self.short_urls[0], **args)
+                              .data.decode('utf-8'))
+            ips.extend(x['I.P Address'] for x in page['short_url logs'])
+            after = page['next']
+            if after is None:
+                break
+        self.assertEqual(ips, ['10.0.0.0', '10.0.0.2', '10.0.0.4',
+                               '10.0.0.5', '10.0.0.6'])
+        page = json.loads(self.get_logs(self.short_urls[1]).data.decode(
+            'utf-8'))
+        self.assertEqual(page['short_url logs'][0], {
+            'I.P Address': '10.0.0.1', 'User agent': 'chrome',
+            'System platform': 'windows',
+            'Visited at': (NOW - timedelta(days=120, hours=1)).isoformat()})
+
+    def test_archived_range_and_export(self):
+        """Test filtering and streaming the archived logs."""
+        log_archive.run(NOW)
+        start = NOW - timedelta(days=120, hours=5)
+        page = json.loads(self.get_logs(
+            self.short_urls[0], **{'from': start.strftime('%Y-%m-%dT%H:%M'),
+                                   'to': '2017-05-04T00:00'}).data.decode(
+            'utf-8'))
+        self.assertEqual([x['I.P Address'] for x in page['short_url logs']],
+                         ['10.0.0.2', '10.0.0.4', '10.0.0.5'])
+        response = self.get_logs(self.short_urls[0], format='ndjson')
+        self.assertEqual(len(response.data.decode('utf-8').splitlines()), 5)
+
+    def test_live_logs_are_unchanged(self):
+        """Test that the live logs only hold the recent visits."""
+        log_archive.run(NOW)
+        response = self.client.get(url_for('api.get_short_url_visit_log',
+                                           id=self.short_urls[0].id),
+                                   headers=self.token_header)
+        page = json.loads(response.data.decode('utf-8'))
+        self.assertEqual([x['I.P Address'] for x in page['short_url logs']],
+                         ['10.0.1.1'])
@@ -0,0 +1,77 @@
+"""Test the hash indexed long_url lookup and the per user dedup."""
+import unittest
+
+from app import create_app, db
+from app.helper import UrlSaver
+from app.models import LongUrl, ShortUrl, User, hash_url
+
+
+class LongUrlLookupTestCase(unittest.TestCase):
+    """Test finding long_urls and short_urls without loading relationships."""
+
+    def setUp(self):
+        """Setup app for testing before each test case."""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(first_name='ichiato', last_name='ikikin',
+                         email='ichiato@yahoo.com', password='password')
+        self.user.save()
+        self.other_user = User(first_name='ada', last_name='obi',
+                               email='ada@yahoo.com', password='password')
+        self.other_user.save()
+
+    def tearDown(self):
+        """Delete app and db instances after each test case."""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_url_hash_follows_url(self):
+        """Test that url_hash is set and updated along with url."""
+        long_url = LongUrl(url='http://www.andela.com')
+        self.assertEqual(long_url.url_hash, hash_url('http://www.andela.com'))
+        self.assertEqual(len(long_url.url_hash), 64)
+        long_url.url = 'http://www.google.com'
+        self.assertEqual(long_url.url_hash, hash_url('http://www.google.com'))
+
+    def test_find_by_url(self):
+        """Test that long_urls are found by their url."""
+        short_url = UrlSaver.generate_and_save_urls('http://www.andela.com',
+                                                    self.user)
+        self.assertEqual(LongUrl.find_by_url('http://www.andela.com'),
+                         short_url.long_url)
+        self.assertIsNone(LongUrl.find_by_url('http://www.google.com'))
+
+    def test_dedup_per_user(self):
+        """Test that a user shortening a url twice gets the same short_url."""
+        first = UrlSaver.generate_and_save_urls('http://www.andela.com',
+                                                self.user)
+        second = UrlSaver.generate_and_save_urls('http://www.andela.com',
+                                                 self.user)
+        other = UrlSaver.generate_and_save_urls('http://www.andela.com',
+                                                self.other_user)
+        self.assertEqual(first.id, second.id)
+        self.assertNotEqual(first.id, other.id)
+        self.assertEqual(first.long_url_id, other.long_url_id)
+        self.assertEqual(LongUrl.query.count(), 1)
+        self.assertEqual(ShortUrl.query.count(), 2)
+
+    def test_find_for_user(self):
+        """Test that only the short_urls of the given user are found."""
+        short_url = UrlSaver.generate_and_save_urls('http://www.andela.com',
+                                                    self.user)
+        self.assertEqual(ShortUrl.find_for_user(short_url.long_url_id,
+                                                self.user.id), short_url)
+        self.assertIsNone(ShortUrl.find_for_user(short_url.long_url_id,
+                                                 self.other_user.id))
+
+    def test_change_long_url_to_one_already_shortened(self):
+        """Test that changing to an already shortened url returns it."""
+        andela = UrlSaver.generate_and_save_urls('http://www.andela.com',
+                                                 self.user)
+        google = UrlSaver.generate_and_save_urls('http://www.google.com',
+                                                 self.user)
+        self.assertEqual(google.change_long_url('http://www.andela.com',
+                                                self.user), andela)
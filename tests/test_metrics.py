@@ -0,0 +1,160 @@
+"""Test the metrics registry and the /metrics endpoint."""
+from base64 import b64encode
+import json
+import threading
+import unittest
+
+from flask import url_for
+
+from app import create_app, db
+from app.fastpath import RedirectMiddleware
+from app.helper import UrlSaver
+from app.metrics import MetricsRegistry, exposition
+from app.models import User
+
+
+class MetricsRegistryTestCase(unittest.TestCase):
+    """Test aggregating the shards of the registry."""
+
+    def test_threads_are_summed(self):
+        """Test that the values of every thread, even finished, are summed."""
+        registry = MetricsRegistry([0.1, 1])
+
+        def record():
+            for _ in range(100):
+                registry.inc('hits_total', page='a')
+                registry.observe('latency', 0.5, page='a')
+
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        registry.inc('hits_total', page='b')
+        registry.observe('latency', 2, page='a')
+        totals = registry.collect()
+        self.assertEqual(totals[('hits_total', (('page', 'a'),))], 400)
+        self.assertEqual(totals[('hits_total', (('page', 'b'),))], 1)
+        self.assertEqual(totals[('latency', (('page', 'a'),))],
+                         [0, 400, 1, 202.0])
+        self.assertEqual(registry.collect(), totals)
+
+    def test_histogram_buckets(self):
+        """Test that bucket bounds are inclusive and counts cumulative."""
+        registry = MetricsRegistry([0.1, 1])
+        for value in (0.05, 0.1, 0.5, 3):
+            registry.observe('http_request_duration_seconds', value,
+                             endpoint='api.get_url', status=302)
+        lines = [line for line in exposition(registry).splitlines()
+                 if line.startswith('http_request_duration_seconds')]
+        self.assertEqual(lines, [
+            'http_request_duration_seconds_bucket{endpoint="api.get_url",'
+            'status="302",le="0.1"} 2',
+            'http_request_duration_seconds_bucket{endpoint="api.get_url",'
+            'status="302",le="1.0"} 3',
+            'http_request_duration_seconds_bucket{endpoint="api.get_url",'
+            'status="302",le="+Inf"} 4',
+            'http_request_duration_seconds_sum{endpoint="api.get_url",'
+            'status="302"} 3.65',
+            'http_request_duration_seconds_count{endpoint="api.get_url",'
+            'status="302"} 4'])
+
+
+class MetricsEndpointTestCase(unittest.TestCase):
+    """Test the metrics recorded while serving requests."""
+
+    def setUp(self):
+        """Setup app for testing before each test case."""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client(use_cookies=True)
+        self.user = User(first_name='ichiato', last_name='ikikin',
+                         email='ichiato@yahoo.com', password='password')
+        self.user.save()
+        token = self.user.generate_auth_token(60).decode('ascii')
+        self.token_header = {
+            'Authorization': 'Basic ' + b64encode(
+                (token + ':').encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        }
+
+    def tearDown(self):
+        """Delete app and db instances after each test case."""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def metrics(self):
+        """Return the lines served at /metrics."""
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        return response.data.decode('utf-8').splitlines()
+
+    def test_requests_are_counted(self):
+        """Test that shortens, redirects and latencies are exported."""
+        response = self.client.post(url_for('api.shorten_url'),
+                                    headers=self.token_header,
+                                    data=json.dumps(
+                                        {'url': 'http://www.andela.com'}))
+        code = json.loads(response.data.decode('utf-8'))['short_url'][
+            len(self.app.config['SITE_URL'] or ''):].rsplit('/', 1)[-1]
+        self.client.get(url_for('api.get_url', shorturl=code))
+        self.client.get(url_for('api.get_url', shorturl=code))
+        self.client.get(url_for('api.get_url', shorturl='unknown'),
+                        headers={'Accept': 'application/json'})
+        lines = self.metrics()
+        self.assertIn('short_urls_created_total{source="single"} 1', lines)
+        self.assertIn('redirects_total{outcome="redirected"} 2', lines)
+        self.assertIn('redirects_total{outcome="unknown"} 1', lines)
+        self.assertIn('http_request_duration_seconds_count'
+                      '{endpoint="api.get_url",status="302"} 2', lines)
+        self.assertIn('http_request_duration_seconds_count'
+                      '{endpoint="api.get_url",status="404"} 1', lines)
+        self.assertIn('cache_hits_total{cache="resolve"} 1', lines)
+        self.assertIn('# TYPE cache_misses_total counter', lines)
+        self.assertIn('activity_log_written 2', lines)
+
+    def test_server_errors_are_counted(self):
+        """Test that a view raising an unhandled exception is recorded."""
+        def fail():
+            raise RuntimeError('boom')
+
+        self.app.add_url_rule('/fail', 'fail', fail)
+        self.app.config['PROPAGATE_EXCEPTIONS'] = False
+        response = self.client.get('/fail')
+        self.assertEqual(response.status_code, 500)
+        self.metrics()
+        lines = self.metrics()
+        self.assertIn('http_request_duration_seconds_count'
+                      '{endpoint="fail",status="500"} 1', lines)
+        self.assertIn('http_request_duration_seconds_count'
+                      '{endpoint="metrics",status="200"} 1', lines)
+
+    def test_fast_path_is_timed(self):
+        """Test that redirects served by the fast path are timed too."""
+        self.app.wsgi_app = RedirectMiddleware(self.app)
+        short_url = UrlSaver.generate_and_save_urls('http://www.andela.com',
+                                                    self.user)
+        response = self.client.get(url_for('api.get_url',
+                                           shorturl=short_url.url))
+        self.assertEqual(response.status_code, 302)
+        lines = self.metrics()
+        self.assertIn('http_request_duration_seconds_count'
+                      '{endpoint="api.get_url",status="302"} 1', lines)
+        self.assertIn('redirects_total{outcome="redirected"} 1', lines)
+
+    def test_disabled(self):
+        """Test that nothing is recorded while metrics are disabled."""
+        short_url = UrlSaver.generate_and_save_urls('http://www.andela.com',
+                                                    self.user)
+        self.app.config['METRICS_ENABLED'] = False
+        self.client.get(url_for('api.get_url', shorturl=short_url.url))
+        self.app.config['METRICS_ENABLED'] = True
+        lines = self.metrics()
+        self.assertFalse([line for line in lines
+                          if line.startswith('redirects_total')])
+        self.assertFalse([line for line in lines if 'api.get_url' in line])
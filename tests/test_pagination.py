@@ -0,0 +1,138 @@
+"""Test the keyset pagination of the url listings."""
+from base64 import b64encode
+from datetime import datetime
+import json
+import unittest
+
+from flask import url_for
+
+from app import create_app, db
+from app.helper import UrlSaver
+from app.models import ShortUrl, User
+from app.pagination import InvalidCursor, decode_cursor, encode_cursor
+
+
+class CursorTestCase(unittest.TestCase):
+    """Test encoding and decoding cursors."""
+
+    def test_round_trip(self):
+        """Test that cursors decode to the values they were made from."""
+        created = datetime(2017, 5, 1, 12, 30, 15, 250)
+        cursor = encode_cursor([created, 42])
+        self.assertEqual(decode_cursor(cursor, [ShortUrl.date_created,
+                                                ShortUrl.id]),
+                         [created, 42])
+
+    def test_invalid_cursors(self):
+        """Test that cursors not made by encode_cursor are rejected."""
+        columns = [ShortUrl.no_of_visits, ShortUrl.id]
+        for cursor in ('nonsense', encode_cursor([1]),
+                       encode_cursor(['a', 1]), encode_cursor({'a': 1})):
+            with self.assertRaises(InvalidCursor):
+                decode_cursor(cursor, columns)
+
+
+class ApiPaginationTestCase(unittest.TestCase):
+    """Test paging through the sorted url listings."""
+
+    def setUp(self):
+        """Setup app for testing before each test case."""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client(use_cookies=True)
+        self.user = User(first_name='ichiato', last_name='ikikin',
+                         email='ichiato@yahoo.com', password='password')
+        self.user.save()
+        token = self.user.generate_auth_token(60).decode('ascii')
+        self.token_header = {
+            'Authorization': 'Basic ' + b64encode(
+                (token + ':').encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json'
+        }
+        visits = [3, 1, 3, 0, 1]
+        for number, no_of_visits in enumerate(visits):
+            short_url = UrlSaver.generate_and_save_urls(
+                'http://www.site%d.com' % number, self.user)
+            short_url.no_of_visits = no_of_visits
+            short_url.long_url.no_of_visits = no_of_visits
+        db.session.commit()
+
+    def tearDown(self):
+        """Delete app and db instances after each test case."""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get_page(self, url_type, sort_type, **args):
+        """Get a page of a listing and return the decoded body."""
+        response = self.client.get(url_for('api.sort_urls', url_type=url_type,
+                                           sort_type=sort_type, **args),
+                                   headers=self.token_header)
+        return response.status_code, json.loads(response.data.decode('utf-8'))
+
+    def get_all_pages(self, url_type, sort_type, key):
+        """Follow the next cursors and return the pages and every key."""
+        pages, keys, after = 0, [], None
+        while True:
+            args = {'limit': 2}
+            if after:
+                args['after'] = after
+            status, body = self.get_page(url_type, sort_type, **args)
+            self.assertEqual(status, 200)
+            self.assertLessEqual(len(body['url_list']), 2)
+            pages += 1
+            keys.extend(item[key] for item in body['url_list'])
+            after = body['next']
+            if not after:
+                return pages, keys
+
+    def test_shorturl_popularity_pages(self):
+        """Test that pages neither skip nor repeat equal visit counts."""
+        pages, urls = self.get_all_pages('shorturl', 'popularity',
+                                         'short_url')
+        expected = [x.url for x in ShortUrl.query.order_by(
+            db.desc(ShortUrl.no_of_visits), db.desc(ShortUrl.id))]
+        self.assertEqual(pages, 3)
+        self.assertEqual(urls, expected)
+
+    def test_longurl_popularity_pages(self):
+        """Test paging through long_urls by popularity."""
+        _, urls = self.get_all_pages('longurl', 'popularity', 'long_url')
+        self.assertEqual(len(urls), 5)
+        self.assertEqual(len(set(urls)), 5)
+
+    def test_shorturl_date_pages(self):
+        """Test paging through short_urls by date added."""
+        _, urls = self.get_all_pages('shorturl', 'date', 'short_url')
+        expected = [x.url for x in ShortUrl.query.order_by(
+            db.desc(ShortUrl.date_created), db.desc(ShortUrl.id))]
+        self.assertEqual(urls, expected)
+
+    def test_deleted_short_urls_are_skipped(self):
+        """Test that deleted short_urls are not listed."""
+        ShortUrl.query.get(1).deleted = True
+        db.session.commit()
+        _, urls = self.get_all_pages('shorturl', 'popularity', 'short_url')
+        self.assertEqual(len(urls), 4)
+
+    def test_default_page_holds_everything(self):
+        """Test that short listings fit on one page by default."""
+        status, body = self.get_page('shorturl', 'popularity')
+        self.assertEqual(len(body['url_list']), 5)
+        self.assertIsNone(body['next'])
+
+    def test_invalid_limit(self):
+        """Test that limits out of range are rejected."""
+        for limit in ('0', 'abc', '1001'):
+            status, body = self.get_page('shorturl', 'popularity',
+                                         limit=limit)
+            self.assertEqual(status, 400)
+
+    def test_invalid_cursor(self):
+        """Test that malformed cursors are rejected."""
+        status, body = self.get_page('shorturl', 'date', after='nonsense')
+        self.assertEqual(status, 400)
+        self.assertEqual(body['message'], 'The request is invalid or'
+                         ' inconsistent. Invalid cursor.')
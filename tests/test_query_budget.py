@@ -0,0 +1,122 @@
+"""Test the query counts of requests and the endpoints' query budgets."""
+from base64 import b64encode
+from datetime import datetime
+import json
+import unittest
+
+from flask import url_for
+from sqlalchemy import event
+
+from app import create_app, db
+from app.activity import LogQueue
+from app.helper import UrlSaver
+from app.models import LongUrl, ShortUrl, User
+from tests.query_budget import QueryBudgetMixin
+
+SHORT_URLS = 20
+
+
+class QueryBudgetTestCase(QueryBudgetMixin, unittest.TestCase):
+    """Test that the endpoints run a fixed number of queries."""
+
+    def setUp(self):
+        """Setup app for testing before each test case."""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client(use_cookies=True)
+        self.user = User(first_name='ichiato', last_name='ikikin',
+                         email='ichiato@yahoo.com', password='password')
+        self.user.save()
+        self.short_urls = [UrlSaver.generate_and_save_urls(
+            'http://www.andela.com/%d' % number, self.user).id
+            for number in range(SHORT_URLS)]
+        LogQueue(self.app).write([
+            {'short_url_id': short_url, 'ip': '10.0.0.1',
+             'browser': 'chrome', 'platform': 'windows',
+             'visited_at': datetime.utcnow()}
+            for short_url in self.short_urls])
+        token = self.user.generate_auth_token(60).decode('ascii')
+        self.token_header = {
+            'Authorization': 'Basic ' + b64encode(
+                (token + ':').encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json'
+        }
+
+    def tearDown(self):
+        """Delete app and db instances after each test case."""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get(self, path, budget):
+        """Get path with a fresh session, within budget queries."""
+        db.session.remove()
+        with self.assertMaxQueries(budget):
+            response = self.client.get(path, headers=self.token_header)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response
+
+    def test_endpoint_budgets(self):
+        """Test that no endpoint runs a query per short_url."""
+        short_url = self.short_urls[0]
+        budgets = [
+            (url_for('api.get_user_short_urls'), 3),
+            (url_for('api.get_short_url', id=short_url), 4),
+            (url_for('api.get_user_details'), 2),
+            (url_for('api.get_influential_users'), 2),
+            (url_for('api.get_short_url_visit_log', id=short_url), 3),
+            (url_for('api.get_short_url_stats', id=short_url), 4),
+            (url_for('api.get_short_url_breakdown', id=short_url), 8),
+            (url_for('api.get_user_breakdown'), 7),
+            ('/api/v1/shorturl/popularity', 2),
+            ('/api/v1/shorturl/date', 2),
+            ('/api/v1/longurl/popularity', 2)]
+        for path, budget in budgets:
+            self.get(path, budget)
+
+    def test_shorten_loads_no_collections(self):
+        """Test that shortening never loads the user's other short_urls."""
+        loaded = []
+
+        def count(target, context):
+            loaded.append(target)
+
+        db.session.remove()
+        user = User.query.get(self.user.id)
+        event.listen(ShortUrl, 'load', count)
+        event.listen(User, 'load', count)
+        try:
+            with self.assertMaxQueries(18):
+                UrlSaver.generate_and_save_urls('http://www.andela.com/new',
+                                                user, 'andela')
+                UrlSaver.generate_and_save_urls('http://www.google.com',
+                                                user)
+        finally:
+            event.remove(ShortUrl, 'load', count)
+            event.remove(User, 'load', count)
+        self.assertEqual(loaded, [])
+        self.assertEqual(User.query.get(self.user.id).short_url_count,
+                         SHORT_URLS + 2)
+        self.assertEqual(len(LongUrl.query.filter_by(
+            url='http://www.andela.com/new').one().users), 1)
+
+    def test_response_headers(self):
+        """Test that responses carry their query count and time."""
+        response = self.get(url_for('api.get_user_short_urls'), 3)
+        self.assertEqual(response.headers['X-Query-Count'], '2')
+        self.assertGreaterEqual(float(response.headers['X-Query-Time']), 0)
+        listing = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(len(listing['short_url list']), SHORT_URLS)
+
+    def test_repeated_statements(self):
+        """Test that lazy loads in a loop exceed the budget."""
+        db.session.remove()
+        with self.assertRaises(AssertionError):
+            with self.assertMaxQueries(2) as stats:
+                [x.long_url.url for x in ShortUrl.query]
+        repeated = stats.repeated(self.app.config[
+            'QUERY_STATS_REPEAT_THRESHOLD'])
+        self.assertEqual(len(repeated), 1)
+        self.assertEqual(repeated[0][1], SHORT_URLS)
@@ -0,0 +1,71 @@
+"""Test the redirect fast path middleware."""
+import json
+import unittest
+
+from flask import url_for
+
+from app import create_app, db
+from app.fastpath import RedirectMiddleware
+from app.helper import UrlSaver
+from app.models import ShortUrl, UrlActivityLogs, User
+
+
+class RedirectMiddlewareTestCase(unittest.TestCase):
+    """Test redirects served by the middleware."""
+
+    def setUp(self):
+        """Setup app for testing before each test case."""
+        self.app = create_app('testing')
+        self.app.wsgi_app = RedirectMiddleware(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client(use_cookies=True)
+        self.user = User(first_name='ichiato', last_name='ikikin',
+                         email='ichiato@yahoo.com', password='password')
+        self.user.save()
+        self.short_url = UrlSaver.generate_and_save_urls(
+            'http://www.andela.com', self.user)
+
+    def tearDown(self):
+        """Delete app and db instances after each test case."""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_redirect(self):
+        """Test that active short_urls redirect and record the visit."""
+        response = self.client.get(
+            url_for('api.get_url', shorturl=self.short_url.url),
+            environ_base={'HTTP_USER_AGENT': 'chrome, windows',
+                          'REMOTE_ADDR': '221.192.199.49'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.location, 'http://www.andela.com')
+        db.session.expire_all()
+        self.assertEqual(ShortUrl.query.get(1).no_of_visits, 1)
+        log = UrlActivityLogs.query.get(1)
+        self.assertEqual(log.ip, '221.192.199.49')
+        self.assertEqual(log.browser, 'chrome')
+
+    def test_inactive_short_url(self):
+        """Test that inactive short_urls get a plain 400."""
+        self.short_url.is_active = False
+        db.session.commit()
+        response = self.client.get(
+            url_for('api.get_url', shorturl=self.short_url.url))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, b'URL is inactive.')
+
+    def test_unknown_short_url(self):
+        """Test that unknown short_urls get a plain 404."""
+        response = self.client.get(url_for('api.get_url', shorturl='nope'))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.content_type, 'text/plain; charset=utf-8')
+
+    def test_other_routes_fall_through(self):
+        """Test that routes other than the redirect reach Flask."""
+        response = self.client.get(url_for('api.get_token'),
+                                   headers={'Accept': 'application/json'})
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(json_response['error'], '403 Forbidden')
@@ -0,0 +1,162 @@
+"""Test the resolve cache in front of the redirect path."""
+from base64 import b64encode
+import json
+import unittest
+from unittest import mock
+
+from flask import url_for
+
+from app import create_app, db, resolve_cache
+from app.cache import LRUCache, MISSING, ResolvedUrl
+from app.helper import UrlSaver
+from app.models import ShortUrl, User
+
+
+class FakeClock(object):
+    """A clock that only moves when told to."""
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class LRUCacheTestCase(unittest.TestCase):
+    """Test the bounded LRU cache."""
+
+    def test_least_recently_used_entry_is_evicted(self):
+        """Test that the cache never holds more than maxsize entries."""
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIs(cache.get('b'), MISSING)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_entries_expire(self):
+        """Test that entries are dropped once their TTL is over."""
+        clock = FakeClock()
+        cache = LRUCache(maxsize=2, ttl=10, clock=clock)
+        cache.set('a', 1)
+        cache.set('b', None, ttl=1)
+        clock.now = 5
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIs(cache.get('b'), MISSING)
+        clock.now = 10
+        self.assertIs(cache.get('a'), MISSING)
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['expirations'], 2)
+
+
+class ResolveCacheTestCase(unittest.TestCase):
+    """Test caching and invalidation of resolved short_urls."""
+
+    def setUp(self):
+        """Setup app for testing before each test case."""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client(use_cookies=True)
+        self.user = User(first_name='ichiato', last_name='ikikin',
+                         email='ichiato@yahoo.com', password='password')
+        self.user.save()
+        self.short_url = UrlSaver.generate_and_save_urls(
+            'http://www.andela.com', self.user)
+        token = self.user.generate_auth_token(60).decode('ascii')
+        self.token_header = {
+            'Authorization': 'Basic ' + b64encode(
+                (token + ':').encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        }
+
+    def tearDown(self):
+        """Delete app and db instances after each test case."""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def visit(self, code):
+        """Follow a short_url."""
+        return self.client.get(url_for('api.get_url', shorturl=code),
+                               headers={'Accept': 'application/json'})
+
+    def test_resolve_is_cached(self):
+        """Test that a resolved short_url is served from the cache."""
+        self.visit(self.short_url.url)
+        self.visit(self.short_url.url)
+        resolved = resolve_cache.get(self.short_url.url)
+        self.assertEqual(resolved.long_url, 'http://www.andela.com')
+        self.assertTrue(resolved.is_active)
+        self.assertEqual(resolve_cache.stats()['hits'], 2)
+
+    def test_unknown_short_url_is_cached(self):
+        """Test that unknown short_urls are cached as negative entries."""
+        response = self.visit('unknown')
+        self.assertEqual(response.status_code, 404)
+        self.assertIsNone(resolve_cache.get('unknown'))
+
+    def test_saving_short_url_drops_negative_entry(self):
+        """Test that a vanity string missed earlier resolves once saved."""
+        self.visit('python')
+        UrlSaver.generate_and_save_urls('http://www.google.com', self.user,
+                                        'python')
+        response = self.visit('python')
+        self.assertEqual(response.status_code, 302)
+
+    def test_toggle_is_active_invalidates(self):
+        """Test that deactivating a short_url stops its redirection."""
+        self.visit(self.short_url.url)
+        self.client.put('/api/v1/short_url/1/deactivate',
+                        headers=self.token_header)
+        self.assertIs(resolve_cache.get(self.short_url.url), MISSING)
+        self.assertEqual(self.visit(self.short_url.url).status_code, 400)
+
+    def test_change_during_lookup_is_not_cached(self):
+        """Test that a row read before a deactivation is not cached."""
+        def deactivate_then_resolve(*row):
+            self.client.put('/api/v1/short_url/1/deactivate',
+                            headers=self.token_header)
+            return ResolvedUrl(*row)
+
+        with mock.patch('app.models.ResolvedUrl',
+                        side_effect=deactivate_then_resolve):
+            self.assertTrue(ShortUrl.resolve(self.short_url.url).is_active)
+        self.assertIs(resolve_cache.get(self.short_url.url), MISSING)
+        self.assertEqual(self.visit(self.short_url.url).status_code, 400)
+
+    def test_invalidations_are_bounded(self):
+        """Test that forgotten invalidations still reject older reads."""
+        resolve_cache.cache.maxsize = 2
+        self.app.extensions['resolve_cache_invalidations'].maxsize = 2
+        version = resolve_cache.version()
+        for code in ('a', 'b', 'c'):
+            resolve_cache.invalidate(code)
+        resolve_cache.set('a', None, version)
+        self.assertIs(resolve_cache.get('a'), MISSING)
+        resolve_cache.set('a', None, resolve_cache.version())
+        self.assertIsNone(resolve_cache.get('a'))
+
+    def test_delete_invalidates(self):
+        """Test that deleting a short_url stops its redirection."""
+        self.visit(self.short_url.url)
+        self.client.delete(url_for('api.delete_urls', id=1),
+                           headers=self.token_header)
+        self.assertEqual(self.visit(self.short_url.url).status_code, 404)
+
+    def test_change_long_url_invalidates(self):
+        """Test that a changed target url is followed immediately."""
+        self.visit(self.short_url.url)
+        self.client.put(url_for('api.change_long_url', id=1),
+                        headers=self.token_header,
+                        data=json.dumps({'url': 'http://www.google.com'}))
+        response = self.visit(self.short_url.url)
+        self.assertEqual(response.location, 'http://www.google.com')
+        self.assertEqual(ShortUrl.resolve(self.short_url.url).long_url,
+                         'http://www.google.com')
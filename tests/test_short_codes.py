@@ -0,0 +1,136 @@
+"""Test the counter based allocation of short_url codes."""
+import unittest
+
+from app import code_allocator, create_app, db
+from app.codes import Scrambler, base62_decode, base62_encode
+from app.helper import UrlSaver
+from app.models import CodeSequence, User
+
+
+class Base62TestCase(unittest.TestCase):
+    """Test encoding of ids into codes."""
+
+    def test_round_trip(self):
+        """Test that decoding an encoded number returns the number."""
+        for number in (0, 61, 62, 3843, 56800235583):
+            self.assertEqual(base62_decode(base62_encode(number)), number)
+        self.assertEqual(base62_encode(61, 3), '00Z')
+
+    def test_scrambler_is_a_permutation(self):
+        """Test that scrambling maps a range onto itself one to one."""
+        scramble = Scrambler('secret', 62 ** 2)
+        images = [scramble(number) for number in range(62 ** 2)]
+        self.assertEqual(sorted(images), list(range(62 ** 2)))
+        self.assertNotEqual(images[:10], list(range(10)))
+
+
+class CodeAllocatorTestCase(unittest.TestCase):
+    """Test leasing of id blocks and code allocation."""
+
+    def setUp(self):
+        """Setup app for testing before each test case."""
+        self.app = create_app('testing')
+        self.app.config['SHORT_URL_BLOCK_SIZE'] = 10
+        code_allocator.init_app(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(first_name='ichiato', last_name='ikikin',
+                         email='ichiato@yahoo.com', password='password')
+        self.user.save()
+
+    def tearDown(self):
+        """Delete app and db instances after each test case."""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_blocks_are_leased_from_the_sequence(self):
+        """Test that one lease serves a whole block of codes."""
+        codes = [code_allocator.allocate() for _ in range(25)]
+        self.assertEqual(len(set(codes)), 25)
+        self.assertTrue(all(len(code) == 6 for code in codes))
+        self.assertEqual(code_allocator.stats()['leases'], 3)
+        self.assertEqual(CodeSequence.query.get('short_url').next_value, 30)
+
+    def test_forked_worker_leases_its_own_block(self):
+        """Test that a block is not shared with a forked child."""
+        lease = code_allocator.lease
+        lease.next_id()
+        lease._pid = -1
+        self.assertEqual(lease.next_id(), 10)
+
+    def test_codes_grow_once_a_length_is_used_up(self):
+        """Test that ids beyond the 6 character space get longer codes."""
+        lease = code_allocator.lease
+        self.assertEqual(len(lease.encode(62 ** 6 - 1)), 6)
+        self.assertEqual(len(lease.encode(62 ** 6)), 7)
+
+    def test_clash_with_vanity_string(self):
+        """Test that a code taken by a vanity string is skipped."""
+        code = code_allocator.lease.encode(0)
+        UrlSaver.generate_and_save_urls('http://www.google.com', self.user,
+                                        code)
+        short_url = UrlSaver.generate_and_save_urls('http://www.andela.com',
+                                                    self.user)
+        self.assertEqual(short_url.url, code_allocator.lease.encode(1))
+
+
+class CodePoolTestCase(unittest.TestCase):
+    """Test the pool of pre-generated codes."""
+
+    def setUp(self):
+        """Setup app for testing before each test case."""
+        self.app = create_app('testing')
+        self.app.config['SHORT_URL_ALLOCATOR'] = 'pool'
+        self.app.config['SHORT_URL_POOL_SIZE'] = 20
+        self.app.config['SHORT_URL_POOL_LOW_WATER'] = 5
+        self.app.config['SHORT_URL_POOL_REFILL_BATCH'] = 10
+        code_allocator.init_app(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(first_name='ichiato', last_name='ikikin',
+                         email='ichiato@yahoo.com', password='password')
+        self.user.save()
+
+    def tearDown(self):
+        """Delete app and db instances after each test case."""
+        code_allocator.pool.stop()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_generated_codes_are_unused(self):
+        """Test that codes already in use are never pooled."""
+        code_allocator.pool.length = 1
+        for code in 'abcdefghij':
+            UrlSaver.generate_and_save_urls('http://www.andela.com/' + code,
+                                            self.user, code)
+        codes = code_allocator.pool.generate(500)
+        self.assertTrue(codes)
+        self.assertFalse(set(codes) & set('abcdefghij'))
+
+    def test_refill(self):
+        """Test that the pool is topped up to its size."""
+        code_allocator.pool.refill()
+        self.assertEqual(code_allocator.stats()['size'], 20)
+        self.assertEqual(code_allocator.stats()['refills'], 2)
+
+    def test_empty_pool_falls_back(self):
+        """Test that shortening works while the pool is still empty."""
+        short_url = UrlSaver.generate_and_save_urls('http://www.andela.com',
+                                                    self.user)
+        self.assertEqual(len(short_url.url), 6)
+        self.assertEqual(code_allocator.stats()['fallbacks'], 1)
+
+    def test_pop_from_pool(self):
+        """Test that shortening pops codes from a filled pool."""
+        code_allocator.pool.refill()
+        code_allocator.pool.start()
+        codes = [UrlSaver.generate_and_save_urls(
+            'http://www.andela.com/%d' % i, self.user).url for i in range(5)]
+        self.assertEqual(len(set(codes)), 5)
+        stats = code_allocator.stats()
+        self.assertEqual(stats['popped'], 5)
+        self.assertEqual(stats['fallbacks'], 0)
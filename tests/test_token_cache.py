@@ -0,0 +1,110 @@
+"""Test caching verified tokens and the users they identify."""
+import unittest
+
+from app import create_app, db, token_cache
+from app.models import User
+
+
+class TokenCacheTestCase(unittest.TestCase):
+    """Test the token cache in front of token authentication."""
+
+    def setUp(self):
+        """Setup app for testing before each test case."""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(first_name='ichiato', last_name='ikikin',
+                         email='ichiato@yahoo.com', password='password')
+        self.user.save()
+        self.token = self.user.generate_auth_token(60).decode('ascii')
+        self.statements = []
+        db.event.listen(db.engine, 'before_cursor_execute', self.count)
+
+    def tearDown(self):
+        """Delete app and db instances after each test case."""
+        db.event.remove(db.engine, 'before_cursor_execute', self.count)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def count(self, connection, cursor, statement, *args):
+        """Record the statements sent to the database."""
+        self.statements.append(statement)
+
+    def verify(self):
+        """Verify the token in a new session."""
+        db.session.remove()
+        return User.verify_auth_token(self.token)
+
+    def test_cached_token_skips_query(self):
+        """Test that a verified token is served from the cache."""
+        self.assertEqual(self.verify().email, 'ichiato@yahoo.com')
+        self.statements = []
+        user = self.verify()
+        self.assertEqual(self.statements, [])
+        self.assertIn(user, db.session)
+        self.assertEqual((user.id, user.first_name),
+                         (self.user.id, 'ichiato'))
+        stats = token_cache.stats()
+        self.assertEqual(stats['tokens']['hits'], 1)
+        self.assertEqual(stats['users']['hits'], 1)
+
+    def test_changed_user_is_reloaded(self):
+        """Test that users are dropped from the cache when they change."""
+        self.verify()
+        user = User.query.get(self.user.id)
+        user.password = 'secret'
+        user.last_name = 'obi'
+        db.session.commit()
+        self.assertEqual(token_cache.stats()['users']['size'], 0)
+        user = self.verify()
+        self.assertEqual(user.last_name, 'obi')
+        self.assertTrue(user.verify_password('secret'))
+
+    def test_counted_short_urls_keep_user_cached(self):
+        """Test that updates of other columns keep the user cached."""
+        user = self.verify()
+        user.count_short_urls(2)
+        db.session.commit()
+        self.assertEqual(token_cache.stats()['users']['size'], 1)
+        self.statements = []
+        user = self.verify()
+        self.assertEqual(self.statements, [])
+        self.assertEqual(user.short_url_count, 2)
+
+    def test_change_during_load_is_not_cached(self):
+        """Test that a user changed while it was read is not cached."""
+        def change(connection, cursor, statement, *args):
+            if statement.startswith('SELECT') and 'users' in statement:
+                token_cache.invalidate(self.user.id)
+        db.event.listen(db.engine, 'before_cursor_execute', change)
+        try:
+            self.assertEqual(self.verify().email, 'ichiato@yahoo.com')
+        finally:
+            db.event.remove(db.engine, 'before_cursor_execute', change)
+        self.assertEqual(token_cache.stats()['users']['size'], 0)
+        self.verify()
+        self.assertEqual(token_cache.stats()['users']['size'], 1)
+
+    def test_deleted_user(self):
+        """Test that the token of a deleted user identifies nobody."""
+        self.verify()
+        db.session.delete(User.query.get(self.user.id))
+        db.session.commit()
+        self.assertIsNone(self.verify())
+
+    def test_invalid_tokens_are_not_cached(self):
+        """Test that invalid and expired tokens are rejected every time."""
+        expired = self.user.generate_auth_token(-1).decode('ascii')
+        for token in (self.token + 'x', expired, expired):
+            self.assertIsNone(User.verify_auth_token(token))
+        self.assertEqual(token_cache.stats()['tokens']['size'], 0)
+
+    def test_disabled(self):
+        """Test that every token is verified when the cache is disabled."""
+        self.app.config['TOKEN_CACHE_ENABLED'] = False
+        self.verify()
+        self.statements = []
+        self.assertEqual(self.verify().email, 'ichiato@yahoo.com')
+        self.assertEqual(len(self.statements), 1)
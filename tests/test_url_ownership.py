@@ -0,0 +1,107 @@
+"""Test the lookup of short_urls owned by the requesting user."""
+from base64 import b64encode
+import json
+import unittest
+
+from flask import url_for
+from sqlalchemy import event
+
+from app import create_app, db
+from app.helper import UrlSaver
+from app.models import ShortUrl, User
+
+
+class UrlOwnershipTestCase(unittest.TestCase):
+    """Test that management endpoints only touch the requested short_url."""
+
+    def setUp(self):
+        """Setup app for testing before each test case."""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client(use_cookies=True)
+        self.user = User(first_name='ichiato', last_name='ikikin',
+                         email='ichiato@yahoo.com', password='password')
+        self.user.save()
+        self.other_user = User(first_name='ada', last_name='obi',
+                               email='ada@yahoo.com', password='password')
+        self.other_user.save()
+        self.short_urls = [UrlSaver.generate_and_save_urls(
+            'http://www.andela.com/%d' % number, self.user)
+            for number in range(20)]
+        self.other_short_url = UrlSaver.generate_and_save_urls(
+            'http://www.google.com', self.other_user)
+        self.loaded = []
+        event.listen(ShortUrl, 'load', self.count_load)
+
+    def tearDown(self):
+        """Delete app and db instances after each test case."""
+        event.remove(ShortUrl, 'load', self.count_load)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def count_load(self, target, context):
+        """Record every short_url loaded from the database."""
+        self.loaded.append(target.id)
+
+    def request(self, method, endpoint, id, data=None):
+        """Send a request as the owner of the short_urls."""
+        token = self.user.generate_auth_token(60).decode('ascii')
+        headers = {'Authorization': 'Basic ' + b64encode(
+                   (token + ':').encode('utf-8')).decode('utf-8'),
+                   'Accept': 'application/json',
+                   'Content-Type': 'application/json'}
+        db.session.remove()
+        self.loaded = []
+        return getattr(self.client, method)(
+            url_for(endpoint, id=id), headers=headers,
+            data=json.dumps(data) if data else None)
+
+    def test_find_owned(self):
+        """Test that short_urls are only found for their owner."""
+        short_url = self.short_urls[3]
+        self.assertEqual(ShortUrl.find_owned(short_url.id, self.user.id),
+                         short_url)
+        self.assertIsNone(ShortUrl.find_owned(short_url.id,
+                                              self.other_user.id))
+        short_url.deleted = True
+        db.session.commit()
+        self.assertIsNone(ShortUrl.find_owned(short_url.id, self.user.id,
+                                              include_deleted=False))
+
+    def test_only_the_requested_short_url_is_loaded(self):
+        """Test that the owner's other short_urls are not loaded."""
+        id = self.short_urls[5].id
+        for method, endpoint in (('get', 'api.get_short_url'),
+                                 ('get', 'api.get_short_url_visit_log'),
+                                 ('put', 'api.toggle_is_active'),
+                                 ('delete', 'api.delete_urls')):
+            self.request(method, endpoint, id)
+            self.assertEqual(self.loaded, [id], endpoint)
+
+    def test_short_urls_of_other_users(self):
+        """Test that other users' short_urls are reported as missing."""
+        id = self.other_short_url.id
+        for method, endpoint in (('get', 'api.get_short_url'),
+                                 ('get', 'api.get_short_url_visit_log'),
+                                 ('put', 'api.toggle_is_active'),
+                                 ('delete', 'api.delete_urls')):
+            response = self.request(method, endpoint, id)
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(json.loads(response.data.decode('utf-8')),
+                             {'error': 'Resource not found. You do not have'
+                              ' any such URL.'})
+        response = self.request('put', 'api.change_long_url', id,
+                                {'url': 'http://www.python.org'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_change_long_url_of_deleted_short_url(self):
+        """Test that deleted short_urls cannot be retargeted."""
+        self.short_urls[0].deleted = True
+        db.session.commit()
+        response = self.request('put', 'api.change_long_url',
+                                self.short_urls[0].id,
+                                {'url': 'http://www.python.org'})
+        self.assertEqual(response.status_code, 404)
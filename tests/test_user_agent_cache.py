@@ -0,0 +1,82 @@
+"""Test memoizing the User-Agent parsing of the visit path."""
+import unittest
+
+from flask import url_for
+
+from app import create_app, db, user_agent_cache
+from app.fastpath import RedirectMiddleware
+from app.helper import UrlSaver
+from app.models import UrlActivityLogs, User
+
+
+class UserAgentCacheTestCase(unittest.TestCase):
+    """Test memoizing the User-Agent parsing of the visit path."""
+
+    chrome = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+              '(KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.36')
+
+    def setUp(self):
+        """Setup app for testing before each test case."""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client(use_cookies=True)
+        user = User(first_name='ichiato', last_name='ikikin',
+                    email='ichiato@yahoo.com', password='password')
+        user.save()
+        self.short_url = UrlSaver.generate_and_save_urls(
+            'http://www.andela.com', user)
+
+    def tearDown(self):
+        """Delete app and db instances after each test case."""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_parse_is_cached(self):
+        """Test that each distinct header is parsed once."""
+        for _ in range(3):
+            parsed = user_agent_cache.parse(self.chrome)
+        self.assertEqual(parsed, ('chrome', 'windows', '58.0.3029.110'))
+        self.assertEqual(user_agent_cache.parse('curl/7.54'),
+                         (None, None, None))
+        stats = user_agent_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']),
+                         (2, 2, 2))
+        self.assertAlmostEqual(stats['hit_ratio'], 0.5)
+
+    def test_visits_are_logged_with_parsed_agent(self):
+        """Test that redirects log the cached browser and platform."""
+        for user_agent in (self.chrome, self.chrome, 'curl/7.54'):
+            self.client.get(url_for('api.get_url',
+                                    shorturl=self.short_url.url),
+                            environ_base={'HTTP_USER_AGENT': user_agent})
+        logs = UrlActivityLogs.query.order_by(UrlActivityLogs.id).all()
+        self.assertEqual([(x.browser, x.platform) for x in logs],
+                         [('chrome', 'windows'), ('chrome', 'windows'),
+                          ('curl/7.54', None)])
+        self.assertEqual(user_agent_cache.stats()['hits'], 1)
+
+    def test_unrecognized_user_agent_is_truncated(self):
+        """Test that an unrecognized header is logged up to the name length."""
+        user_agent = 'scanner/' + 'x' * 300
+        self.client.get(url_for('api.get_url', shorturl=self.short_url.url),
+                        environ_base={'HTTP_USER_AGENT': user_agent})
+        log = UrlActivityLogs.query.one()
+        self.assertEqual((log.browser, log.platform),
+                         (user_agent[:255], None))
+
+    def test_missing_user_agent_is_redirected(self):
+        """Test that a visit without a User-Agent header is logged bare."""
+        path = url_for('api.get_url', shorturl=self.short_url.url)
+        # environ_base replaces the User-Agent the test client sends.
+        no_user_agent = {'REMOTE_ADDR': '10.0.0.1'}
+        response = self.client.get(path, environ_base=no_user_agent)
+        self.assertEqual(response.status_code, 302)
+        self.app.wsgi_app = RedirectMiddleware(self.app)
+        response = self.client.get(path, environ_base=no_user_agent)
+        self.assertEqual(response.status_code, 302)
+        logs = UrlActivityLogs.query.all()
+        self.assertEqual([(x.browser, x.platform) for x in logs],
+                         [(None, None), (None, None)])
@@ -0,0 +1,162 @@
+"""Test the write-behind aggregation of visit counters."""
+import unittest
+
+from flask import url_for
+
+from app import create_app, db, visit_counter
+from app.counters import CounterAccumulator
+from app.helper import UrlSaver
+from app.models import LongUrl, ShortUrl, User, VisitCountShard
+
+
+class VisitCounterTestCase(unittest.TestCase):
+    """Test coalescing and flushing of visit counts."""
+
+    def setUp(self):
+        """Setup app for testing before each test case."""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client(use_cookies=True)
+        self.user = User(first_name='ichiato', last_name='ikikin',
+                         email='ichiato@yahoo.com', password='password')
+        self.user.save()
+        self.short_url = UrlSaver.generate_and_save_urls(
+            'http://www.andela.com', self.user)
+        self.app.config['VISIT_COUNTER_WRITE_BEHIND'] = True
+        self.app.config['VISIT_COUNTER_FLUSH_INTERVAL'] = 3600
+        self.accumulator = CounterAccumulator(self.app)
+
+    def tearDown(self):
+        """Delete app and db instances after each test case."""
+        self.accumulator.stop()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def visits(self):
+        """Return the persisted visits of the short_url and its long_url."""
+        db.session.expire_all()
+        return (ShortUrl.query.get(1).no_of_visits,
+                LongUrl.query.get(1).no_of_visits)
+
+    def test_increments_are_coalesced_until_flushed(self):
+        """Test that visits are only written when flushed."""
+        for _ in range(3):
+            self.accumulator.incr(1, 1)
+        self.assertEqual(self.visits(), (0, 0))
+        self.assertEqual(self.accumulator.pending(), 2)
+        self.accumulator.flush()
+        self.assertEqual(self.visits(), (3, 3))
+        self.assertEqual(self.accumulator.stats()['flushes'], 1)
+
+    def test_flush_on_shutdown(self):
+        """Test that stopping the flusher writes the pending visits."""
+        self.accumulator.incr(1, 1)
+        self.accumulator.stop()
+        self.assertEqual(self.visits(), (1, 1))
+
+    def test_discard(self):
+        """Test that a reset short_url drops its pending visits."""
+        self.accumulator.incr(1, 1)
+        self.accumulator.discard(1)
+        self.accumulator.flush()
+        self.assertEqual(self.visits(), (0, 1))
+
+    def test_redirect_counts_visits(self):
+        """Test that following a short_url counts a visit."""
+        self.client.get(url_for('api.get_url', shorturl=self.short_url.url))
+        self.client.get(url_for('api.get_url', shorturl=self.short_url.url))
+        self.assertEqual(self.visits(), (2, 2))
+
+
+class ShardedVisitCounterTestCase(unittest.TestCase):
+    """Test counting visits in shards and compacting them."""
+
+    def setUp(self):
+        """Setup app for testing before each test case."""
+        self.app = create_app('testing')
+        self.app.config['VISIT_COUNTER_SHARDS'] = 4
+        self.app.config['VISIT_COUNTER_COMPACT_INTERVAL'] = 3600
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(first_name='ichiato', last_name='ikikin',
+                         email='ichiato@yahoo.com', password='password')
+        self.user.save()
+        self.short_url = UrlSaver.generate_and_save_urls(
+            'http://www.andela.com', self.user)
+        self.accumulator = CounterAccumulator(self.app)
+
+    def tearDown(self):
+        """Delete app and db instances after each test case."""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def count(self, visits):
+        """Count visits of the short_url, one flush per visit."""
+        for _ in range(visits):
+            self.accumulator.incr(1, 1)
+
+    def test_visits_are_spread_over_shards(self):
+        """Test that flushes land in shards, not in no_of_visits."""
+        self.count(40)
+        shards = VisitCountShard.query.filter_by(table_name='short_url').all()
+        self.assertGreater(len(shards), 1)
+        self.assertLessEqual(len(shards), 4)
+        self.assertEqual(sum(shard.visits for shard in shards), 40)
+        self.assertEqual(ShortUrl.query.get(1).no_of_visits, 0)
+        self.assertEqual(self.accumulator.visits('short_url', [1]), {1: 40})
+        self.assertEqual(self.accumulator.visits('long_url', [1]), {1: 40})
+
+    def test_compaction(self):
+        """Test that compaction moves the shards into no_of_visits."""
+        self.count(10)
+        self.assertGreater(self.accumulator.compact(), 0)
+        db.session.expire_all()
+        self.assertEqual(ShortUrl.query.get(1).no_of_visits, 10)
+        self.assertEqual(LongUrl.query.get(1).no_of_visits, 10)
+        self.assertEqual(self.accumulator.visits('short_url', [1]), {1: 0})
+        self.count(5)
+        self.accumulator._dirty.clear()
+        self.assertEqual(self.accumulator.compact(), 0)
+        self.accumulator.compact(everything=True)
+        db.session.expire_all()
+        self.assertEqual(ShortUrl.query.get(1).no_of_visits, 15)
+
+    def test_periodic_sweep_compacts_every_shard(self):
+        """Test that shards left by another worker are compacted too."""
+        self.count(4)
+        other = CounterAccumulator(self.app)
+        other._compact_if_due()
+        self.assertEqual(other.compactions, 0)
+        other._swept_at -= self.app.config['VISIT_COUNTER_SWEEP_INTERVAL']
+        other._compact_if_due()
+        self.assertEqual(other.compactions, 1)
+        db.session.expire_all()
+        self.assertEqual(ShortUrl.query.get(1).no_of_visits, 4)
+        self.assertEqual(LongUrl.query.get(1).no_of_visits, 4)
+        self.assertEqual(self.accumulator.visits('short_url', [1]), {1: 0})
+
+    def test_discard_zeroes_shards(self):
+        """Test that resetting a short_url also clears its shards."""
+        self.count(3)
+        self.accumulator.discard(1)
+        self.assertEqual(self.accumulator.visits('short_url', [1]), {1: 0})
+        self.assertEqual(self.accumulator.visits('long_url', [1]), {1: 3})
+
+    def test_reads_sum_the_shards(self):
+        """Test that the reported visits include the shards."""
+        self.app.extensions['visit_counter'] = self.accumulator
+        self.count(2)
+        self.accumulator.compact()
+        self.count(3)
+        db.session.expire_all()
+        self.assertEqual(visit_counter.totals([ShortUrl.query.get(1)]),
+                         {1: 5})
+        url_list, _ = ShortUrl.sort_shorturl_by_popularity(10)
+        self.assertEqual(url_list[0]['Times_visted'], 5)
+        url_list, _ = LongUrl.sort_longurl_by_popularity(10)
+        self.assertEqual(url_list[0]['Times_visted'], 5)
@@ -0,0 +1,146 @@
+"""Test paging, filtering and exporting the logs of a short_url."""
+from base64 import b64encode
+import csv
+from datetime import datetime, timedelta
+import io
+import json
+import unittest
+
+from flask import url_for
+
+from app import create_app, db
+from app.activity import LogQueue
+from app.helper import UrlSaver
+from app.models import UrlActivityLogs, User, pack_ip
+
+
+class VisitLogApiTestCase(unittest.TestCase):
+    """Test the logs endpoint over many logged visits."""
+
+    def setUp(self):
+        """Setup app for testing before each test case."""
+        self.app = create_app('testing')
+        self.app.config['VISIT_LOG_EXPORT_CHUNK_SIZE'] = 4
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client(use_cookies=True)
+        self.user = User(first_name='ichiato', last_name='ikikin',
+                         email='ichiato@yahoo.com', password='password')
+        self.user.save()
+        self.short_url = UrlSaver.generate_and_save_urls(
+            'http://www.andela.com', self.user)
+        token = self.user.generate_auth_token(60).decode('ascii')
+        self.token_header = {
+            'Authorization': 'Basic ' + b64encode(
+                (token + ':').encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json'
+        }
+        self.started = datetime(2017, 5, 1)
+        LogQueue(self.app).write([
+            {'short_url_id': self.short_url.id, 'ip': '10.0.0.%d' % number,
+             'browser': 'chrome', 'platform': 'windows',
+             'visited_at': self.started + timedelta(hours=number)}
+            for number in range(10)])
+
+    def tearDown(self):
+        """Delete app and db instances after each test case."""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get_logs(self, **args):
+        """Get the logs of the short_url."""
+        return self.client.get(url_for('api.get_short_url_visit_log',
+                                       id=self.short_url.id, **args),
+                               headers=self.token_header)
+
+    def get_json(self, **args):
+        """Get the logs of the short_url as JSON."""
+        response = self.get_logs(**args)
+        return response.status_code, json.loads(response.data.decode('utf-8'))
+
+    def test_pages(self):
+        """Test reading the logs latest first a page at a time."""
+        ips, after = [], None
+        while True:
+            args = {'limit': 3}
+            if after:
+                args['after'] = after
+            status, page = self.get_json(**args)
+            self.assertEqual(status, 200)
+            self.assertLessEqual(len(page['short_url logs']), 3)
+            ips.extend(x['I.P Address'] for x in page['short_url logs'])
+            after = page['next']
+            if after is None:
+                break
+        self.assertEqual(ips, ['10.0.0.%d' % x for x in range(9, -1, -1)])
+
+    def test_logs_without_visit_time_come_last(self):
+        """Test that logs older than visit times are paged after the rest."""
+        db.session.execute(UrlActivityLogs.__table__.insert(), [
+            {'short_url_id': self.short_url.id,
+             'packed_ip': pack_ip('10.0.1.%d' % number), 'visited_at': None}
+            for number in range(4)])
+        db.session.commit()
+        ips, after = [], None
+        while True:
+            args = {'limit': 3}
+            if after:
+                args['after'] = after
+            status, page = self.get_json(**args)
+            self.assertEqual(status, 200)
+            ips.extend(x['I.P Address'] for x in page['short_url logs'])
+            after = page['next']
+            if after is None:
+                break
+        self.assertEqual(ips, ['10.0.0.%d' % x for x in range(9, -1, -1)] +
+                         ['10.0.1.%d' % x for x in range(3, -1, -1)])
+        status, page = self.get_json(**{'from': '2017-05-01'})
+        self.assertEqual(len(page['short_url logs']), 10)
+        response = self.get_logs(format='ndjson')
+        lines = response.data.decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 14)
+        self.assertIsNone(json.loads(lines[-1])['Visited at'])
+
+    def test_time_range(self):
+        """Test that only the logs from and before to are returned."""
+        status, page = self.get_json(**{'from': '2017-05-01T02:00',
+                                        'to': '2017-05-01T05:00'})
+        self.assertEqual(status, 200)
+        self.assertEqual([x['Visited at'] for x in page['short_url logs']],
+                         ['2017-05-01T04:00:00', '2017-05-01T03:00:00',
+                          '2017-05-01T02:00:00'])
+        status, page = self.get_json(**{'from': '2017-06-01'})
+        self.assertEqual(status, 200)
+        self.assertEqual(page['short_url logs'], [])
+
+    def test_ndjson_export(self):
+        """Test streaming every log in the range as NDJSON."""
+        response = self.get_logs(format='ndjson', **{'to': '2017-05-01T07:00'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertTrue(response.is_streamed)
+        lines = response.data.decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line)['I.P Address'] for line in lines],
+                         ['10.0.0.%d' % x for x in range(6, -1, -1)])
+
+    def test_csv_export(self):
+        """Test streaming every log as CSV."""
+        response = self.get_logs(format='csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/csv')
+        rows = list(csv.DictReader(io.StringIO(
+            response.data.decode('utf-8'))))
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(rows[0], {'I.P Address': '10.0.0.9',
+                                   'User agent': 'chrome',
+                                   'System platform': 'windows',
+                                   'Visited at': '2017-05-01T09:00:00'})
+
+    def test_invalid_arguments(self):
+        """Test that invalid formats, cursors and times are rejected."""
+        for args in ({'format': 'xml'}, {'after': 'nonsense'},
+                     {'from': 'yesterday'}, {'limit': 0}):
+            status, _ = self.get_json(**args)
+            self.assertEqual(status, 400)
@@ -0,0 +1,112 @@
+"""Test the visit rollups and the stats endpoint reading them."""
+from base64 import b64encode
+from datetime import datetime
+import json
+import unittest
+
+from flask import url_for
+
+from app import create_app, db
+from app.activity import LogQueue
+from app.helper import UrlSaver
+from app.models import User, VisitRollupDaily, VisitRollupHourly
+from app.rollups import bucket_start
+
+
+class VisitRollupTestCase(unittest.TestCase):
+    """Test rolling up logged visits and reading the rollups."""
+
+    def setUp(self):
+        """Setup app for testing before each test case."""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client(use_cookies=True)
+        self.user = User(first_name='ichiato', last_name='ikikin',
+                         email='ichiato@yahoo.com', password='password')
+        self.user.save()
+        self.short_url = UrlSaver.generate_and_save_urls(
+            'http://www.andela.com', self.user)
+        self.queue = LogQueue(self.app)
+        token = self.user.generate_auth_token(60).decode('ascii')
+        self.token_header = {
+            'Authorization': 'Basic ' + b64encode(
+                (token + ':').encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json'
+        }
+
+    def tearDown(self):
+        """Delete app and db instances after each test case."""
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def log(self, visited_at, browser='chrome', platform='windows'):
+        """Write the log of a visit to the short_url."""
+        self.queue.write([{'short_url_id': self.short_url.id,
+                           'ip': '127.0.0.1', 'browser': browser,
+                           'platform': platform, 'visited_at': visited_at}])
+
+    def get_stats(self, **args):
+        """Get the stats of the short_url."""
+        response = self.client.get(url_for('api.get_short_url_stats',
+                                           id=self.short_url.id, **args),
+                                   headers=self.token_header)
+        return response.status_code, json.loads(response.data.decode('utf-8'))
+
+    def test_bucket_start(self):
+        """Test truncating times to their hour and day."""
+        moment = datetime(2017, 5, 1, 12, 30, 15)
+        self.assertEqual(bucket_start(moment, 'hour'),
+                         datetime(2017, 5, 1, 12))
+        self.assertEqual(bucket_start(moment, 'day'), datetime(2017, 5, 1))
+
+    def test_logs_are_rolled_up(self):
+        """Test that writing logs updates both rollups incrementally."""
+        self.log(datetime(2017, 5, 1, 12, 10))
+        self.log(datetime(2017, 5, 1, 12, 50))
+        self.log(datetime(2017, 5, 1, 13, 5), browser='firefox',
+                 platform=None)
+        hourly = VisitRollupHourly.query.order_by(
+            VisitRollupHourly.bucket).all()
+        self.assertEqual([(x.bucket.hour, x.browser, x.platform, x.visits)
+                          for x in hourly],
+                         [(12, 'chrome', 'windows', 2),
+                          (13, 'firefox', 'unknown', 1)])
+        self.assertEqual(sorted(x.visits for x in
+                                VisitRollupDaily.query.all()), [1, 2])
+
+    def test_stats(self):
+        """Test the totals per bucket, platform and browser."""
+        self.log(datetime(2017, 5, 1, 12, 10))
+        self.log(datetime(2017, 5, 2, 8, 0), browser='firefox')
+        self.log(datetime(2017, 5, 9, 8, 0))
+        status, stats = self.get_stats(**{'from': '2017-05-01',
+                                          'to': '2017-05-03'})
+        self.assertEqual(status, 200)
+        self.assertEqual(stats['total'], 2)
+        self.assertEqual(stats['buckets'], [
+            {'start': '2017-05-01T00:00:00', 'visits': 1},
+            {'start': '2017-05-02T00:00:00', 'visits': 1}])
+        self.assertEqual(stats['browsers'], {'chrome': 1, 'firefox': 1})
+        self.assertEqual(stats['platforms'], {'windows': 2})
+        _, stats = self.get_stats(granularity='hour',
+                                  **{'from': '2017-05-01T12:00',
+                                     'to': '2017-05-01T13:00'})
+        self.assertEqual(stats['total'], 1)
+
+    def test_redirects_are_rolled_up(self):
+        """Test that following a short_url shows up in the stats."""
+        self.client.get(url_for('api.get_url', shorturl=self.short_url.url))
+        status, stats = self.get_stats()
+        self.assertEqual(stats['total'], 1)
+
+    def test_invalid_arguments(self):
+        """Test that invalid granularities and ranges are rejected."""
+        for args in ({'granularity': 'week'}, {'from': 'yesterday'},
+                     {'from': '2017-05-02', 'to': '2017-05-01'},
+                     {'granularity': 'hour', 'from': '2017-01-01',
+                      'to': '2017-05-01'}):
+            status, _ = self.get_stats(**args)
+            self.assertEqual(status, 400)